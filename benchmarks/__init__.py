@@ -0,0 +1,2 @@
+from .synthetic_match import SyntheticMatch, StubDetector
+from .accuracy import score_tracks, score_detections
@@ -0,0 +1,157 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from utils import get_bbox_iou
+
+
+def score_tracks(match, frames, min_iou=0.5):
+    """
+    Compare the output of a pipeline run with the ground truth of a
+    SyntheticMatch.
+    Args:
+        match: The SyntheticMatch that was analysed.
+        frames: Per-frame dicts with the finalized 'players' and 'ball'
+            tracks and the 'camera_movement' of every frame, in order.
+        min_iou: Overlap a player track needs with a true box to count as
+            detecting it.
+
+    Returns:
+        Dict with:
+            player_recall / player_precision: Fraction of true / reported
+                player boxes matched one to one.
+            id_switches: Number of times a true player's matched track id
+                changed.
+            team_accuracy: Fraction of matched players in the right team;
+                team labels are arbitrary, so the better of the two
+                labellings is taken.
+            ball_coverage: Fraction of frames with a ball position,
+                detected or interpolated.
+            ball_error_px: Mean distance between reported and true ball
+                centers.
+            camera_error_px: Mean absolute error of the camera movement.
+    """
+    is_player = match.object_class == 2
+    true_positives = false_positives = false_negatives = id_switches = 0
+    last_track = {}
+    teams = []
+    ball_errors = []
+    camera_errors = []
+
+    for frame_num, frame in enumerate(frames):
+        truth = match.boxes[frame_num][is_player]
+        truth_ids = np.flatnonzero(is_player)
+        track_ids = list(frame['players'])
+        predicted = np.array([frame['players'][track_id]['bbox'] for track_id in track_ids],
+                             dtype=np.float64).reshape(-1, 4)
+
+        matched = []
+        if len(truth) and len(predicted):
+            iou = get_bbox_iou(truth, predicted)
+            rows, cols = linear_sum_assignment(-iou)
+            matched = [(row, col) for row, col in zip(rows, cols) if iou[row, col] >= min_iou]
+        true_positives += len(matched)
+        false_negatives += len(truth) - len(matched)
+        false_positives += len(predicted) - len(matched)
+
+        for row, col in matched:
+            object_id = truth_ids[row]
+            track_id = track_ids[col]
+            if last_track.get(object_id, track_id) != track_id:
+                id_switches += 1
+            last_track[object_id] = track_id
+            team_id = frame['players'][track_id].get('team_id')
+            if team_id is not None:
+                teams.append((match.team[object_id], team_id))
+
+        ball = frame['ball'].get(1)
+        if ball is not None:
+            center = np.reshape(ball['bbox'], (2, 2)).mean(axis=0)
+            true_center = match.ball_boxes[frame_num].reshape(2, 2).mean(axis=0)
+            ball_errors.append(np.linalg.norm(center - true_center))
+        camera_errors.append(np.abs(np.subtract(frame['camera_movement'], match.camera_movement[frame_num])).mean())
+
+    team_accuracy = 0.0
+    if teams:
+        true_team, team_id = np.array(teams).T
+        same = np.mean(true_team == team_id)
+        team_accuracy = max(same, 1 - same)
+
+    return {
+        'player_recall': round(true_positives / max(true_positives + false_negatives, 1), 4),
+        'player_precision': round(true_positives / max(true_positives + false_positives, 1), 4),
+        'id_switches': id_switches,
+        'team_accuracy': round(float(team_accuracy), 4),
+        'ball_coverage': round(len(ball_errors) / max(len(frames), 1), 4),
+        'ball_error_px': round(float(np.mean(ball_errors)), 3) if ball_errors else None,
+        'camera_error_px': round(float(np.mean(camera_errors)), 3) if camera_errors else None,
+    }
+
+
+def score_detections(predictions, truths, iou_thresholds=np.linspace(0.5, 0.95, 10)):
+    """
+    COCO-style mean average precision of per-image detections.
+
+    Predictions are matched greedily, most confident first, to the unmatched
+    reference box of the same class they overlap most; AP is the 101-point
+    interpolated area under the precision-recall curve, averaged over the
+    classes that have reference boxes.
+    Args:
+        predictions: Per-image (xyxy, confidence, class_id) arrays.
+        truths: Per-image (xyxy, class_id) arrays of the reference boxes,
+            ground truth or another detector's output.
+        iou_thresholds: IoU thresholds averaged for 'map50_95'; the first
+            one gives 'map50'.
+
+    Returns:
+        Dict with 'map50', 'map50_95' and the per-class 'ap50'.
+    """
+    iou_thresholds = np.asarray(iou_thresholds)
+    confidences, classes, correct = [], [], []
+    true_counts = {}
+    for (xyxy, confidence, class_id), (true_xyxy, true_class) in zip(predictions, truths):
+        confidence = np.asarray(confidence, dtype=np.float64).reshape(-1)
+        class_id = np.asarray(class_id, dtype=int).reshape(-1)
+        true_class = np.asarray(true_class, dtype=int).reshape(-1)
+        for value in true_class:
+            true_counts[value] = true_counts.get(value, 0) + 1
+        order = np.argsort(-confidence, kind='stable')
+        iou = get_bbox_iou(np.reshape(xyxy, (-1, 4))[order], true_xyxy)
+        iou[class_id[order][:, None] != true_class[None, :]] = 0
+        hits = np.zeros((len(order), len(iou_thresholds)), dtype=bool)
+        for t, threshold in enumerate(iou_thresholds):
+            taken = np.zeros(len(true_class), dtype=bool)
+            for row in range(len(order)):
+                candidates = np.where(taken, -1.0, iou[row])
+                best = int(candidates.argmax()) if len(candidates) else -1
+                if best >= 0 and candidates[best] >= threshold:
+                    taken[best] = hits[row, t] = True
+        confidences.append(confidence[order])
+        classes.append(class_id[order])
+        correct.append(hits)
+
+    confidences = np.concatenate(confidences) if confidences else np.zeros(0)
+    classes = np.concatenate(classes) if classes else np.zeros(0, dtype=int)
+    correct = np.concatenate(correct) if correct else np.zeros((0, len(iou_thresholds)), dtype=bool)
+    recall_points = np.linspace(0, 1, 101)
+    ap = {}
+    for class_id, count in sorted(true_counts.items()):
+        rows = np.flatnonzero(classes == class_id)
+        rows = rows[np.argsort(-confidences[rows], kind='stable')]
+        true_positives = np.cumsum(correct[rows], axis=0)
+        recall = true_positives / count
+        precision = true_positives / np.arange(1, len(rows) + 1)[:, None]
+        values = []
+        for t in range(len(iou_thresholds)):
+            # precision envelope: the best precision at this recall or beyond
+            envelope = np.maximum.accumulate(np.concatenate([precision[:, t], [0.0]])[::-1])[::-1]
+            index = np.searchsorted(recall[:, t], recall_points, side='left')
+            values.append(envelope[index].mean())
+        ap[int(class_id)] = values
+
+    if not ap:
+        return {'map50': None, 'map50_95': None, 'ap50': {}}
+    ap_matrix = np.array(list(ap.values()))
+    return {
+        'map50': round(float(ap_matrix[:, 0].mean()), 4),
+        'map50_95': round(float(ap_matrix.mean()), 4),
+        'ap50': {class_id: round(float(values[0]), 4) for class_id, values in ap.items()},
+    }
@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.accuracy import score_detections
+from trackers import InferenceEngine, load_detector, export_detector
+from trackers.detector_backends import IMAGE_EXTENSIONS, load_calibration_frames
+
+BACKENDS = ('pytorch', 'onnx', 'onnx-int8', 'openvino', 'openvino-int8')
+
+
+def parse_backend(name):
+    """
+    Detector options of a backend name such as 'onnx' or 'openvino-int8'.
+    """
+    backend, _, precision = name.partition('-')
+    if precision not in ('', 'fp32', 'int8'):
+        raise ValueError(f'Unknown precision {precision!r} in {name!r}, expected fp32 or int8')
+    return {'backend': backend, 'int8': precision == 'int8'}
+
+
+def read_labels(path, width, height):
+    """
+    Boxes of a YOLO label file in pixels. A missing file is an image
+    without objects.
+
+    Returns:
+        (xyxy, class_id)
+    """
+    rows = np.zeros((0, 5))
+    if os.path.exists(path):
+        rows = np.loadtxt(path, ndmin=2).reshape(-1, 5) if os.path.getsize(path) else rows
+    center, size = rows[:, 1:3], rows[:, 3:5]
+    xyxy = np.concatenate([center - size / 2, center + size / 2], axis=1) * [width, height, width, height]
+    return xyxy, rows[:, 0].astype(int)
+
+
+def load_samples(data, labels=None, max_images=None):
+    """
+    Images to compare the detectors on.
+    Args:
+        data: A directory of images, a YOLO dataset split holding
+            images/ and labels/, or a video whose frames are sampled evenly.
+        labels: Directory of YOLO labels. Defaults to labels/ next to the
+            images; without labels only the agreement with the PyTorch
+            model is reported.
+        max_images: Use at most this many images.
+
+    Returns:
+        (images, truths) where truths is None without labels.
+    """
+    if not os.path.isdir(data):
+        return load_calibration_frames(data, max_images or 200), None
+    image_dir = os.path.join(data, 'images') if os.path.isdir(os.path.join(data, 'images')) else data
+    label_dir = labels or os.path.join(os.path.dirname(os.path.normpath(image_dir)), 'labels')
+    names = sorted(name for name in os.listdir(image_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+    images, truths = [], []
+    for name in names[:max_images]:
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is None:
+            continue
+        images.append(image)
+        height, width = image.shape[:2]
+        truths.append(read_labels(os.path.join(label_dir, os.path.splitext(name)[0] + '.txt'), width, height))
+    return images, (truths if os.path.isdir(label_dir) else None)
+
+
+def shape_batches(images, batch_size):
+    """
+    Consecutive batches of at most `batch_size` images of the same shape,
+    as the InferenceEngine expects.
+    """
+    batches = []
+    for image in images:
+        if batches and len(batches[-1]) < batch_size and batches[-1][0].shape == image.shape:
+            batches[-1].append(image)
+        else:
+            batches.append([image])
+    return batches
+
+
+def model_size_mb(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / (1 << 20)
+    return os.path.getsize(path) / (1 << 20)
+
+
+def run_backend(model_path, name, images, batch_size=1, conf=0.1, repeats=3, **options):
+    """
+    Detect every image with one backend and time it.
+
+    Images go through the InferenceEngine as in the pipelines, including
+    its downscaling, after one warm-up batch; the fastest of `repeats`
+    passes is reported.
+
+    Returns:
+        (detections, stats) with one (xyxy, confidence, class_id) per image
+        and a dict with the 'fps', the mean 'latency_ms' per batch, the
+        'export_s' and 'load_s' times and the 'model_mb' size.
+    """
+    detector = dict(parse_backend(name), **options)
+    start = time.perf_counter()
+    path = export_detector(model_path, **detector)
+    export_time = time.perf_counter() - start
+    model = load_detector(path, **dict(detector, int8=False))
+    load_time = time.perf_counter() - start - export_time
+
+    engine = InferenceEngine(model, conf=conf, batch_size=batch_size)
+    batches = shape_batches(images, batch_size)
+    engine.detect(batches[0])
+    best = None
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        detections = [detection for batch in batches for detection in engine.detect(batch)]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return [(d.xyxy, d.confidence, d.class_id) for d in detections], {
+        'fps': round(len(images) / best, 2),
+        'latency_ms': round(best / len(batches) * 1000, 2),
+        'export_s': round(export_time, 2),
+        'load_s': round(load_time, 2),
+        'model_mb': round(model_size_mb(path), 2),
+    }
+
+
+def compare_backends(model_path, backends, images, truths=None, batch_size=1, conf=0.1, repeats=3, **options):
+    """
+    Accuracy and speed of several detector backends on the same images.
+
+    With ground truth every backend gets its mAP against it; every backend
+    other than 'pytorch' also gets its mAP against the PyTorch detections
+    ('agreement_map50'), which shows what the export or the quantization
+    costs even without labels.
+
+    Returns:
+        One dict per backend with its 'backend', speed stats, 'speedup'
+        over 'pytorch' and accuracy metrics.
+    """
+    rows = []
+    reference = None
+    for name in backends:
+        detector_options = options if parse_backend(name)['backend'] != 'pytorch' else {}
+        detections, stats = run_backend(model_path, name, images, batch_size, conf, repeats, **detector_options)
+        row = dict({'backend': name}, **stats)
+        if truths is not None:
+            scores = score_detections(detections, truths)
+            row.update(map50=scores['map50'], map50_95=scores['map50_95'])
+        if name == 'pytorch':
+            reference = detections
+        elif reference is not None:
+            scores = score_detections(detections, [(xyxy, class_id) for xyxy, _, class_id in reference])
+            row.update(agreement_map50=scores['map50'], agreement_map50_95=scores['map50_95'])
+        rows.append(row)
+
+    baseline = next((row for row in rows if row['backend'] == 'pytorch'), None)
+    for row in rows:
+        row['speedup'] = round(row['fps'] / baseline['fps'], 2) if baseline else None
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the accuracy and speed of the detector backends.')
+    parser.add_argument('model', help='PyTorch weights, e.g. models/best.pt')
+    parser.add_argument('--data', required=True,
+                        help='images, a YOLO dataset split with images/ and labels/, or a video')
+    parser.add_argument('--labels', default=None, help='YOLO labels of the images, if not in labels/')
+    parser.add_argument('--backends', nargs='+', default=['pytorch', 'onnx', 'openvino'],
+                        help=f'any of {", ".join(BACKENDS)}')
+    parser.add_argument('--calibration', nargs='+', default=None,
+                        help='videos or image directories to calibrate INT8 on; defaults to --data')
+    parser.add_argument('--calibration-frames', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=None, help='inference threads of the exported models')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--conf', type=float, default=0.1, help='the pipelines use 0.1')
+    parser.add_argument('--max-images', type=int, default=None)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--force-export', action='store_true', help='export and quantize again')
+    parser.add_argument('--output', default=None, help='JSON file receiving the results')
+    args = parser.parse_args(argv)
+
+    images, truths = load_samples(args.data, args.labels, args.max_images)
+    if not images:
+        print(f'No images found in {args.data}')
+        return 1
+    options = {'calibration': args.calibration or args.data, 'calibration_frames': args.calibration_frames,
+               'force_export': args.force_export}
+    if args.threads:
+        options['threads'] = args.threads
+    rows = compare_backends(args.model, args.backends, images, truths, args.batch_size, args.conf, args.repeats,
+                            **options)
+
+    print(f'{len(images)} images, batch size {args.batch_size}' + ('' if truths is not None else ', no labels'))
+    columns = ['backend', 'fps', 'speedup', 'latency_ms', 'map50', 'map50_95', 'agreement_map50', 'model_mb']
+    print(' '.join(f'{column:>16}' for column in columns))
+    for row in rows:
+        print(' '.join(f'{str(row.get(column, "-")):>16}' for column in columns))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'images': len(images), 'batch_size': args.batch_size, 'conf': args.conf,
+                       'backends': rows}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
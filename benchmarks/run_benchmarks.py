@@ -0,0 +1,268 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.synthetic_match import SyntheticMatch, StubDetector
+from benchmarks.accuracy import score_tracks
+from pipeline import StreamingPipeline
+from utils import StageProfiler
+
+SCENARIOS = {
+    'smoke': {'num_frames': 96, 'size': (1280, 720), 'num_players': 14, 'seed': 0},
+    'broadcast': {'num_frames': 240, 'size': (1920, 1080), 'num_players': 22, 'seed': 1},
+}
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# metric: (better direction, tolerated change, relative or absolute)
+TOLERANCES = {
+    'fps': ('higher', 0.15, 'relative'),
+    'stage_fps': ('higher', 0.25, 'relative'),
+    'peak_rss_mb': ('lower', 0.20, 'relative'),
+    'player_recall': ('higher', 0.01, 'absolute'),
+    'player_precision': ('higher', 0.01, 'absolute'),
+    'id_switches': ('lower', 2, 'absolute'),
+    'team_accuracy': ('higher', 0.01, 'absolute'),
+    'ball_coverage': ('higher', 0.01, 'absolute'),
+    'ball_error_px': ('lower', 0.5, 'absolute'),
+    'camera_error_px': ('lower', 0.25, 'absolute'),
+}
+
+
+class RecordingPipeline(StreamingPipeline):
+    """
+    A StreamingPipeline that keeps the finalized tracks of every frame.
+    """
+    def process(self, frames, camera_frames=None):
+        self.recorded = []
+        yield from super().process(frames, camera_frames)
+
+    def finalize(self, pending, count):
+        for frame_num, frame in enumerate(super().finalize(pending, count)):
+            record = pending[frame_num]
+            self.recorded.append({'players': record['players'], 'ball': record['ball'],
+                                  'camera_movement': record['camera_movement']})
+            yield frame
+
+
+def run_scenario(name, config, work_dir, repeats=3, pipeline_options=None, seconds_per_frame=0.0):
+    """
+    Benchmark the streaming pipeline on one synthetic scenario.
+
+    The video is rendered once, then analysed `repeats` times with the stub
+    detector; the fastest run is reported. Unless `seconds_per_frame`
+    simulates a model, detection throughput covers the inference engine
+    around the model but not the model itself.
+    Args:
+        name: Scenario name, used for the file names.
+        config: SyntheticMatch arguments.
+        work_dir: Directory for the rendered and annotated videos.
+        repeats: Number of timed runs.
+        pipeline_options: Further StreamingPipeline arguments.
+        seconds_per_frame: Simulated model time per detected frame.
+
+    Returns:
+        Dict with the end-to-end 'fps', 'wall_time' and 'peak_rss_mb', the
+        per-stage 'stages' of the profile, the ground-truth 'accuracy' and
+        the fraction of frames that went through the detector.
+    """
+    match = SyntheticMatch(**config)
+    # renders are reused only for the same scenario and generator version
+    digest = hashlib.sha1(json.dumps([SyntheticMatch.version, config], sort_keys=True).encode()).hexdigest()[:12]
+    video_path = os.path.join(work_dir, f'{name}_{digest}.avi')
+    output_path = os.path.join(work_dir, f'{name}_{digest}_output.avi')
+    if not os.path.exists(video_path):
+        match.write_video(video_path)
+
+    best = None
+    for _ in range(max(1, repeats)):
+        profiler = StageProfiler()
+        pipeline = RecordingPipeline(None, profiler=profiler, **(pipeline_options or {}))
+        detector = StubDetector(match, seconds_per_frame=seconds_per_frame)
+        pipeline.tracker.inference_engine.model = detector
+        pipeline.run(video_path, output_path)
+        report = profiler.report()
+        if best is None or report['fps'] > best[0]['fps']:
+            keyframe_detector = pipeline.tracker.keyframe_detector
+            detected = 1.0
+            if keyframe_detector is not None:
+                detected = keyframe_detector.stats['keyframes'] / max(keyframe_detector.stats['frames'], 1)
+            best = report, pipeline.recorded, detected
+
+    report, recorded, detected = best
+    return {
+        'scenario': name,
+        'config': dict(config, size=list(config['size'])),
+        'frames': report['frames'],
+        'fps': report['fps'],
+        'wall_time': report['wall_time'],
+        'peak_rss_mb': report['peak_rss_mb'],
+        'stages': {stage['stage']: {key: stage[key] for key in ('fps', 'mean_ms', 'p95_ms', 'share')}
+                   for stage in report['stages']},
+        'accuracy': score_tracks(match, recorded),
+        'detected_fraction': round(detected, 4),
+    }
+
+
+def run_isolated(name, config, work_dir, repeats, pipeline_options=None, seconds_per_frame=0.0):
+    """
+    Run a scenario in a fresh process, so its peak memory is its own.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_scenario, name, config, work_dir, repeats, pipeline_options,
+                           seconds_per_frame).result()
+
+
+def sweep_keyframes(name, config, work_dir, intervals, repeats=1, seconds_per_frame=0.05, motion_scale=None,
+                    max_lost=None):
+    """
+    Accuracy against speed of keyframe detection at several intervals.
+
+    Every interval is run with a stub model that costs `seconds_per_frame`,
+    so the speedup reflects the detections saved on a CPU-bound deployment
+    with a model of that cost.
+
+    Returns:
+        One dict per interval with its 'fps', 'speedup' over the first
+        interval, 'detected_fraction' and ground-truth accuracy.
+    """
+    rows = []
+    for interval in intervals:
+        options = {'keyframe_interval': interval, 'keyframe_motion_scale': motion_scale,
+                   'keyframe_max_lost': max_lost}
+        result = run_isolated(name, config, work_dir, repeats, options, seconds_per_frame)
+        rows.append(dict({'interval': interval, 'fps': result['fps'],
+                          'speedup': round(result['fps'] / rows[0]['fps'], 2) if rows else 1.0,
+                          'detected_fraction': result['detected_fraction']}, **result['accuracy']))
+    return rows
+
+
+def flatten_metrics(result):
+    metrics = {'fps': result['fps'], 'peak_rss_mb': result['peak_rss_mb']}
+    metrics.update({f'stage_fps.{stage}': values['fps'] for stage, values in result['stages'].items()})
+    metrics.update(result['accuracy'])
+    return metrics
+
+
+def find_regressions(result, baseline):
+    """
+    Compare a scenario result with its baseline.
+
+    Returns:
+        List of messages, one per metric that got worse by more than its
+        tolerance in TOLERANCES.
+    """
+    current = flatten_metrics(result)
+    previous = baseline['metrics']
+    regressions = []
+    for metric, old in previous.items():
+        new = current.get(metric)
+        rule = TOLERANCES.get(metric.split('.')[0])
+        if rule is None or old is None or new is None:
+            continue
+        direction, tolerance, kind = rule
+        allowed = tolerance * abs(old) if kind == 'relative' else tolerance
+        change = new - old if direction == 'higher' else old - new
+        if change < -allowed:
+            regressions.append(f'{metric}: {old} -> {new} (tolerance {tolerance:g} {kind})')
+    return regressions
+
+
+def machine_id():
+    return f'{platform.node()} {platform.machine()} {platform.processor() or platform.system()}'.strip()
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic footage.')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--baselines', default=BASELINE_PATH)
+    parser.add_argument('--update-baselines', action='store_true',
+                        help='store the results as the new baselines instead of comparing with them')
+    parser.add_argument('--work-dir', default=None, help='where videos are rendered; a temporary directory by default')
+    parser.add_argument('--output', default=None, help='JSON file receiving the results')
+    parser.add_argument('--keyframe-sweep', nargs='+', type=int, metavar='INTERVAL',
+                        help='report accuracy against speed for these keyframe intervals instead')
+    parser.add_argument('--model-ms', type=float, default=50.0,
+                        help='simulated model time per detected frame in the keyframe sweep')
+    parser.add_argument('--keyframe-motion-scale', type=float, default=None)
+    parser.add_argument('--keyframe-max-lost', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    if args.keyframe_sweep:
+        return run_keyframe_sweep(args)
+
+    baselines = load_baselines(args.baselines)
+    results = {}
+    failed = False
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        for name in args.scenarios:
+            result = run_isolated(name, SCENARIOS[name], work_dir, args.repeats)
+            baseline = baselines.get(name)
+            result['regressions'] = find_regressions(result, baseline) if baseline else []
+            results[name] = result
+
+            print(f"{name}: {result['frames']} frames, {result['fps']} fps, peak rss {result['peak_rss_mb']} MiB")
+            print('  ' + ', '.join(f'{stage} {values["fps"]} fps' for stage, values in result['stages'].items()))
+            print('  ' + ', '.join(f'{metric} {value}' for metric, value in result['accuracy'].items()))
+            if baseline and baseline.get('machine') != machine_id():
+                print(f"  baseline was recorded on {baseline.get('machine')}; timings may not be comparable")
+            for message in result['regressions']:
+                print(f'  REGRESSION {message}')
+            failed |= bool(result['regressions'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baselines:
+        for name, result in results.items():
+            baselines[name] = {'machine': machine_id(), 'config': result['config'],
+                               'metrics': flatten_metrics(result)}
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f'Baselines written to {args.baselines}')
+        return 0
+    return 1 if failed else 0
+
+
+def run_keyframe_sweep(args):
+    sweeps = {}
+    columns = ['interval', 'fps', 'speedup', 'detected_fraction', 'player_recall', 'id_switches',
+               'team_accuracy', 'ball_coverage', 'ball_error_px']
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        for name in args.scenarios:
+            rows = sweep_keyframes(name, SCENARIOS[name], work_dir, args.keyframe_sweep, args.repeats,
+                                   args.model_ms / 1000, args.keyframe_motion_scale, args.keyframe_max_lost)
+            sweeps[name] = rows
+            print(f'{name} (model {args.model_ms:g} ms/frame)')
+            print('  ' + ' '.join(f'{column:>17}' for column in columns))
+            for row in rows:
+                print('  ' + ' '.join(f'{str(row[column]):>17}' for column in columns))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(sweeps, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+import time
+import cv2
+import numpy as np
+
+
+class SyntheticMatch:
+    """
+    A procedurally generated broadcast shot with exact ground truth.
+
+    Two teams of players in solid jerseys, a referee and a ball move over a
+    striped, textured pitch with an advertising board along the top, while
+    the camera pans left and right at a constant speed. Every trajectory is
+    drawn from `seed` when the match is created, so the same arguments
+    always give the same footage and ground truth; only `write_video`
+    renders pixels.
+
+    Ground truth, per frame `i`:
+        boxes[i]: (num_objects, 4) xyxy boxes of the players and referee.
+        ball_boxes[i]: xyxy box of the ball.
+        camera_movement[i]: [x, y] displacement of the scene since the
+            previous frame, in the convention of CameraMovementEstimator.
+    `object_class` and `team` give the class id and team (1 or 2, 0 for the
+    referee) of each object; object `k` has track id `k + 1` in the truth.
+
+    The frame number is drawn as a black and white barcode in the bottom
+    right corner, away from the players and the camera movement features,
+    so a detector can tell which frame it was given.
+    """
+    # bump when the rendering changes, so cached renders are not reused
+    version = 1
+    class_names = {0: 'ball', 1: 'goalkeeper', 2: 'player', 3: 'referee'}
+    team_colors = {1: (40, 40, 200), 2: (200, 130, 40)}
+    referee_color = (20, 220, 230)
+
+    def __init__(self, num_frames=240, size=(1920, 1080), num_players=22, pan_speed=8, pan_range=480,
+                 ball_miss_rate=0.1, seed=0):
+        """
+        Args:
+            num_frames: Length of the video.
+            size: (width, height) of the frames.
+            num_players: Number of players, split evenly between the teams.
+            pan_speed: Horizontal camera speed in pixels per frame. The
+                camera movement estimator ignores motion below 5 pixels.
+            pan_range: Pixels the camera travels before turning around.
+            ball_miss_rate: Fraction of frames in which the stub detector
+                misses the ball, exercising the ball interpolation.
+            seed: Seed of every random choice.
+        """
+        self.num_frames = num_frames
+        self.size = tuple(size)
+        self.num_players = num_players
+        self.pan_speed = pan_speed
+        self.pan_range = pan_range
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        width, height = self.size
+        self.scale = height / 1080
+        if width - pan_range < 200 * self.scale:
+            raise ValueError(f"Frames of width {width} are too narrow for a pan range of {pan_range}")
+
+        # triangle wave: constant speed, turning around every pan_range pixels
+        phase = (np.arange(num_frames) * pan_speed) % (2 * pan_range)
+        self.camera_offset = np.where(phase <= pan_range, phase, 2 * pan_range - phase).astype(np.float64)
+        self.camera_movement = np.zeros((num_frames, 2), dtype=np.float32)
+        self.camera_movement[1:, 0] = -np.diff(self.camera_offset)
+
+        self.object_class = np.array([2] * num_players + [3])
+        self.team = np.array([1 + k % 2 for k in range(num_players)] + [0])
+        object_size = np.array([30, 70]) * self.scale
+        # players stay inside the part of the pitch that is visible for the whole pan
+        low = np.array([pan_range + 20 * self.scale, 0.3 * height])
+        high = np.array([width - 20 * self.scale, 0.95 * height]) - object_size
+        position = self.random_walk(rng, len(self.object_class), low, high, max_speed=4 * self.scale)
+        self.boxes = np.concatenate([position, position + object_size], axis=2)
+        self.boxes[:, :, [0, 2]] -= self.camera_offset[:, None, None]
+
+        ball_size = 10 * self.scale
+        ball = self.random_walk(rng, 1, low, high + object_size - ball_size, max_speed=8 * self.scale)[:, 0]
+        self.ball_boxes = np.concatenate([ball, ball + ball_size], axis=1)
+        self.ball_boxes[:, [0, 2]] -= self.camera_offset[:, None]
+        self.ball_detected = rng.random(num_frames) >= ball_miss_rate
+
+        self.pitch = self.draw_pitch(rng, width + pan_range, height)
+        self.barcode_bits = max(1, (num_frames - 1).bit_length())
+        self.barcode_block = max(8, int(round(24 * self.scale)))
+
+    def random_walk(self, rng, count, low, high, max_speed):
+        """
+        Smooth trajectories of `count` objects bouncing inside [low, high].
+
+        Returns:
+            (num_frames, count, 2) world positions of the top left corners.
+        """
+        position = rng.uniform(low, high, size=(count, 2))
+        velocity = rng.uniform(-max_speed, max_speed, size=(count, 2))
+        positions = np.empty((self.num_frames, count, 2))
+        for frame_num in range(self.num_frames):
+            positions[frame_num] = position
+            velocity = velocity + rng.normal(0, 0.1 * max_speed, size=velocity.shape)
+            speed = np.linalg.norm(velocity, axis=1, keepdims=True)
+            velocity *= np.minimum(1, max_speed / np.maximum(speed, 1e-9))
+            position = position + velocity
+            bounced = (position < low) | (position > high)
+            velocity[bounced] *= -1
+            position = np.clip(position, low, high)
+        return positions
+
+    def draw_pitch(self, rng, width, height):
+        pitch = np.empty((height, width, 3), dtype=np.uint8)
+        pitch[:] = (40, 140, 40)
+        stripe = max(1, int(120 * self.scale))
+        for x in range(0, width, 2 * stripe):
+            pitch[:, x:x + stripe] = (50, 160, 50)
+        noise = rng.integers(-12, 13, size=(height, width, 1))
+        pitch = np.clip(pitch.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+        board = int(0.08 * height)
+        block = max(8, int(60 * self.scale))
+        for x in range(0, width, block):
+            color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+            pitch[:board, x:x + block] = color
+        line = max(2, int(4 * self.scale))
+        cv2.line(pitch, (0, board + 2 * line), (width, board + 2 * line), (255, 255, 255), line)
+        for x in range(int(300 * self.scale), width, int(700 * self.scale)):
+            cv2.line(pitch, (x, board), (x, height), (255, 255, 255), line)
+        cv2.circle(pitch, (width // 2, height // 2), int(150 * self.scale), (255, 255, 255), line)
+        return pitch
+
+    def render(self, frame_num):
+        """
+        The BGR frame `frame_num`.
+        """
+        width, height = self.size
+        offset = int(self.camera_offset[frame_num])
+        frame = self.pitch[:, offset:offset + width].copy()
+        for box, team in zip(self.boxes[frame_num], self.team):
+            x1, y1, x2, y2 = np.round(box).astype(int)
+            shirt = self.team_colors[team] if team else self.referee_color
+            waist = (y1 + y2) // 2
+            head = max(2, (x2 - x1) // 4)
+            cv2.rectangle(frame, (x1, y1 + 2 * head), (x2, waist), shirt, cv2.FILLED)
+            cv2.rectangle(frame, (x1 + 2, waist), (x2 - 2, y2), (30, 30, 30), cv2.FILLED)
+            cv2.circle(frame, ((x1 + x2) // 2, y1 + head), head, (120, 160, 210), cv2.FILLED)
+        x1, y1, x2, y2 = self.ball_boxes[frame_num]
+        radius = max(1, int(round((x2 - x1) / 2)))
+        cv2.circle(frame, (int(round((x1 + x2) / 2)), int(round((y1 + y2) / 2))), radius, (255, 255, 255),
+                   cv2.FILLED)
+
+        block = self.barcode_block
+        for bit in range(self.barcode_bits):
+            x = width - (bit + 1) * block
+            frame[height - block:, x:x + block] = 255 if frame_num >> bit & 1 else 0
+        return frame
+
+    def read_frame_number(self, image):
+        """
+        Decode the barcode of a rendered frame, possibly resized.
+        """
+        scale = image.shape[1] / self.size[0]
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        # sample the middle half of every block
+        radius = max(0, int(self.barcode_block * scale / 4))
+        y = int((self.size[1] - self.barcode_block / 2) * scale)
+        frame_num = 0
+        for bit in range(self.barcode_bits):
+            x = int((self.size[0] - (bit + 0.5) * self.barcode_block) * scale)
+            if gray[y - radius:y + radius + 1, x - radius:x + radius + 1].mean() > 127:
+                frame_num |= 1 << bit
+        return frame_num
+
+    def write_video(self, path, fps=24):
+        """
+        Render the match to `path` with the MJPG codec.
+        """
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, self.size)
+        try:
+            for frame_num in range(self.num_frames):
+                writer.write(self.render(frame_num))
+        finally:
+            writer.release()
+        return path
+
+    def detections(self, frame_num):
+        """
+        Ground-truth detections of a frame, as the stub detector reports
+        them: the players and referee, plus the ball unless it is missed.
+
+        Returns:
+            (xyxy, class_id) arrays.
+        """
+        xyxy = self.boxes[frame_num]
+        class_id = self.object_class
+        if self.ball_detected[frame_num]:
+            xyxy = np.concatenate([xyxy, self.ball_boxes[frame_num][None]])
+            class_id = np.concatenate([class_id, [0]])
+        return xyxy, class_id
+
+
+class _Array(np.ndarray):
+    """
+    An array answering the `.cpu().numpy()` calls made on ultralytics tensors.
+    """
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return np.asarray(self)
+
+
+class _Boxes:
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).view(_Array)
+        self.conf = np.asarray(conf, dtype=np.float32).view(_Array)
+        self.cls = np.asarray(cls, dtype=np.float32).view(_Array)
+
+
+class _Result:
+    def __init__(self, xyxy, conf, cls, names):
+        self.boxes = _Boxes(xyxy, conf, cls)
+        self.names = names
+
+
+class StubDetector:
+    """
+    Stands in for the YOLO model on a SyntheticMatch.
+
+    Implements the `predict` call the InferenceEngine makes and answers with
+    the ground-truth boxes of the frames, scaled to the resized batch and
+    jittered by a Gaussian seeded per frame. Frames are identified by their
+    barcode, so any subset of the video can be passed in any order.
+    """
+    def __init__(self, match, jitter=1.0, confidence=0.9, seconds_per_frame=0.0, seed=0):
+        """
+        Args:
+            match: The SyntheticMatch being analysed.
+            jitter: Standard deviation of the box noise, in pixels.
+            confidence: Confidence reported for every detection.
+            seconds_per_frame: Time every frame is held up, to stand in for
+                the cost of a real model.
+            seed: Seed of the box noise.
+        """
+        self.match = match
+        self.jitter = jitter
+        self.confidence = confidence
+        self.seconds_per_frame = seconds_per_frame
+        self.seed = seed
+
+    def predict(self, batch, conf=0.1, imgsz=640, verbose=False):
+        results = []
+        for image in batch:
+            frame_num = self.match.read_frame_number(image)
+            xyxy, class_id = self.match.detections(frame_num)
+            rng = np.random.default_rng((self.seed, frame_num))
+            xyxy = xyxy + rng.normal(0, self.jitter, size=xyxy.shape)
+            scale = image.shape[1] / self.match.size[0]
+            results.append(_Result(xyxy * scale, np.full(len(class_id), self.confidence), class_id,
+                                   self.match.class_names))
+        if self.seconds_per_frame:
+            time.sleep(self.seconds_per_frame * len(batch))
+        return results
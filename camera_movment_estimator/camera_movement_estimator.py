@@ -2,19 +2,45 @@ import pickle
 import cv2
 import numpy as np
 import os
+from utils import as_track_table, FrameRenderer
 class CameraMovementEstimator():
-    def __init__(self, frame):
+    motion_models = ('translation', 'affine', 'homography')
+
+    def __init__(self, frame, motion_model='translation', flow_scale=1.0, input_scale=1.0):
+        """
+        Args:
+            frame: First frame of the video, BGR or already grayscale.
+            motion_model: Global motion fitted to the tracked features of
+                each frame: 'translation' (median displacement), 'affine'
+                (RANSAC partial affine) or 'homography' (RANSAC).
+            flow_scale: Factor applied to the grayscale frames before optical
+                flow, e.g. 0.25 for 4K feeds. Results are always reported in
+                full-resolution pixels.
+            input_scale: Scale of the frames passed in, relative to the
+                full-resolution video, when they are decoded at reduced size
+                for this stage. Frames decoded at `flow_scale` are used as
+                they are.
+        """
+        if motion_model not in self.motion_models:
+            raise ValueError(f"motion_model must be one of {self.motion_models}, got {motion_model!r}")
+        self.motion_model = motion_model
+        self.flow_scale = flow_scale
+        self.input_scale = input_scale
         self.minimum_distance = 5
+        self.ransac_threshold = 3.0
+        self.renderer = FrameRenderer()
         self.lk_params = dict(
             winSize=(15, 15),
             maxLevel=2,
             criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
         )
-        first_frame_grayscale = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        first_frame_grayscale = self.to_gray(frame)
+        height, width = frame.shape[:2]
+        self.reference_point = np.array([width / 2, height / 2], dtype=np.float32) / input_scale
 
         mask_features = np.zeros_like(first_frame_grayscale)
-        mask_features[:, 0:20] = 1
-        mask_features[:, 900:1050] = 1
+        mask_features[:, 0:int(20 * flow_scale)] = 1
+        mask_features[:, int(900 * flow_scale):int(1050 * flow_scale)] = 1
 
         self.features = dict(
             maxCorners=100,
@@ -23,60 +49,182 @@ class CameraMovementEstimator():
             blockSize=7,
             mask=mask_features
         )
+        self.reset()
     def draw_camera_movement(self, frames, camera_movement_per_frame):
+        # drawn in place; the translucent panel only touches its own region
         output_frames = []
         for frame_num, frame in enumerate(frames):
-            frame_copy = frame.copy()
-            overlay = frame.copy()
-            cv2.rectangle(overlay, (0, 0), (500, 500), (255, 255, 255), -1)
-            alpha = 0.6
-            cv2.addWeighted(overlay, alpha, frame_copy, 1 - alpha, 0, frame_copy)
-            x_movement, y_movement = camera_movement_per_frame[frame_num]
-            frame = cv2.putText(frame, f'Movement X: {x_movement:.2f}',
-                                (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 3)
-            frame = cv2.putText(frame, f'Movement Y: {y_movement:.2f}',
-                                (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 3)
-            output_frames.append(frame)
+            output_frames.append(self.renderer.draw_camera_movement(frame, camera_movement_per_frame[frame_num]))
         return output_frames
-    
+
     def add_adjust_positions_to_tracks(self, tracks, camera_movement_per_frame):
-        for obj, obj_tracks in tracks.items():
-            for frame_num, frame_data in enumerate(obj_tracks):
-                for tarck_id, track_data in frame_data.items():
-                    position = track_data.get('position', [0, 0])
-                    camera_movement = camera_movement_per_frame[frame_num]
-                    position_adjusted = (position[0] - camera_movement[0], position[1] - camera_movement[1])
-                    tracks[obj][frame_num][tarck_id]['position_adjusted'] = position_adjusted
-                    
+        """
+        Subtract the camera movement of each row's frame from its position.
+        Args:
+            tracks: A TrackTable or the legacy dict of per-frame track lists.
+            camera_movement_per_frame: [x, y] movement for each frame.
+        """
+        table = as_track_table(tracks)
+        camera_movement = np.asarray(camera_movement_per_frame, dtype=np.float32).reshape(-1, 2)
+        position = np.nan_to_num(table.position)
+        table.set_column('position_adjusted', position - camera_movement[table.frame])
+        table.write_back(tracks, ['position_adjusted'])
+
+    def reset(self):
+        """
+        Forget the previous frame so the next chunk starts a new video.
+        """
+        self.old_gray = None
+        self.old_features = None
+
+    def prime(self, frame):
+        """
+        Continue from `frame` as the previous frame, e.g. after earlier chunks
+        were loaded from a cache instead of being estimated.
+        """
+        self.old_gray = self.to_gray(frame)
+        self.old_features = cv2.goodFeaturesToTrack(self.old_gray, **self.features)
+
+    def to_gray(self, frame):
+        """
+        Grayscale, optionally downscaled, version of a frame for optical flow.
+        """
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        scale = self.flow_scale / self.input_scale
+        if scale != 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def fit_motion(self, old_points, new_points):
+        """
+        Fit the global motion model to matched feature positions.
+        Args:
+            old_points: (N, 2) feature positions in the previous frame.
+            new_points: (N, 2) positions of the same features in this frame.
+
+        Returns:
+            3x3 float32 matrix mapping previous-frame pixels to this frame,
+            or None when there are too few matches.
+        """
+        transform = np.eye(3, dtype=np.float32)
+        if self.motion_model == 'translation':
+            if len(old_points) < 1:
+                return None
+            transform[:2, 2] = np.median(new_points - old_points, axis=0)
+        elif self.motion_model == 'affine':
+            if len(old_points) < 3:
+                return None
+            affine, _ = cv2.estimateAffinePartial2D(old_points, new_points, method=cv2.RANSAC,
+                                                    ransacReprojThreshold=self.ransac_threshold)
+            if affine is None:
+                return None
+            transform[:2] = affine
+        else:
+            if len(old_points) < 4:
+                return None
+            homography, _ = cv2.findHomography(old_points, new_points, cv2.RANSAC,
+                                               self.ransac_threshold)
+            if homography is None:
+                return None
+            transform = homography.astype(np.float32)
+        return transform
+
+    def movement_from_transforms(self, transforms):
+        """
+        [x, y] displacement of the frame center under each transform, which
+        for the translation model is the translation itself.
+        Args:
+            transforms: (N, 3, 3) per-frame transforms.
+
+        Returns:
+            (N, 2) float32 array of camera movements.
+        """
+        transforms = np.asarray(transforms, dtype=np.float32).reshape(-1, 3, 3)
+        point = np.append(self.reference_point, 1).astype(np.float32)
+        moved = transforms @ point
+        moved = moved[:, :2] / moved[:, 2:3]
+        return (moved - self.reference_point).astype(np.float32)
+
+    def get_camera_transforms_chunk(self, frames):
+        """
+        Estimate the per-frame global motion for a chunk of consecutive frames.
+
+        The last grayscale frame and its tracked features are kept on the
+        instance, so successive chunks of a streamed video produce the same
+        transforms as a single call on the whole video.
+        Args:
+            frames: Consecutive frames following the previously seen chunk.
+
+        Returns:
+            transforms: (N, 3, 3) float32 array mapping each frame's previous
+                frame to it, in full-resolution pixels. Frames whose motion
+                is below `minimum_distance` get the identity.
+        """
+        transforms = np.tile(np.eye(3, dtype=np.float32), (len(frames), 1, 1))
+        start = 0
+        if self.old_gray is None:
+            if len(frames) == 0:
+                return transforms
+            self.old_gray = self.to_gray(frames[0])
+            self.old_features = cv2.goodFeaturesToTrack(self.old_gray, **self.features)
+            start = 1
+        old_gray = self.old_gray
+        old_features = self.old_features
+
+        # maps flow-resolution transforms back to full-resolution pixels
+        scale = np.diag([self.flow_scale, self.flow_scale, 1]).astype(np.float32)
+        inverse_scale = np.diag([1 / self.flow_scale, 1 / self.flow_scale, 1]).astype(np.float32)
+
+        for frame_num in range(start, len(frames)):
+            new_gray = self.to_gray(frames[frame_num])
+            transform = None
+            if old_features is not None and len(old_features) > 0:
+                new_features, status, error = cv2.calcOpticalFlowPyrLK(
+                    old_gray, new_gray, old_features, None, **self.lk_params
+                )
+                tracked = status.reshape(-1) == 1
+                transform = self.fit_motion(old_features.reshape(-1, 2)[tracked],
+                                            new_features.reshape(-1, 2)[tracked])
+
+            if transform is not None:
+                transform = inverse_scale @ transform @ scale
+                movement = self.movement_from_transforms(transform)[0]
+                if np.linalg.norm(movement) > self.minimum_distance:
+                    transforms[frame_num] = transform
+                    old_features = cv2.goodFeaturesToTrack(new_gray, **self.features)
+            else:
+                old_features = cv2.goodFeaturesToTrack(new_gray, **self.features)
+            old_gray = new_gray
+
+        self.old_gray = old_gray
+        self.old_features = old_features
+        return transforms
+
+    def get_camera_movement_chunk(self, frames):
+        """
+        Estimate camera movement for a chunk of consecutive frames.
+        Args:
+            frames: Consecutive frames following the previously seen chunk.
+
+        Returns:
+            camera_movement: (N, 2) float32 array of [x, y] movement per frame.
+        """
+        return self.movement_from_transforms(self.get_camera_transforms_chunk(frames))
+
+    def get_camera_transforms(self, frames):
+        """
+        Per-frame (N, 3, 3) global motion transforms of a whole video.
+        """
+        self.reset()
+        return self.get_camera_transforms_chunk(frames)
+
     def get_camera_movement(self, frames, read_from_stub=False, stub_path=None):
         if read_from_stub and stub_path is not None and os.path.exists(stub_path):
             with open(stub_path, 'rb') as f:
                 return pickle.load(f)
-        camera_movement = [[0, 0]] * len(frames)  # Initialize with no movement
-        old_gray = cv2.cvtColor(frames[0], cv2.COLOR_BGR2GRAY)
-        old_features = cv2.goodFeaturesToTrack(old_gray, **self.features)
-
-        for frame_num in range(1, len(frames)):
-            new_gray = cv2.cvtColor(frames[frame_num], cv2.COLOR_BGR2GRAY)
-            new_features, status, error = cv2.calcOpticalFlowPyrLK(
-                old_gray, new_gray, old_features, None, **self.lk_params
-            )
-
-            max_distance = 0
-            camera_movement_x = camera_movement_y = 0, 0 
-            for i, (new, old) in enumerate(zip(new_features, old_features)):
-                new_features_piont = new.ravel()
-                old_features_point = old.ravel()
-                distance = np.linalg.norm(new_features_piont - old_features_point)
-                if distance > max_distance:
-                    max_distance = distance
-                    camera_movement_x, camera_movement_y = new_features_piont[0] - old_features_point[0], new_features_piont[1] - old_features_point[1]
-
-            if max_distance > self.minimum_distance:
-                camera_movement[frame_num] = [camera_movement_x, camera_movement_y]
-                old_features = cv2.goodFeaturesToTrack(new_gray, **self.features)
-            old_gray = new_gray.copy()
-        
+        self.reset()
+        camera_movement = self.get_camera_movement_chunk(frames)
+
         if stub_path is not None:
             with open(stub_path, 'wb') as f:
                 pickle.dump(camera_movement, f)
@@ -1,60 +1,272 @@
+import argparse
+import collections
+import multiprocessing
 import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import cv2
+import numpy as np
 import albumentations as A
 
-# Input paths
-image_dir = 'D:\\football_analysis\\training\\football-players-detection-1\\football-players-detection-1\\train\\images'
-label_dir = 'D:\\football_analysis\\training\\football-players-detection-1\\football-players-detection-1\\train\\labels'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
 
-# Output paths
-output_image_dir = 'D:\\football_analysis\\training\\football-players-detection-1\\football-players-detection-1\\train\\images_aug'
-output_label_dir = 'D:\\football_analysis\\training\\football-players-detection-1\\football-players-detection-1\\train\\labels_aug'
+# per-process state of the pool workers, created once by _init_worker
+_worker = {}
 
 
-transform = A.Compose([
-    A.HorizontalFlip(p=0.5),
-    A.RandomBrightnessContrast(p=0.3),
-    A.ShiftScaleRotate(shift_limit=0.05, scale_limit=0.1, rotate_limit=15, p=0.5),
-], bbox_params=A.BboxParams(format='yolo', label_fields=['class_labels']))
+def build_transform():
+    return A.Compose([
+        A.HorizontalFlip(p=0.5),
+        A.RandomBrightnessContrast(p=0.3),
+        A.ShiftScaleRotate(shift_limit=0.05, scale_limit=0.1, rotate_limit=15, p=0.5),
+    ], bbox_params=A.BboxParams(format='yolo', label_fields=['class_labels']))
 
 
-# Loop through each image
+def variant_seed(seed, file_name, variant):
+    """
+    Seed of one variant of one image. It only depends on its arguments, so
+    a variant comes out the same whichever worker makes it and whatever
+    else is generated in the same run.
+    """
+    return zlib.crc32(f'{seed}:{file_name}:{variant}'.encode())
 
-for file in os.listdir(image_dir):
-    if not file.endswith(".jpg") and not file.endswith(".png"):
-        continue
 
-    img_path = os.path.join(image_dir, file)
-    label_path = os.path.join(label_dir, file.replace(".jpg", ".txt").replace(".png", ".txt"))
+def output_names(file_name, variant):
+    """
+    Image and label file names of variant `variant` of `file_name`.
+    """
+    stem, extension = os.path.splitext(file_name)
+    return f'{stem}_aug{variant}{extension}', f'{stem}_aug{variant}.txt'
 
-    # Load image and label
-    image = cv2.imread(img_path)
-    height, width = image.shape[:2]
 
-    with open(label_path, 'r') as f:
-        lines = f.readlines()
+def read_labels(path):
+    """
+    Read a YOLO label file. A missing file is an image without objects.
 
+    Returns:
+        (bboxes, class_labels) with one normalized xywh box per object.
+    """
     bboxes = []
     class_labels = []
+    if not os.path.exists(path):
+        return bboxes, class_labels
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.strip().split()
+            if not parts:
+                continue
+            class_labels.append(int(parts[0]))
+            bboxes.append(list(map(float, parts[1:5])))
+    return bboxes, class_labels
 
-    for line in lines:
-        parts = line.strip().split()
-        class_id = int(parts[0])
-        bbox = list(map(float, parts[1:]))
-        bboxes.append(bbox)
-        class_labels.append(class_id)
 
-    # Apply transform
-    augmented = transform(image=image, bboxes=bboxes, class_labels=class_labels)
+def _write_atomic(path, data, mode='wb'):
+    # a file only appears under its name once complete, so an interrupted run never leaves a
+    # truncated output that would be skipped next time
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, mode) as f:
+        f.write(data)
+    os.replace(temp_path, path)
 
-    aug_img = augmented['image']
-    aug_bboxes = augmented['bboxes']
-    aug_labels = augmented['class_labels']
 
-    # Save augmented image and label
-    aug_filename = file.replace(".jpg", "_aug.jpg").replace(".png", "_aug.png")
-    cv2.imwrite(os.path.join(output_image_dir, aug_filename), aug_img)
+def _load(image_path, label_path):
+    image = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f'Cannot decode {image_path}')
+    return image, read_labels(label_path)
 
-    with open(os.path.join(output_label_dir, aug_filename.replace(".jpg", ".txt").replace(".png", ".txt")), 'w') as f:
-        for bbox, class_id in zip(aug_bboxes, aug_labels):
-            f.write(f"{class_id} {' '.join(map(str, bbox))}\n")
\ No newline at end of file
+
+def _save(image, bboxes, class_labels, image_path, label_path):
+    extension = os.path.splitext(image_path)[1]
+    params = [cv2.IMWRITE_JPEG_QUALITY, _worker['jpeg_quality']] if extension.lower() in ('.jpg', '.jpeg') else []
+    ok, encoded = cv2.imencode(extension, image, params)
+    if not ok:
+        raise ValueError(f'Cannot encode {image_path}')
+    _write_atomic(image_path, encoded.tobytes())
+    # the label goes last, so a variant with both files was written completely
+    lines = ''.join(f"{class_id} {' '.join(map(str, map(float, bbox)))}\n"
+                    for bbox, class_id in zip(bboxes, class_labels))
+    _write_atomic(label_path, lines, mode='w')
+
+
+def _init_worker(io_threads, jpeg_quality):
+    # the pool provides the parallelism; OpenCV's own threads would only compete with it
+    cv2.setNumThreads(1)
+    _worker['transform'] = build_transform()
+    _worker['io'] = ThreadPoolExecutor(max_workers=io_threads)
+    _worker['io_threads'] = io_threads
+    _worker['jpeg_quality'] = jpeg_quality
+
+
+def _augment_batch(tasks, seed):
+    """
+    Generate the missing variants of a batch of images on this worker.
+
+    Images are decoded and the variants encoded and written on the
+    worker's I/O threads, so the next images are read and the previous
+    variants written while the transforms run.
+    Args:
+        tasks: List of (file name, image path, label path, [(variant,
+            output image path, output label path), ...]).
+        seed: Base seed of the run.
+
+    Returns:
+        Dict with the number of 'images' and 'outputs' done and the
+        (file name, error) pairs of the images that 'failed'.
+    """
+    transform = _worker['transform']
+    io = _worker['io']
+    loads = [io.submit(_load, image_path, label_path) for _, image_path, label_path, _ in tasks]
+    saves = collections.deque()
+    failed = {}
+    outputs = 0
+
+    def finish_save():
+        nonlocal outputs
+        file_name, save = saves.popleft()
+        try:
+            save.result()
+            outputs += 1
+        except Exception as e:
+            failed.setdefault(file_name, f'{type(e).__name__}: {e}')
+
+    for (file_name, _, _, variants), load in zip(tasks, loads):
+        try:
+            image, (bboxes, class_labels) = load.result()
+            for variant, image_path, label_path in variants:
+                seed_value = variant_seed(seed, file_name, variant)
+                random.seed(seed_value)
+                np.random.seed(seed_value)
+                if hasattr(transform, 'set_random_seed'):
+                    transform.set_random_seed(seed_value)
+                augmented = transform(image=image, bboxes=bboxes, class_labels=class_labels)
+                saves.append((file_name, io.submit(_save, augmented['image'], augmented['bboxes'],
+                                                   augmented['class_labels'], image_path, label_path)))
+                # bounds the augmented images waiting to be written
+                while len(saves) > 2 * _worker['io_threads']:
+                    finish_save()
+        except Exception as e:
+            failed.setdefault(file_name, f'{type(e).__name__}: {e}')
+    while saves:
+        finish_save()
+
+    return {'images': len(tasks) - len(failed), 'outputs': outputs, 'failed': sorted(failed.items())}
+
+
+def augment_dataset(image_dir, label_dir, output_image_dir, output_label_dir, variants=1, seed=0, workers=None,
+                    io_threads=2, batch_size=16, jpeg_quality=95, force=False, log=print, log_interval=10):
+    """
+    Write `variants` augmented copies of every image of a YOLO dataset.
+
+    Images are spread over a pool of worker processes in batches of
+    `batch_size`. Every variant is seeded from `seed`, the image name and
+    the variant number, so a run is reproducible and can be resumed:
+    variants whose image and label files both exist are skipped unless
+    `force` is set. Change `seed`, or the transform, together with `force`.
+    Args:
+        image_dir: Directory of the .jpg, .jpeg and .png images.
+        label_dir: Directory of the YOLO .txt labels, one per image.
+        output_image_dir: Directory receiving `<name>_aug<k>.<ext>`.
+        output_label_dir: Directory receiving `<name>_aug<k>.txt`.
+        variants: Number of augmented copies per image.
+        seed: Base seed of the augmentations.
+        workers: Number of worker processes. Defaults to the CPU count.
+        io_threads: Threads per worker decoding, encoding and writing
+            images alongside the transforms.
+        batch_size: Images handed to a worker at a time.
+        jpeg_quality: Quality of the written JPEG images.
+        force: Regenerate existing outputs.
+        log: Callable receiving progress lines, or None.
+        log_interval: Seconds between progress lines.
+
+    Returns:
+        Dict with the number of 'images' processed, 'skipped' and 'failed',
+        the 'outputs' written, 'wall_time' and 'images_per_sec'; the
+        errors of failed images are under 'errors'.
+    """
+    os.makedirs(output_image_dir, exist_ok=True)
+    os.makedirs(output_label_dir, exist_ok=True)
+    existing_images = set() if force else set(os.listdir(output_image_dir))
+    existing_labels = set() if force else set(os.listdir(output_label_dir))
+
+    tasks = []
+    skipped = 0
+    for file_name in sorted(os.listdir(image_dir)):
+        if not file_name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        missing = []
+        for variant in range(variants):
+            image_name, label_name = output_names(file_name, variant)
+            if image_name not in existing_images or label_name not in existing_labels:
+                missing.append((variant, os.path.join(output_image_dir, image_name),
+                                os.path.join(output_label_dir, label_name)))
+        if not missing:
+            skipped += 1
+            continue
+        label_path = os.path.join(label_dir, os.path.splitext(file_name)[0] + '.txt')
+        tasks.append((file_name, os.path.join(image_dir, file_name), label_path, missing))
+
+    report = {'images': 0, 'skipped': skipped, 'failed': 0, 'outputs': 0, 'wall_time': 0.0,
+              'images_per_sec': 0.0, 'errors': []}
+    start = time.perf_counter()
+    last_log = start
+    if tasks:
+        workers = max(1, min(workers or os.cpu_count() or 1, -(-len(tasks) // batch_size)))
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(io_threads, jpeg_quality)) as pool:
+            futures = [pool.submit(_augment_batch, tasks[i:i + batch_size], seed)
+                       for i in range(0, len(tasks), batch_size)]
+            for future in as_completed(futures):
+                result = future.result()
+                report['images'] += result['images']
+                report['outputs'] += result['outputs']
+                report['failed'] += len(result['failed'])
+                report['errors'].extend(result['failed'])
+                now = time.perf_counter()
+                if log is not None and now - last_log >= log_interval:
+                    last_log = now
+                    done = report['images'] + report['failed']
+                    log(f"{done}/{len(tasks)} images, {report['images'] / (now - start):.1f} images/s")
+
+    wall_time = time.perf_counter() - start
+    report['wall_time'] = round(wall_time, 3)
+    report['images_per_sec'] = round(report['images'] / wall_time, 2) if wall_time > 0 else 0.0
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write augmented copies of a YOLO dataset.')
+    parser.add_argument('image_dir')
+    parser.add_argument('label_dir')
+    parser.add_argument('--output-image-dir', help='defaults to <image_dir>_aug')
+    parser.add_argument('--output-label-dir', help='defaults to <label_dir>_aug')
+    parser.add_argument('--variants', type=int, default=1, help='augmented copies per image')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, the CPU count by default')
+    parser.add_argument('--io-threads', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--jpeg-quality', type=int, default=95)
+    parser.add_argument('--force', action='store_true', help='regenerate outputs that already exist')
+    args = parser.parse_args(argv)
+
+    report = augment_dataset(
+        args.image_dir, args.label_dir,
+        args.output_image_dir or os.path.normpath(args.image_dir) + '_aug',
+        args.output_label_dir or os.path.normpath(args.label_dir) + '_aug',
+        variants=args.variants, seed=args.seed, workers=args.workers, io_threads=args.io_threads,
+        batch_size=args.batch_size, jpeg_quality=args.jpeg_quality, force=args.force)
+    for file_name, error in report['errors']:
+        print(f'failed {file_name}: {error}')
+    print(f"{report['images']} images ({report['outputs']} outputs) in {report['wall_time']} s, "
+          f"{report['images_per_sec']} images/s; {report['skipped']} already done, {report['failed']} failed")
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
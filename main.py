@@ -1,4 +1,5 @@
-from utils.video_utils import read_video, write_video
+import sys
+from utils.video_utils import read_video, write_video, get_video_fps
 from trackers import Tracker
 from team_assigner import TeamAssigner
 from player_ball_assigner import PlayerBallAssigner
@@ -6,20 +7,54 @@ import numpy as np
 from camera_movment_estimator import CameraMovementEstimator
 from view_transformer import ViewTransformer
 from speed_and_distance_estimator import SpeedAndDistanceEstimator 
+from pipeline import StreamingPipeline, BatchRunner, LivePipeline, ClipRenderer
+from utils import StageProfiler
+
+EXPORT_PATH = 'D:\\football_analysis\\output_videos\\match.parquet'
 
 def main():
     video_path = 'D:\\football_analysis\\videos\\08fd33_4.mp4'
     output_path = 'D:\\football_analysis\\output_videos\\output.avi'
 
+    # frames are streamed in chunks, so memory use does not grow with the match length
+    # per-stage timings are printed every 10 s and written next to the output at the end
+    profiler = StageProfiler(live_interval=10)
+    pipeline = StreamingPipeline(model_path='models/best.pt', chunk_size=64,
+                                 cache_dir='stubs/stage_cache', profiler=profiler)
+    # the tracks are exported too, so --clip can render highlights without running the analysis again
+    pipeline.run(video_path, output_path, export_path=EXPORT_PATH)
+    profiler.write_report('D:\\football_analysis\\output_videos\\profile.json')
+
+def main_manifest(manifest_path):
+    # every video of the manifest, one model load per worker; re-running resumes unfinished jobs
+    runner = BatchRunner(model_path='models/best.pt', workers=2, frame_memory_mb=4096,
+                         cache_dir='stubs/stage_cache')
+    report = runner.run(manifest_path, report_path='output_videos/batch_report.json')
+    print(report['summary'])
+
+def main_live(source):
+    # RTSP/camera feed (or a file replayed at its frame rate); work is shed to stay within 250 ms per frame
+    pipeline = LivePipeline(model_path='models/best.pt', latency_budget=0.25, flow_scale=0.5)
+    report = pipeline.run(source, output_path='output_videos/live_output.avi')
+    pipeline.write_latency_report('output_videos/live_latency.csv')
+    print({key: value for key, value in report.items() if key != 'per_frame'})
+
+def main_clip(start, duration=20):
+    # a highlight drawn from the export of an earlier run; only the clip's frames are decoded and annotated
+    renderer = ClipRenderer(EXPORT_PATH, cache_dir='stubs/stage_cache')
+    print(renderer.render('output_videos/clip.avi', seconds=(start, start + duration)))
+
+def main_batch():
+    # whole-video variant, kept for working with the pickled stubs
+    video_path = 'D:\\football_analysis\\videos\\08fd33_4.mp4'
+    output_path = 'D:\\football_analysis\\output_videos\\output.avi'
+
     frames = read_video(video_path)
     tracker = Tracker(model_path='models/best.pt')
     tracks = tracker.get_object_tracks(frames, read_from_stub=True, stub_path='stubs/tracks.pkl')
     # get object positions
     tracker.add_positions_to_tracks(tracks)
     tracks['ball'] = tracker.interpolate_ball_positions(tracks['ball'])
-    # estimate speed and distance
-    speed_estimator = SpeedAndDistanceEstimator()
-    speed_estimator.add_speed_and_distance_to_tracks(tracks)
     # camera movement estimation
     camera_estimator = CameraMovementEstimator(frames[0])
     camera_movment_per_frame = camera_estimator.get_camera_movement(frames,
@@ -29,32 +64,26 @@ def main():
     # view transformation
     view_transformer = ViewTransformer()
     view_transformer.add_transformed_position_to_tracks(tracks)
+    # estimate speed and distance, from the pitch positions of the view transformation
+    speed_estimator = SpeedAndDistanceEstimator(frame_rate=get_video_fps(video_path))
+    speed_estimator.add_speed_and_distance_to_tracks(tracks)
 
     team_assigner = TeamAssigner()
-    team_assigner.assign_team_color(frames[0], tracks['players'][0])
-
+    # the first frame whose players give two distinct jersey colors
     for frame_num, player_track in enumerate(tracks['players']):
+        if team_assigner.assign_team_color(frames[frame_num], player_track):
+            break
 
-        for player_id, player_data in player_track.items():
-            bbox = player_data['bbox']
-            team_id = team_assigner.get_player_team(frames[frame_num], bbox, player_id)
-
+    for frame_num, player_track in enumerate(tracks['players']):
+        # all players of a frame are classified in one batch
+        player_teams = team_assigner.get_player_teams(frames[frame_num], player_track)
+        for player_id, team_id in player_teams.items():
             tracks['players'][frame_num][player_id]['team_id'] = team_id
             tracks['players'][frame_num][player_id]['team_color'] = team_assigner.team_colors[team_id]
     # assign ball to player
     player_assigner = PlayerBallAssigner()
-    team_ball_control = [None]
-    for frame_num, player_track in enumerate(tracks['players']):
-        ball_bbox = tracks['ball'][frame_num].get(1, {}).get('bbox', [])
-        player_id = player_assigner.assign_ball(player_track, ball_bbox)
-        
-        if player_id is not None:
-            tracks['players'][frame_num][player_id]['has_ball'] = True
-            team_ball_control.append(tracks['players'][frame_num][player_id]['team_id'])
-        else:
-            team_ball_control.append(team_ball_control[-1])
-
-        team_ball_control.append(player_id)
+    possession = player_assigner.assign_ball_to_tracks(tracks)
+    team_ball_control = possession['team_id']
 
     # draw camera movement
     
@@ -64,4 +93,11 @@ def main():
     write_video(output, output_path)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    if len(sys.argv) > 2 and sys.argv[1] == '--live':
+        main_live(sys.argv[2])
+    elif len(sys.argv) > 2 and sys.argv[1] == '--clip':
+        main_clip(float(sys.argv[2]))
+    elif len(sys.argv) > 1:
+        main_manifest(sys.argv[1])
+    else:
+        main()
\ No newline at end of file
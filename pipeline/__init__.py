@@ -0,0 +1,5 @@
+from .streaming_pipeline import StreamingPipeline
+from .parallel_pipeline import ParallelPipeline
+from .live_pipeline import LivePipeline, LOAD_LEVELS
+from .batch_runner import BatchRunner, load_manifest
+from .clip_renderer import ClipRenderer
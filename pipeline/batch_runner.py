@@ -0,0 +1,252 @@
+import csv
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .streaming_pipeline import StreamingPipeline
+from trackers import prepare_detector
+from utils import StageProfiler, get_frame_size, video_fingerprint
+
+# per-process state of the pool workers, created once by _init_worker
+_worker = {}
+
+
+def load_manifest(path):
+    """
+    Read a job manifest.
+
+    Either a JSON list of `{"video": ..., "output": ...}` objects or a CSV
+    file with `video` and `output` columns, and optionally `export` for a
+    .parquet or .arrow file of the tracks. Relative paths are resolved
+    against the manifest's directory.
+
+    Returns:
+        List of job dicts with absolute 'video', 'output' and, if given,
+        'export' paths.
+    """
+    with open(path, newline='') as f:
+        if path.endswith('.json'):
+            entries = json.load(f)
+        else:
+            entries = list(csv.DictReader(f))
+
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for entry in entries:
+        if not entry.get('video') or not entry.get('output'):
+            raise ValueError(f"Manifest entry needs 'video' and 'output': {entry!r}")
+        jobs.append({name: os.path.join(base, entry[name]) for name in ('video', 'output', 'export')
+                     if entry.get(name)})
+    return jobs
+
+
+def fit_frame_budget(max_frames, chunk_size, lookahead, io_queue_size, min_lookahead=1):
+    """
+    Shrink the buffering of a StreamingPipeline so that at most `max_frames`
+    frames are alive at once.
+
+    A pipeline holds up to `io_queue_size` decoded and `io_queue_size`
+    annotated frames in its queues plus `chunk_size + lookahead` frames
+    being analysed. The queues are shrunk first, then the look-ahead (never
+    below `min_lookahead`), then the chunk size.
+
+    Returns:
+        (chunk_size, lookahead, io_queue_size)
+    """
+    io_queue_size = max(1, min(io_queue_size, max_frames // 8))
+    lookahead = max(min_lookahead, min(lookahead, max_frames // 4))
+    chunk_size = max(1, min(chunk_size, max_frames - 2 * io_queue_size - lookahead))
+    return chunk_size, lookahead, io_queue_size
+
+
+def _init_worker(model_path, pipeline_options, profile):
+    _worker['pipeline'] = StreamingPipeline(model_path, profiler=StageProfiler(enabled=profile),
+                                            **pipeline_options)
+    # the settings as configured, which the frame budget of each job shrinks from
+    _worker['options'] = {name: getattr(_worker['pipeline'], name)
+                          for name in ('chunk_size', 'lookahead', 'io_queue_size')}
+
+
+def _run_job(job, frame_budget_bytes):
+    """
+    Run one job on this worker's pipeline.
+
+    Returns:
+        The job's report entry.
+    """
+    pipeline = _worker['pipeline']
+    options = _worker['options']
+    width, height = get_frame_size(job['video'])
+    record = dict(job, status='running', pid=os.getpid(), frames=0, wall_time=0.0, fps=0.0)
+    if not width or not height:
+        return dict(record, status='failed', error=f"Cannot read video {job['video']}")
+
+    if frame_budget_bytes:
+        max_frames = max(1, frame_budget_bytes // (width * height * 3))
+        pipeline.chunk_size, pipeline.lookahead, pipeline.io_queue_size = fit_frame_budget(
+            max_frames, options['chunk_size'], options['lookahead'], options['io_queue_size'])
+    record['settings'] = {'chunk_size': pipeline.chunk_size, 'lookahead': pipeline.lookahead,
+                          'io_queue_size': pipeline.io_queue_size}
+
+    hits, misses = (pipeline.cache.hits, pipeline.cache.misses) if pipeline.cache else (0, 0)
+    start = time.perf_counter()
+    try:
+        output_dir = os.path.dirname(job['output'])
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        pipeline.run(job['video'], job['output'], export_path=job.get('export'))
+        record['status'] = 'done'
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = f'{type(e).__name__}: {e}'
+    wall_time = time.perf_counter() - start
+
+    record['frames'] = getattr(pipeline, 'frame_count', 0)
+    record['wall_time'] = round(wall_time, 3)
+    record['fps'] = round(record['frames'] / wall_time, 2) if wall_time > 0 else 0.0
+    if pipeline.cache:
+        record['cache_hits'] = pipeline.cache.hits - hits
+        record['cache_misses'] = pipeline.cache.misses - misses
+    record['io'] = pipeline.io_stats
+    if pipeline.profiler.enabled:
+        record['profile'] = pipeline.profiler.report()
+    return record
+
+
+class BatchRunner:
+    """
+    Runs a StreamingPipeline over every video of a manifest with a pool of
+    worker processes.
+
+    Each worker loads the model once and reuses it for all the jobs it is
+    given. Jobs are scheduled largest file first, so a long match does not
+    end up alone at the tail of the batch. The pipelines' buffering is
+    shrunk per job so that all workers together keep at most
+    `frame_memory_mb` of decoded frames alive.
+
+    The report is rewritten after every job. Running the same manifest with
+    the same report again skips the jobs that finished on an unchanged
+    video; interrupted or failed jobs are re-run, and with a `cache_dir` the
+    chunks they had already analysed come straight from the stage cache.
+    """
+    def __init__(self, model_path, workers=1, frame_memory_mb=None, cache_dir=None, profile=False,
+                 **pipeline_options):
+        """
+        Args:
+            model_path: Path to the YOLO weights.
+            workers: Number of worker processes, e.g. one per GPU.
+            frame_memory_mb: Total memory all workers may spend on frames
+                in flight. None keeps the pipeline settings as given.
+            cache_dir: Directory of the stage cache shared by the workers.
+            profile: Add the per-stage profile of every job to the report.
+            **pipeline_options: Further StreamingPipeline arguments.
+        """
+        self.model_path = model_path
+        self.workers = workers
+        self.frame_memory_mb = frame_memory_mb
+        self.profile = profile
+        self.pipeline_options = dict(pipeline_options, cache_dir=cache_dir)
+
+    def run(self, manifest, report_path):
+        """
+        Process every job of a manifest.
+        Args:
+            manifest: Path of a manifest file (see `load_manifest`) or a
+                list of job dicts.
+            report_path: JSON file receiving one entry per job with its
+                status, timing, throughput, cache and queue counters, and
+                its stage profile when profiling is on.
+
+        Returns:
+            The report as a dict.
+        """
+        jobs = load_manifest(manifest) if isinstance(manifest, str) else list(manifest)
+        entries, pending = self.resume(jobs, self.load_report(report_path))
+        report = {'jobs': entries}
+
+        frame_budget_bytes = None
+        if self.frame_memory_mb:
+            # split by the configured workers, not the busy ones, so a resumed batch uses the
+            # same chunk sizes and therefore the same stage cache keys
+            frame_budget_bytes = self.frame_memory_mb * (1 << 20) // max(1, self.workers)
+
+        start = time.perf_counter()
+        if pending:
+            # exported once here rather than by every worker, with the CPUs shared between them
+            pipeline_options = dict(self.pipeline_options, detector=prepare_detector(
+                self.model_path, self.pipeline_options.get('detector'), self.workers))
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(pending)), mp_context=context,
+                                     initializer=_init_worker,
+                                     initargs=(self.model_path, pipeline_options, self.profile)) as pool:
+                futures = {pool.submit(_run_job, job, frame_budget_bytes): index for index, job in pending}
+                for future in as_completed(futures):
+                    report['jobs'][futures[future]] = future.result()
+                    self.write_report(report, report_path)
+
+        wall_time = time.perf_counter() - start
+        frames = sum(job['frames'] for job in report['jobs'] if job['status'] == 'done')
+        report['summary'] = {
+            'jobs': len(jobs),
+            'done': sum(job['status'] == 'done' for job in report['jobs']),
+            'skipped': sum(job['status'] == 'skipped' for job in report['jobs']),
+            'failed': sum(job['status'] == 'failed' for job in report['jobs']),
+            'frames': frames,
+            'wall_time': round(wall_time, 3),
+            'fps': round(frames / wall_time, 2) if wall_time > 0 else 0.0,
+        }
+        self.write_report(report, report_path)
+        return report
+
+    @staticmethod
+    def resume(jobs, previous):
+        """
+        Match jobs against the entries of an earlier report.
+        Args:
+            jobs: Job dicts, see `load_manifest`.
+            previous: Earlier entries by (video, output), see `load_report`.
+
+        Returns:
+            (entries, pending): one report entry per job, marked 'skipped'
+            for the jobs that finished on an unchanged video (also when an
+            earlier resume skipped them) and None for the others, and the
+            (index, job) pairs to run, largest video first.
+        """
+        entries, pending = [None] * len(jobs), []
+        for index, job in enumerate(jobs):
+            fingerprint = video_fingerprint(job['video'])
+            done = previous.get((job['video'], job['output']))
+            if (done and done.get('status') in ('done', 'skipped') and done.get('fingerprint') == fingerprint
+                    and os.path.exists(job['output']) and os.path.exists(job.get('export', job['output']))):
+                entries[index] = dict(done, status='skipped')
+            else:
+                pending.append((index, dict(job, fingerprint=fingerprint)))
+        pending.sort(key=lambda item: -os.path.getsize(item[1]['video']))
+        return entries, pending
+
+    @staticmethod
+    def load_report(report_path):
+        """
+        Entries of an earlier report, by (video, output).
+        """
+        if not os.path.exists(report_path):
+            return {}
+        with open(report_path) as f:
+            report = json.load(f)
+        return {(job['video'], job['output']): job for job in report.get('jobs', []) if job}
+
+    @staticmethod
+    def write_report(report, report_path):
+        """
+        Atomically replace the report file, so an interrupted batch leaves
+        the last complete version behind.
+        """
+        directory = os.path.dirname(os.path.abspath(report_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'jobs': [job for job in report['jobs'] if job], 'summary': report.get('summary')},
+                      f, indent=2)
+        os.replace(temp_path, report_path)
@@ -0,0 +1,157 @@
+import argparse
+import sys
+import time
+from player_ball_assigner import PossessionStatistics
+from utils import MatchStore, SeekIndex, StageCache, FrameRenderer, StageProfiler, OBJECT_TYPES
+from utils import ThreadedVideoReader, ThreadedVideoWriter
+
+
+class ClipRenderer:
+    """
+    Renders an annotated segment of an analysed match, e.g. a highlight,
+    without running the analysis again or reading the rest of the video.
+
+    The overlays are drawn from the match export of an earlier run (see
+    `utils.MatchExporter`), reading only the row groups that cover the
+    clip. The ball control panel starts from the export's last possession
+    checkpoint at least the longest rolling window before the clip and
+    replays the possession column from there. The video is decoded from
+    the keyframe before the clip, found in the video's SeekIndex, so the
+    cost of a clip grows with its length (plus that window), not with how
+    far into the match it starts.
+    """
+    def __init__(self, export_path, video_path=None, cache_dir=None, possession_windows=None, video_io=None,
+                 profiler=None):
+        """
+        Args:
+            export_path: .parquet or .arrow file written by a pipeline run
+                with `export_path`.
+            video_path: The analysed video. Defaults to the one recorded in
+                the export.
+            cache_dir: Directory of the stage cache keeping the seek index
+                of the video, so it is only built once per video.
+            possession_windows: Dict of rolling possession window name to
+                length in seconds, as given to the pipeline. Defaults to the
+                last 5 minutes.
+            video_io: Optional dict of stage to video backend options:
+                'decode' and 'encode', see `StreamingPipeline`.
+            profiler: Optional StageProfiler timing the clip's stages.
+        """
+        self.store = MatchStore(export_path)
+        self.video_path = video_path or self.store.metadata.get('video')
+        if self.video_path is None:
+            raise ValueError(f'{export_path} does not record its video, pass video_path')
+        self.cache = StageCache(cache_dir) if cache_dir is not None else None
+        self.seek_index = SeekIndex.load_or_build(self.video_path, self.cache)
+        self.fps = self.store.fps
+        self.possession_windows = {'Last 5 min': 300} if possession_windows is None else possession_windows
+        self.video_io = {stage: dict(options) for stage, options in (video_io or {}).items()}
+        self.renderer = FrameRenderer()
+        self.profiler = profiler if profiler is not None else StageProfiler(enabled=False)
+
+    def clip_range(self, frames=None, seconds=None):
+        """
+        [start, stop) frames of a clip given by exactly one of `frames`, a
+        (start, stop) pair of frame numbers, or `seconds`, a (start, stop)
+        pair of times in the video.
+        """
+        if (frames is None) == (seconds is None):
+            raise ValueError('Pass the clip as either frames or seconds')
+        if frames is not None:
+            start, stop = frames
+        else:
+            start, stop = (self.seek_index.frame_at(value) for value in seconds)
+        stop = min(stop, len(self.seek_index))
+        if not 0 <= start < stop:
+            raise ValueError(f'Empty clip: frames [{start}, {stop}) of a {len(self.seek_index)} frame video')
+        return int(start), int(stop)
+
+    def iter_clip(self, frames=None, seconds=None):
+        """
+        Annotated frames of a clip, see `clip_range`, in order.
+        """
+        start, stop = self.clip_range(frames, seconds)
+        profiler = self.profiler
+        with profiler.stage('load_tracks', stop - start):
+            tracks = self.store.track_table(frames=(start, stop)).as_tracks()
+            camera_movement = self.store.camera_movement(frames=(start, stop))
+            possession_team = self.store.possession_team(frames=(start, stop))
+            windows = {name: seconds * self.fps for name, seconds in self.possession_windows.items()}
+            possession = PossessionStatistics(windows)
+            # replaying from far enough back refills every rolling window
+            checkpoint = self.store.possession_checkpoint(start - int(max(windows.values(), default=0)))
+            possession.prime(checkpoint['totals'], checkpoint['last_team'])
+            possession.extend(self.store.possession_team(frames=(checkpoint['frame'], start)))
+
+        decode = dict(self.video_io.get('decode', {}))
+        reader = ThreadedVideoReader(self.video_path, profiler=profiler, backend=decode.pop('backend', 'opencv'),
+                                     start=start, stop=stop, seek_index=self.seek_index, **decode)
+        try:
+            for frame_num, frame in enumerate(reader):
+                with profiler.stage('render'):
+                    possession.update(possession_team[frame_num])
+                    self.renderer.render(frame, {obj: tracks[obj][frame_num] for obj in OBJECT_TYPES}, possession,
+                                         camera_movement[frame_num])
+                profiler.add_frames()
+                yield frame
+        finally:
+            reader.close()
+
+    def render(self, output_path, frames=None, seconds=None):
+        """
+        Write an annotated clip, see `clip_range`, to `output_path`.
+
+        Returns:
+            Dict with the clip's 'start' and 'stop' frames, the 'frames'
+            written, the frames 'decoded' to reach and read them and the
+            'wall_time'.
+        """
+        start, stop = self.clip_range(frames, seconds)
+        self.profiler.start()
+        encode = dict(self.video_io.get('encode', {}))
+        writer = ThreadedVideoWriter(output_path, fps=self.fps, profiler=self.profiler,
+                                     backend=encode.pop('backend', 'opencv'), **encode)
+        began = time.perf_counter()
+        written = 0
+        try:
+            with writer:
+                for frame in self.iter_clip(frames=(start, stop)):
+                    writer.write(frame)
+                    written += 1
+        finally:
+            self.profiler.stop()
+        return {'start': start, 'stop': stop, 'frames': written,
+                'decoded': self.seek_index.decode_cost(start, stop),
+                'wall_time': round(time.perf_counter() - began, 3)}
+
+
+def parse_time(value):
+    """
+    Seconds of a time given as seconds, 'mm:ss' or 'hh:mm:ss'.
+    """
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render an annotated clip from the export of an analysed match.')
+    parser.add_argument('export', help='.parquet or .arrow file of a pipeline run with export_path')
+    parser.add_argument('output', help='annotated clip to write')
+    parser.add_argument('--start', required=True, help="start time, in seconds or as 'mm:ss'")
+    parser.add_argument('--duration', type=float, default=20.0, help='length of the clip in seconds')
+    parser.add_argument('--video', default=None, help='the analysed video, if it has moved since the export')
+    parser.add_argument('--cache-dir', default='stubs/stage_cache', help='where the seek index is kept')
+    args = parser.parse_args(argv)
+
+    start = parse_time(args.start)
+    renderer = ClipRenderer(args.export, video_path=args.video, cache_dir=args.cache_dir)
+    report = renderer.render(args.output, seconds=(start, start + args.duration))
+    print(f"frames {report['start']}-{report['stop']}: {report['frames']} written, {report['decoded']} decoded "
+          f"in {report['wall_time']} s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
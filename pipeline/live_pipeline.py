@@ -0,0 +1,284 @@
+import csv
+import json
+import os
+import time
+import numpy as np
+from .streaming_pipeline import StreamingPipeline
+from utils import LiveVideoReader, ThreadedVideoWriter, MatchExporter, OBJECT_TYPES
+
+# Work shed under load, lightest first: run YOLO only every
+# `keyframe_interval` frames, re-evaluate uncertain team assignments only
+# every `team_interval` frames, and draw every overlay ('full'), the
+# objects without the panels ('objects') or nothing at all (None).
+LOAD_LEVELS = (
+    {'keyframe_interval': 1, 'team_interval': 1, 'overlays': 'full'},
+    {'keyframe_interval': 2, 'team_interval': 1, 'overlays': 'full'},
+    {'keyframe_interval': 4, 'team_interval': 12, 'overlays': 'full'},
+    {'keyframe_interval': 8, 'team_interval': 24, 'overlays': 'objects'},
+    {'keyframe_interval': 8, 'team_interval': 48, 'overlays': None},
+)
+
+
+class LivePipeline(StreamingPipeline):
+    """
+    Runs the analysis on a live feed, one frame at a time as it arrives.
+
+    Every stage is causal: a frame is finalized as soon as it is analysed,
+    so a missing ball is held at its last position for `ball_hold_frames`
+    frames instead of being interpolated toward a later detection, and
+    speeds only use past frames. Frames keep the number the reader gave
+    them, so frames dropped on the way show up as gaps in the tracks and
+    speeds stay measured over the actual time elapsed.
+
+    End-to-end latency runs from the moment a frame arrives until its
+    annotated version is handed to the output. When a frame went over
+    `latency_budget` or frames had to be dropped since the last change, the
+    pipeline moves one step down `load_levels`, shedding work, at most once
+    every `settle_frames` frames; once every frame of the last
+    `settle_frames` stayed below `relax_fraction` of the budget, it moves
+    back up. A frame that is already older than the budget when its turn
+    comes is skipped if a newer one is waiting.
+    """
+    def __init__(self, model_path, latency_budget=0.25, load_levels=LOAD_LEVELS, settle_frames=24,
+                 relax_fraction=0.5, buffer_size=2, ball_hold_frames=12, camera_motion_model='translation',
+                 flow_scale=1.0, pitch_follows_camera=False, possession_hysteresis_frames=0,
+                 possession_windows=None, profiler=None, keyframe_motion_scale=None, keyframe_max_lost=None,
+                 ball_crop_size=None, detector=None):
+        """
+        Args:
+            model_path: Path to the YOLO weights.
+            latency_budget: Target end-to-end latency per frame, in seconds.
+            load_levels: Sequence of dicts with the 'keyframe_interval',
+                'team_interval' and 'overlays' of every load level, from
+                full quality to the cheapest. See LOAD_LEVELS.
+            settle_frames: Frames to wait after a level change before the
+                next one.
+            relax_fraction: Fraction of the budget every frame has to stay
+                under before work is added back.
+            buffer_size: Frames the reader keeps while the pipeline is busy;
+                older ones are dropped.
+            ball_hold_frames: Frames a missing ball is held at its last
+                position.
+            camera_motion_model, flow_scale, pitch_follows_camera,
+            possession_hysteresis_frames, possession_windows, profiler,
+            keyframe_motion_scale, keyframe_max_lost, ball_crop_size, detector:
+                As for StreamingPipeline.
+        """
+        self.load_levels = [dict(level) for level in load_levels]
+        super().__init__(model_path, chunk_size=1, lookahead=0,
+                         camera_motion_model=camera_motion_model, flow_scale=flow_scale,
+                         pitch_follows_camera=pitch_follows_camera,
+                         possession_hysteresis_frames=possession_hysteresis_frames,
+                         possession_windows=possession_windows, profiler=profiler,
+                         keyframe_interval=max(level['keyframe_interval'] for level in self.load_levels),
+                         keyframe_motion_scale=keyframe_motion_scale, keyframe_max_lost=keyframe_max_lost,
+                         ball_crop_size=ball_crop_size, detector=detector)
+        self.tracker.ball_interpolator.max_gap = ball_hold_frames
+        self.latency_budget = latency_budget
+        self.settle_frames = settle_frames
+        self.relax_fraction = relax_fraction
+        self.buffer_size = buffer_size
+        self.reader = None
+        self.latencies = []
+
+    def run(self, source, output_path=None, realtime=None, max_frames=None, export_path=None):
+        """
+        Analyse a live feed until it ends or `max_frames` frames have been
+        captured.
+        Args:
+            source: RTSP/HTTP URL, camera index, or path to a video file or
+                pipe, see LiveVideoReader.
+            output_path: Optional path of the annotated video.
+            realtime: Replay a file at its frame rate. Defaults to True for
+                regular files.
+            max_frames: Stop after this many captured frames.
+            export_path: Optional .parquet or .arrow file receiving the
+                tracks of the processed frames, see `MatchExporter`.
+
+        Returns:
+            The latency report, see `latency_report`.
+        """
+        self.profiler.start()
+        self.profiling = True
+        reader = LiveVideoReader(source, buffer_size=self.buffer_size, realtime=realtime, profiler=self.profiler)
+        self.fps = reader.fps
+        self.speed_estimator.frame_rate = reader.fps
+        writer = None
+        if output_path is not None:
+            writer = ThreadedVideoWriter(output_path, fps=reader.fps, queue_size=self.io_queue_size,
+                                         profiler=self.profiler)
+            self.profiler.watch_queue('encode_queue', writer.stats)
+        if export_path is not None:
+            self.exporter = MatchExporter(export_path, reader.fps, metadata={'source': str(source)})
+        try:
+            for frame_num, frame in self.process(reader):
+                if writer is not None:
+                    writer.write(frame)
+                if max_frames is not None and reader.captured >= max_frames:
+                    break
+            if self.exporter is not None:
+                self.exporter.close()
+        finally:
+            if self.exporter is not None:
+                self.exporter.abort()
+                self.exporter = None
+            reader.close()
+            if writer is not None:
+                writer.close()
+            self.profiler.stop()
+            self.profiling = False
+        return self.latency_report()
+
+    def process(self, reader):
+        """
+        Analyse and annotate a live feed.
+        Args:
+            reader: A LiveVideoReader, or any iterable of
+                `(frame_num, frame, capture_time)` tuples with increasing
+                frame numbers.
+
+        Yields:
+            (frame_num, annotated frame) for every frame that was not
+            dropped, as soon as it is ready.
+        """
+        self.begin()
+        self.reader = reader
+        self.latencies = []
+        self.level = 0
+        self.level_frames = 0
+        self.calm_frames = 0
+        self.skipped = 0
+        self.drops_seen = 0
+        self.apply_level()
+
+        for frame_num, frame, capture_time in reader:
+            waiting = reader.waiting() if hasattr(reader, 'waiting') else 0
+            if waiting and time.perf_counter() - capture_time > self.latency_budget:
+                # too late to be worth the work, and a newer frame is ready
+                self.skipped += 1
+                continue
+            self.seek(frame_num)
+            records = self.analyse_chunk([frame])
+            for output in self.finalize(records, 1):
+                latency = time.perf_counter() - capture_time
+                self.latencies.append({'frame': frame_num, 'latency_ms': round(latency * 1000, 3),
+                                       'load_level': self.level, 'detected': self.detected()})
+                self.adapt(latency)
+                yield frame_num, output
+        self.profiler.stop()
+
+    def seek(self, frame_num):
+        """
+        Number the next frame `frame_num`, after frames that were dropped.
+        """
+        self.frame_read = self.frame_count = frame_num
+        # the camera estimator and detectors continue from the last frame they saw
+        self.camera_frame = self.detection_frame = frame_num
+
+    def detected(self):
+        keyframe_detector = self.tracker.keyframe_detector
+        return bool(keyframe_detector is None or keyframe_detector.keyframes[-1:].all())
+
+    def dropped(self):
+        """
+        Frames dropped by the reader or skipped as stale so far.
+        """
+        return getattr(self.reader, 'dropped', 0) + self.skipped
+
+    def adapt(self, latency):
+        """
+        Move between load levels after a frame with end-to-end `latency`.
+        """
+        self.level_frames += 1
+        dropped = self.dropped()
+        late = latency > self.latency_budget or dropped > self.drops_seen
+        self.drops_seen = dropped
+        self.overloaded |= late
+        self.calm_frames = 0 if late or latency > self.relax_fraction * self.latency_budget \
+            else self.calm_frames + 1
+        if self.level_frames < self.settle_frames:
+            return
+        if self.overloaded and self.level < len(self.load_levels) - 1:
+            self.level += 1
+        elif self.calm_frames >= self.settle_frames and self.level > 0:
+            self.level -= 1
+        else:
+            return
+        self.apply_level()
+
+    def apply_level(self):
+        settings = self.load_levels[self.level]
+        if self.tracker.keyframe_detector is not None:
+            self.tracker.keyframe_detector.interval = max(1, settings['keyframe_interval'])
+        self.level_frames = 0
+        self.calm_frames = 0
+        self.overloaded = False
+
+    def assign_teams(self, frame, players):
+        team_interval = self.load_levels[self.level]['team_interval']
+        if not self.team_assigner.team_colors or len(self.latencies) % max(1, team_interval) == 0:
+            super().assign_teams(frame, players)
+            return
+        for player_id, team_id in self.team_assigner.get_cached_player_teams(players).items():
+            players[player_id]['team_id'] = team_id
+            players[player_id]['team_color'] = self.team_assigner.team_colors[team_id]
+
+    def render(self, record):
+        overlays = self.load_levels[self.level]['overlays']
+        if overlays == 'full':
+            super().render(record)
+        elif overlays == 'objects':
+            self.renderer.draw_objects(record['frame'], {obj: record[obj] for obj in OBJECT_TYPES})
+
+    def latency_report(self):
+        """
+        Summary of the end-to-end latency of the frames processed so far.
+
+        Returns:
+            Dict with the frames processed and dropped, the latency budget,
+            mean and percentile latencies in milliseconds, the fraction of
+            frames over budget, the frames spent at every load level, and
+            the per-frame entries under 'per_frame'.
+        """
+        latency = np.array([entry['latency_ms'] for entry in self.latencies], dtype=np.float64)
+        levels = np.bincount([entry['load_level'] for entry in self.latencies], minlength=len(self.load_levels))
+        budget_ms = self.latency_budget * 1000
+
+        def percentile(q):
+            return round(float(np.percentile(latency, q)), 3) if len(latency) else None
+
+        return {
+            'frames': len(latency),
+            'captured': getattr(self.reader, 'captured', len(latency)),
+            'dropped': self.dropped(),
+            'latency_budget_ms': budget_ms,
+            'mean_ms': round(float(latency.mean()), 3) if len(latency) else None,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'p99_ms': percentile(99),
+            'max_ms': round(float(latency.max()), 3) if len(latency) else None,
+            'over_budget': round(float(np.mean(latency > budget_ms)), 4) if len(latency) else 0.0,
+            'detected_fraction': round(float(np.mean([entry['detected'] for entry in self.latencies])), 4)
+            if self.latencies else 0.0,
+            'frames_per_level': levels.tolist(),
+            'per_frame': list(self.latencies),
+        }
+
+    def write_latency_report(self, path):
+        """
+        Write the latency report as JSON, or only the per-frame entries as
+        CSV when the path ends in '.csv'.
+        """
+        report = self.latency_report()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not path.endswith('.csv'):
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            return report
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['frame', 'latency_ms', 'load_level', 'detected'])
+            writer.writeheader()
+            writer.writerows(report['per_frame'])
+        return report
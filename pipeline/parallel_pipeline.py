@@ -0,0 +1,403 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from trackers import Tracker, prepare_detector
+from team_assigner import TeamAssigner
+from player_ball_assigner import PlayerBallAssigner, PossessionStatistics
+from camera_movment_estimator import CameraMovementEstimator
+from view_transformer import ViewTransformer
+from speed_and_distance_estimator import SpeedAndDistanceEstimator
+from utils import iter_video, iter_chunks, get_video_fps, get_frame_count, get_bbox_iou
+from utils import ThreadedVideoReader, ThreadedVideoWriter, TrackTable, OBJECT_TYPES, FrameRenderer, MatchExporter
+
+# per-process state of the pool workers, created once by _init_worker
+_worker = {}
+
+
+def _init_worker(model_path, tracker_options, team_options):
+    _worker['tracker'] = Tracker(model_path, **tracker_options)
+    _worker['team_assigner'] = TeamAssigner(**team_options)
+
+
+def _analyse_segment(video_path, start, stop, chunk_size, camera_options):
+    """
+    Decode frames [start, stop) and run the stages that only need pixels:
+    detection, tracking, camera motion and jersey color extraction.
+
+    Runs in a pool worker with a fresh ByteTrack and camera estimator, so
+    the result only depends on the frame range.
+
+    Returns:
+        Dict with the segment's TrackTable (frames relative to `start`),
+        the jersey color of every row (NaN for non-players), the per-frame
+        camera transforms and the frame shape.
+    """
+    tracker = _worker['tracker']
+    team_assigner = _worker['team_assigner']
+    tracker.reset()
+    camera_estimator = None
+    frame_shape = None
+    tables, colors, transforms = [], [], []
+    player_type = OBJECT_TYPES.index('players')
+
+    for frames in iter_chunks(iter_video(video_path, start, stop), chunk_size):
+        if camera_estimator is None:
+            camera_estimator = CameraMovementEstimator(frames[0], **camera_options)
+            frame_shape = frames[0].shape
+        table = TrackTable.from_tracks(tracker.track_frames(frames))
+        transforms.append(camera_estimator.get_camera_transforms_chunk(frames))
+
+        chunk_colors = np.full((len(table), 3), np.nan, dtype=np.float32)
+        for frame_num, frame in enumerate(frames):
+            rows = table.rows_for_frame(frame_num)
+            rows = rows[table.object_type[rows] == player_type]
+            if len(rows):
+                chunk_colors[rows] = team_assigner.get_player_colors(frame, table.bbox[rows])
+        tables.append(table)
+        colors.append(chunk_colors)
+
+    return {
+        'table': TrackTable.concatenate(tables),
+        'colors': np.concatenate(colors) if colors else np.zeros((0, 3), dtype=np.float32),
+        'transforms': np.concatenate(transforms) if transforms else np.zeros((0, 3, 3)),
+        'frame_shape': frame_shape,
+    }
+
+
+class ParallelPipeline:
+    """
+    Analyses one long video with a pool of worker processes.
+
+    The video is cut into segments of `segment_length` frames. Each worker
+    decodes its segment plus the `overlap` frames before it and runs
+    detection, tracking, camera motion and jersey color extraction on them.
+    The overlap warms up ByteTrack and the optical flow, and is used to
+    re-link the segment's track IDs to the previous segment's: tracks whose
+    boxes overlap (IoU >= `min_link_iou`) in at least `min_link_frames`
+    overlap frames are matched one-to-one and keep the earlier ID. Camera
+    transforms are per-frame, so cumulative camera motion carries across
+    seams by simply chaining them. The cheap whole-match stages (ball
+    interpolation, positions, pitch mapping, speed, team votes, possession)
+    then run vectorized on the stitched TrackTable.
+
+    The result is deterministic: segments are stitched in order and do not
+    depend on worker scheduling or on the number of workers. Compared with
+    a `StreamingPipeline` run of the same video:
+        - boxes, positions and ball interpolation are identical, but track
+          IDs are numbered differently;
+        - a track is split in two when it does not survive `min_link_frames`
+          of the overlap in both segments (e.g. it appears in the last few
+          overlap frames);
+        - camera movement can differ by up to the estimator's
+          `minimum_distance` in the first frames after a seam, because the
+          optical flow features are re-detected there;
+        - a player's team is the majority vote of the whole track rather
+          than the running vote, so it can differ in the first frames of an
+          ambiguous track;
+        - ball gaps are interpolated over the whole match rather than
+          within the look-ahead window.
+    """
+    def __init__(self, model_path, workers=None, segment_length=1500, overlap=48, chunk_size=64,
+                 camera_motion_model='translation', flow_scale=1.0, pitch_follows_camera=False,
+                 possession_hysteresis_frames=0, possession_windows=None, min_link_iou=0.5,
+                 min_link_frames=3, io_queue_size=64, detector=None):
+        """
+        Args:
+            model_path: Path to the YOLO weights, loaded once per worker.
+            workers: Number of worker processes. Defaults to the CPU count.
+            segment_length: Frames analysed by one worker task.
+            overlap: Frames decoded before each segment (except the first)
+                for warm-up and ID re-linking.
+            chunk_size: Frames detected and tracked together in a worker.
+            camera_motion_model: Global motion model of the camera movement
+                estimator.
+            flow_scale: Downscale factor for the camera movement optical flow.
+            pitch_follows_camera: Map positions to the pitch through the
+                accumulated camera transforms.
+            possession_hysteresis_frames: Frames a new player has to be
+                closest to the ball before possession switches to them.
+            possession_windows: Dict of rolling possession window name to
+                length in seconds. Defaults to the last 5 minutes.
+            min_link_iou: Minimum box IoU for two tracks to match in an
+                overlap frame.
+            min_link_frames: Minimum number of matching overlap frames to
+                re-link two tracks.
+            io_queue_size: Capacity of the decode and encode queues used
+                while rendering.
+            detector: Optional dict of detector backend options, see
+                `trackers.load_detector`. The model is exported once up
+                front, and the workers share the CPUs between their
+                inference threads unless 'threads' is given.
+        """
+        if overlap < 1:
+            raise ValueError("overlap must be at least 1 frame to re-link tracks.")
+        self.model_path = model_path
+        self.workers = workers or os.cpu_count() or 1
+        self.segment_length = segment_length
+        self.overlap = overlap
+        self.chunk_size = chunk_size
+        self.camera_options = {'motion_model': camera_motion_model, 'flow_scale': flow_scale}
+        self.pitch_follows_camera = pitch_follows_camera
+        self.min_link_iou = min_link_iou
+        self.min_link_frames = min_link_frames
+        self.io_queue_size = io_queue_size
+        self.detector = dict(detector or {})
+        self.tracker = Tracker(model_path=None)
+        self.team_assigner = TeamAssigner()
+        self.player_assigner = PlayerBallAssigner(hysteresis_frames=possession_hysteresis_frames)
+        self.view_transformer = ViewTransformer()
+        self.speed_estimator = SpeedAndDistanceEstimator()
+        self.renderer = FrameRenderer()
+        self.camera_estimator = None
+        self.possession_windows = {'Last 5 min': 300} if possession_windows is None else possession_windows
+        self.fps = 24
+        self.table = None
+        self.colors = None
+        self.camera_transforms = None
+        self.camera_movement = None
+        self.possession = None
+
+    def run(self, video_path, output_path=None, export_path=None):
+        """
+        Analyse `video_path` and, when `output_path` is given, write the
+        annotated video there; with `export_path`, write the tracks to a
+        .parquet or .arrow file as well, see `export`.
+
+        Returns:
+            The stitched TrackTable of the whole video.
+        """
+        self.analyse(video_path)
+        if export_path is not None:
+            self.export(export_path, metadata={'video': os.path.abspath(video_path)})
+        if output_path is not None:
+            self.render(video_path, output_path)
+        return self.table
+
+    def export(self, path, **options):
+        """
+        Write the analysed tracks and possession to a columnar file that
+        `utils.MatchStore` can query.
+        Args:
+            path: Output .parquet or .arrow/.feather file.
+            **options: Further MatchExporter arguments.
+
+        Returns:
+            The exporter's summary.
+        """
+        with MatchExporter(path, self.fps, **options) as exporter:
+            exporter.metadata['team_colors'] = {
+                str(team): np.asarray(color).tolist() for team, color in self.team_assigner.team_colors.items()}
+            exporter.write(self.table, possession_team=self.possession['team_id'])
+        return exporter.summary()
+
+    def segments(self, num_frames):
+        """
+        Split a video into segments.
+
+        Returns:
+            List of (decode_start, start, stop) frame indices. Frames
+            [start, stop) belong to the segment; [decode_start, start) is
+            the overlap with the previous one. The last stop is None, so
+            the last worker reads to the end even if the frame count in the
+            header is short.
+        """
+        starts = list(range(0, max(num_frames, 1), self.segment_length))
+        stops = starts[1:] + [None]
+        return [(max(start - self.overlap, 0), start, stop) for start, stop in zip(starts, stops)]
+
+    def analyse(self, video_path):
+        """
+        Run every analysis stage on `video_path` with the worker pool.
+        """
+        self.fps = get_video_fps(video_path)
+        segments = self.segments(get_frame_count(video_path))
+        engine = self.tracker.inference_engine
+        workers = min(self.workers, len(segments))
+        tracker_options = {'batch_size': engine.batch_size, 'memory_budget_mb': engine.memory_budget_mb,
+                           'conf': engine.conf,
+                           'detector': prepare_detector(self.model_path, self.detector, workers)}
+        team_options = {'crop_size': self.team_assigner.crop_size}
+
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(self.model_path, tracker_options, team_options)) as pool:
+            futures = [pool.submit(_analyse_segment, video_path, decode_start, stop,
+                                   self.chunk_size, self.camera_options)
+                       for decode_start, _, stop in segments]
+            results = [future.result() for future in futures]
+
+        self.stitch(segments, results)
+        self.enrich()
+
+    def stitch(self, segments, results):
+        """
+        Join the per-segment results into whole-video arrays, re-linking the
+        track IDs of each segment to the previous one.
+        """
+        tables, colors, transforms = [], [], []
+        previous = None
+        next_id = 0
+        ball = OBJECT_TYPES.index('ball')
+        for (decode_start, start, stop), result in zip(segments, results):
+            table = result['table']
+            if result['frame_shape'] is not None and self.camera_estimator is None:
+                self.camera_estimator = CameraMovementEstimator(np.zeros(result['frame_shape'][:2], np.uint8),
+                                                                **self.camera_options)
+            own_start = start - decode_start
+            own_stop = table.num_frames if stop is None else min(stop - decode_start, table.num_frames)
+            if own_stop <= own_start:
+                continue
+
+            links = {} if previous is None else self.link_tracks(*previous, table, decode_start, own_start)
+            id_map = {}
+            for local_id in np.unique(table.track_id[table.object_type != ball]).tolist():
+                if local_id in links:
+                    id_map[local_id] = links[local_id]
+                elif previous is None:
+                    id_map[local_id] = local_id
+                else:
+                    id_map[local_id] = next_id = next_id + 1
+                next_id = max(next_id, id_map[local_id])
+            track_id = np.array([id_map.get(tid, tid) for tid in table.track_id.tolist()], dtype=np.int32)
+            table = TrackTable(table.num_frames, table.frame, table.object_type,
+                               np.where(table.object_type == ball, table.track_id, track_id),
+                               {name: getattr(table, name) for name in table.filled | {'bbox'}})
+
+            rows = np.arange(table.frame_offsets[own_start], table.frame_offsets[own_stop])
+            tables.append(table.select(rows, num_frames=own_stop - own_start, frame_offset=own_start))
+            colors.append(result['colors'][rows])
+            transforms.append(result['transforms'][own_start:own_stop])
+            previous = (table, decode_start)
+
+        self.table = TrackTable.concatenate(tables)
+        self.colors = np.concatenate(colors) if colors else np.zeros((0, 3), dtype=np.float32)
+        self.camera_transforms = np.concatenate(transforms) if transforms else np.zeros((0, 3, 3))
+
+    def link_tracks(self, previous_table, previous_start, table, start, overlap_frames):
+        """
+        Match the track IDs of a segment to the previous segment's.
+        Args:
+            previous_table: TrackTable of the previous segment, with its
+                track IDs already mapped to global IDs.
+            previous_start: Video frame of `previous_table`'s first frame.
+            table: TrackTable of the current segment, with local IDs.
+            start: Video frame of `table`'s first frame.
+            overlap_frames: Number of frames at the start of `table` that
+                the previous segment also analysed.
+
+        Returns:
+            Dict of local track ID to the matched global track ID.
+        """
+        ball = OBJECT_TYPES.index('ball')
+        pairs = {}
+        for frame_num in range(min(overlap_frames, table.num_frames)):
+            previous_frame = start - previous_start + frame_num
+            if previous_frame >= previous_table.num_frames:
+                break
+            rows_a = previous_table.rows_for_frame(previous_frame)
+            rows_a = rows_a[previous_table.object_type[rows_a] != ball]
+            rows_b = table.rows_for_frame(frame_num)
+            rows_b = rows_b[table.object_type[rows_b] != ball]
+            if len(rows_a) == 0 or len(rows_b) == 0:
+                continue
+            iou = get_bbox_iou(previous_table.bbox[rows_a], table.bbox[rows_b])
+            for i, j in zip(*np.nonzero(iou >= self.min_link_iou)):
+                key = (int(previous_table.track_id[rows_a[i]]), int(table.track_id[rows_b[j]]))
+                count, total = pairs.get(key, (0, 0.0))
+                pairs[key] = (count + 1, total + iou[i, j])
+
+        if not pairs:
+            return {}
+        global_ids = sorted({a for a, _ in pairs})
+        local_ids = sorted({b for _, b in pairs})
+        score = np.zeros((len(global_ids), len(local_ids)))
+        counts = np.zeros_like(score)
+        for (a, b), (count, total) in pairs.items():
+            score[global_ids.index(a), local_ids.index(b)] = total
+            counts[global_ids.index(a), local_ids.index(b)] = count
+        matched_a, matched_b = linear_sum_assignment(score, maximize=True)
+        return {local_ids[j]: global_ids[i] for i, j in zip(matched_a, matched_b)
+                if counts[i, j] >= self.min_link_frames}
+
+    def enrich(self):
+        """
+        Run the whole-match stages on the stitched table.
+        """
+        table = self.tracker.interpolate_ball_rows(self.table)
+        colors = self.colors
+        if table is not self.table:
+            # the ball rows were rebuilt; the other rows keep their order
+            ball = OBJECT_TYPES.index('ball')
+            colors = np.full((len(table), 3), np.nan, dtype=np.float32)
+            colors[table.object_type != ball] = self.colors[self.table.object_type != ball]
+        self.table = table
+        self.tracker.add_positions_to_tracks(table)
+        self.camera_movement = self.camera_estimator.movement_from_transforms(self.camera_transforms)
+        self.camera_estimator.add_adjust_positions_to_tracks(table, self.camera_movement)
+        frame_homographies = None
+        if self.pitch_follows_camera:
+            frame_homographies = np.linalg.inv(ViewTransformer.accumulate_camera_transforms(self.camera_transforms))
+        self.view_transformer.add_transformed_position_to_tracks(table, frame_homographies)
+        self.speed_estimator.frame_rate = self.fps
+        self.speed_estimator.add_speed_and_distance_to_tracks(table)
+        self.assign_teams(table, colors)
+        self.player_assigner.reset()
+        self.possession = self.player_assigner.assign_ball_to_tracks(table)
+
+    def assign_teams(self, table, colors):
+        """
+        Fit the team colors on the first frame with two distinct player
+        colors, then give every player track the team with the largest summed
+        classification margin over all its rows.
+        """
+        valid = ~np.isnan(colors).any(axis=1)
+        if not valid.any():
+            return
+        frames_with_players = np.bincount(table.frame[valid], minlength=table.num_frames)
+        for frame_num in np.flatnonzero(frames_with_players >= 2):
+            if self.team_assigner.fit_team_colors(colors[valid & (table.frame == frame_num)]):
+                break
+        else:
+            return
+
+        rows = np.flatnonzero(valid)
+        team_ids, confidence = self.team_assigner.predict_teams(colors[rows])
+        track_keys, track_index = np.unique(table.track_keys(rows), return_inverse=True)
+        votes = np.zeros((len(track_keys), 2))
+        np.add.at(votes, (track_index, team_ids - 1), confidence)
+        track_team = votes.argmax(axis=1) + 1
+
+        # players that never got a valid color stay without a team
+        player_rows = table.rows_of_type('players')
+        player_keys = table.track_keys(player_rows)
+        index = np.minimum(np.searchsorted(track_keys, player_keys), len(track_keys) - 1)
+        known = track_keys[index] == player_keys
+        team_id = track_team[index].astype(np.int8)
+        team_colors = np.stack([self.team_assigner.team_colors[1], self.team_assigner.team_colors[2]])
+        table.set_column('team_id', team_id[known], rows=player_rows[known])
+        table.set_column('team_color', team_colors[team_id[known] - 1], rows=player_rows[known])
+
+    def render(self, video_path, output_path):
+        """
+        Draw the analysis onto the video, reading and writing on background
+        threads.
+        """
+        possession_stats = PossessionStatistics(
+            {name: seconds * self.fps for name, seconds in self.possession_windows.items()})
+        tracks = self.table.as_tracks()
+        reader = ThreadedVideoReader(video_path, queue_size=self.io_queue_size)
+        writer = ThreadedVideoWriter(output_path, fps=self.fps, queue_size=self.io_queue_size)
+        try:
+            with writer:
+                for frame_num, frame in enumerate(reader):
+                    if frame_num >= self.table.num_frames:
+                        break
+                    possession_stats.update(self.possession['team_id'][frame_num])
+                    frame_tracks = {obj: tracks[obj][frame_num] for obj in OBJECT_TYPES}
+                    self.renderer.render(frame, frame_tracks, possession_stats, self.camera_movement[frame_num])
+                    writer.write(frame)
+        finally:
+            reader.close()
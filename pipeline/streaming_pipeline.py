@@ -0,0 +1,463 @@
+import os
+import numpy as np
+from trackers import Tracker, BallInterpolator, pack_detections, unpack_detections
+from team_assigner import TeamAssigner
+from player_ball_assigner import PlayerBallAssigner, PossessionStatistics
+from camera_movment_estimator import CameraMovementEstimator
+from view_transformer import ViewTransformer
+from speed_and_distance_estimator import SpeedAndDistanceEstimator
+from utils import iter_chunks, get_video_fps, ThreadedVideoReader, ThreadedVideoWriter, TrackTable
+from utils import FrameRenderer, OBJECT_TYPES
+from utils import StageCache, StageProfiler, FramePool, MatchExporter, file_checksum, video_fingerprint
+
+
+class StreamingPipeline:
+    """
+    Runs the full analysis on a video in fixed-size chunks.
+
+    Frames flow from the reader through detection, tracking, camera movement,
+    team assignment, ball assignment and annotation straight into the writer.
+    At most `chunk_size + lookahead` frames are alive at any time, so peak
+    memory does not depend on the length of the video.
+    """
+    def __init__(self, model_path, chunk_size=64, lookahead=None, io_queue_size=64,
+                 camera_motion_model='translation', flow_scale=1.0, pitch_follows_camera=False,
+                 possession_hysteresis_frames=0, possession_windows=None, cache_dir=None, profiler=None,
+                 keyframe_interval=1, keyframe_motion_scale=None, keyframe_max_lost=None, ball_crop_size=None,
+                 video_io=None, detector=None):
+        """
+        Args:
+            model_path: Path to the YOLO weights.
+            chunk_size: Number of frames detected and tracked together.
+            lookahead: Number of future frames kept before a frame is
+                finalized, used to interpolate ball gaps. Defaults to the
+                ball interpolator's `lookahead`, which reproduces a
+                whole-video run exactly; a shorter one holds the ball at its
+                last detection in gaps that reach past it.
+            io_queue_size: Capacity of the decode and encode queues that
+                run on background threads.
+            camera_motion_model: Global motion model of the camera movement
+                estimator.
+            flow_scale: Downscale factor for the camera movement optical flow.
+            pitch_follows_camera: Map positions to the pitch through the
+                accumulated camera transforms instead of the per-frame
+                camera-adjusted positions.
+            possession_hysteresis_frames: Frames a new player has to be
+                closest to the ball before possession switches to them.
+            possession_windows: Dict of rolling possession window name to
+                length in seconds. Defaults to the last 5 minutes.
+            cache_dir: Directory of the stage cache. Detections, camera
+                motion and team assignment are then stored per chunk and
+                reused on later runs of the same video.
+            profiler: Optional StageProfiler that times every stage,
+                including decoding and encoding, and the queues between
+                them. Nothing is measured without one.
+            keyframe_interval: Run YOLO at most every this many frames and
+                follow the boxes with optical flow in between.
+            keyframe_motion_scale: Pixels of camera movement that bring the
+                next keyframe one frame closer. None ignores camera motion.
+            keyframe_max_lost: Fraction of boxes the optical flow may lose
+                before a frame is detected anyway. None never adds keyframes.
+            ball_crop_size: Look for the ball in a full-resolution crop of
+                this size around its expected position. None relies on the
+                downscaled full-frame pass alone.
+            video_io: Optional dict of stage to video backend options, see
+                `utils.video_backends`: 'decode' for the frames that are
+                analysed and annotated, e.g. {'backend': 'pyav'}, 'encode'
+                for the output, e.g. {'backend': 'ffmpeg', 'codec':
+                'libx264'}, and 'camera_motion' for a separate, cheaper
+                decode feeding the camera movement stage, e.g.
+                {'backend': 'ffmpeg', 'gray': True, 'scale': flow_scale}.
+                Without 'camera_motion' that stage converts the decoded
+                colour frames itself.
+            detector: Optional dict of detector backend options, e.g.
+                {'backend': 'openvino', 'int8': True, 'calibration':
+                'input_videos/match.mp4'}. See `trackers.load_detector`.
+        """
+        self.model_path = model_path
+        self.tracker = Tracker(model_path=model_path, keyframe_interval=keyframe_interval,
+                               keyframe_motion_scale=keyframe_motion_scale, keyframe_max_lost=keyframe_max_lost,
+                               ball_crop_size=ball_crop_size, detector=detector)
+        self.team_assigner = TeamAssigner()
+        self.player_assigner = PlayerBallAssigner(hysteresis_frames=possession_hysteresis_frames)
+        self.view_transformer = ViewTransformer()
+        self.speed_estimator = SpeedAndDistanceEstimator()
+        self.renderer = FrameRenderer()
+        self.camera_estimator = None
+        self.camera_motion_model = camera_motion_model
+        self.flow_scale = flow_scale
+        self.pitch_follows_camera = pitch_follows_camera
+        self.reference_to_frame = None
+        self.chunk_size = chunk_size
+        if lookahead is None:
+            lookahead = self.tracker.ball_interpolator.lookahead or chunk_size
+        self.lookahead = max(lookahead, 1)
+        self.io_queue_size = io_queue_size
+        self.io_stats = {}
+        self.video_io = {stage: dict(options) for stage, options in (video_io or {}).items()}
+        self.camera_input_scale = self.video_io.get('camera_motion', {}).get('scale', 1.0)
+        self.frame_pool = None
+        self.fps = 24
+        self.possession_windows = {'Last 5 min': 300} if possession_windows is None else possession_windows
+        self.possession_stats = None
+        self.cache = StageCache(cache_dir) if cache_dir is not None else None
+        self.profiler = profiler if profiler is not None else StageProfiler(enabled=False)
+        # set while `run` owns the profiler's clock, so `begin` leaves it running
+        self.profiling = False
+        self.video_key = None
+        self.model_key = None
+        self.exporter = None
+
+    def run(self, video_path, output_path, export_path=None):
+        """
+        Analyse `video_path` and write the annotated video to `output_path`,
+        and the finalized tracks to `export_path` if given (a .parquet or
+        .arrow file, see `MatchExporter`).
+
+        Decoding and encoding run on background threads. Afterwards
+        `io_stats` holds the queue counters of both sides: a reader with a
+        large `consumer_stall_time` means analysis is waiting on decode, a
+        writer with a large `producer_stall_time` means it is waiting on
+        encode. With a profiler, its report covers the run once this returns.
+        """
+        # before the readers exist, so no decode timing lands in the stages a restart drops
+        self.profiler.start()
+        self.profiling = True
+        fps = get_video_fps(video_path)
+        self.fps = fps
+        self.speed_estimator.frame_rate = fps
+        if self.cache is not None:
+            self.video_key = video_fingerprint(video_path)
+            self.model_key = file_checksum(self.model_path)
+        # frames go back to the pool once encoded, so decoding reuses their buffers
+        self.frame_pool = FramePool()
+        decode = dict(self.video_io.get('decode', {}))
+        encode = dict(self.video_io.get('encode', {}))
+        reader = ThreadedVideoReader(video_path, queue_size=self.io_queue_size, profiler=self.profiler,
+                                     backend=decode.pop('backend', 'opencv'), pool=self.frame_pool, **decode)
+        writer = ThreadedVideoWriter(output_path, fps=fps, queue_size=self.io_queue_size, profiler=self.profiler,
+                                     backend=encode.pop('backend', 'opencv'), pool=self.frame_pool, **encode)
+        camera_reader = None
+        if 'camera_motion' in self.video_io:
+            camera = dict(self.video_io['camera_motion'])
+            camera_reader = ThreadedVideoReader(video_path, queue_size=self.io_queue_size, profiler=self.profiler,
+                                                backend=camera.pop('backend', 'opencv'), stage='camera_decode',
+                                                **camera)
+            self.profiler.watch_queue('camera_decode_queue', camera_reader.stats)
+        self.profiler.watch_queue('decode_queue', reader.stats)
+        self.profiler.watch_queue('encode_queue', writer.stats)
+        if export_path is not None:
+            self.exporter = MatchExporter(export_path, fps, metadata={'video': os.path.abspath(video_path)})
+        try:
+            with writer:
+                for frame in self.process(reader, camera_frames=camera_reader):
+                    writer.write(frame)
+            if self.exporter is not None:
+                self.exporter.close()
+        finally:
+            if self.exporter is not None:
+                # a run that failed leaves no export behind
+                self.exporter.abort()
+                self.exporter = None
+            reader.close()
+            if camera_reader is not None:
+                camera_reader.close()
+            self.profiler.stop()
+            self.profiling = False
+            self.io_stats = {'reader': reader.stats.as_dict(), 'writer': writer.stats.as_dict(),
+                             'frame_pool': self.frame_pool.as_dict()}
+            if camera_reader is not None:
+                self.io_stats['camera_reader'] = camera_reader.stats.as_dict()
+
+    def reset(self):
+        """
+        Forget everything learned from the previous video (tracks, camera
+        reference, team colors, ball holder) so the pipeline and its loaded
+        model can be reused for another one.
+        """
+        self.tracker.reset()
+        self.team_assigner.reset()
+        self.player_assigner.reset()
+        self.speed_estimator.reset()
+        self.camera_estimator = None
+        self.reference_to_frame = None
+
+    def process(self, frames, camera_frames=None):
+        """
+        Analyse and annotate a stream of frames.
+        Args:
+            frames: Iterable of consecutive frames, e.g. `iter_video(path)`.
+            camera_frames: Optional iterable of the same frames as decoded
+                for the camera movement stage, see `video_io`.
+
+        Yields:
+            Annotated frames, in order.
+        """
+        self.begin()
+        pending = []
+        camera_chunks = None if camera_frames is None else iter_chunks(camera_frames, self.chunk_size)
+
+        for chunk in iter_chunks(frames, self.chunk_size):
+            camera_chunk = None
+            if camera_chunks is not None:
+                camera_chunk = next(camera_chunks, [])
+                if len(camera_chunk) != len(chunk):
+                    raise ValueError("The camera motion decode returned fewer frames than the video")
+            pending.extend(self.analyse_chunk(chunk, camera_chunk))
+            ready = len(pending) - self.lookahead
+            if ready > 0:
+                yield from self.finalize(pending, ready)
+                del pending[:ready]
+
+        yield from self.finalize(pending, len(pending))
+        self.profiler.stop()
+
+    def begin(self):
+        """
+        Reset the pipeline and the per-video state before the first frame,
+        and start the profiler unless `run` already has.
+        """
+        self.reset()
+        if not self.profiling:
+            self.profiler.start()
+        self.frame_count = 0
+        self.possession_stats = PossessionStatistics(
+            {name: seconds * self.fps for name, seconds in self.possession_windows.items()})
+        self.frame_read = 0
+        self.camera_frame = 0
+        self.detection_frame = 0
+        self.previous_frame = None
+        self.previous_camera_frame = None
+        self.previous_detections = None
+        self.detection_state = None
+        self.detections_key = self.camera_key = self.teams_key = None
+
+    def analyse_chunk(self, frames, camera_frames=None):
+        """
+        Run the stages that only need the frames of the current chunk.
+        Args:
+            frames: Consecutive frames.
+            camera_frames: The same frames as decoded for the camera
+                movement stage, or None to use `frames`.
+
+        Returns:
+            List of per-frame records holding the frame and its tracks.
+        """
+        camera_input = frames if camera_frames is None else camera_frames
+        if self.camera_estimator is None:
+            self.camera_estimator = CameraMovementEstimator(camera_input[0], motion_model=self.camera_motion_model,
+                                                            flow_scale=self.flow_scale,
+                                                            input_scale=self.camera_input_scale)
+        frame_range = (self.frame_read, self.frame_read + len(frames))
+        self.frame_read += len(frames)
+        profiler = self.profiler
+
+        # camera motion comes first, it schedules the keyframes of the detector
+        with profiler.stage('camera_motion', len(frames)):
+            camera_transforms = self.get_camera_transforms(camera_input, frame_range)
+            camera_movement = self.camera_estimator.movement_from_transforms(camera_transforms)
+        with profiler.stage('detect', len(frames)):
+            detections = self.get_detections(frames, frame_range, camera_movement)
+        with profiler.stage('track', len(frames)):
+            table = TrackTable.from_tracks(self.tracker.track_detections(detections))
+            self.tracker.add_positions_to_tracks(table)
+        with profiler.stage('view_transform', len(frames)):
+            self.camera_estimator.add_adjust_positions_to_tracks(table, camera_movement)
+            frame_homographies = self.get_frame_homographies(camera_transforms)
+            self.view_transformer.add_transformed_position_to_tracks(table, frame_homographies)
+        with profiler.stage('teams', len(frames)):
+            self.get_teams(frames, frame_range, table)
+        tracks = table.as_tracks()
+        # copied: the frame itself is drawn on and its buffer recycled once written
+        self.previous_frame = frames[-1].copy()
+        self.previous_camera_frame = self.previous_frame if camera_frames is None else camera_frames[-1]
+
+        records = []
+        for frame_num, frame in enumerate(frames):
+            records.append({
+                'frame': frame,
+                'players': tracks['players'][frame_num],
+                'referees': tracks['referees'][frame_num],
+                'ball': tracks['ball'][frame_num],
+                'camera_movement': camera_movement[frame_num],
+                'camera_transform': camera_transforms[frame_num],
+                'frame_homography': None if frame_homographies is None else frame_homographies[frame_num],
+            })
+        return records
+
+    def cached(self, stage, key, compute):
+        """
+        Run `compute` through the stage cache when one is configured.
+        """
+        if self.cache is None or self.video_key is None:
+            return compute()
+        return self.cache.get_or_compute(stage, key, compute)
+
+    def get_detections(self, frames, frame_range, camera_movement):
+        engine = self.tracker.inference_engine
+        modes = self.tracker.detection_params()
+        params = dict({'conf': engine.conf, 'imgsz': engine.imgsz}, **self.tracker.detector_params(), **modes)
+        dependencies = {}
+        if modes:
+            # stateful detection depends on the previous chunk and the camera motion
+            dependencies['inputs'] = [self.detections_key, self.camera_key]
+        self.detections_key = StageCache.key(
+            'detections', video=self.video_key, frames=frame_range, model=self.model_key, params=params,
+            **dependencies)
+
+        def compute():
+            if not modes:
+                return pack_detections(self.tracker.detect_frames(frames))
+            if self.detection_frame != frame_range[0] and self.detection_state is not None:
+                # earlier chunks came from the cache, so the detector has to catch up
+                self.tracker.prime_detection(self.previous_frame, self.previous_detections, self.detection_state)
+            arrays, meta = pack_detections(self.tracker.detect_frames(frames, camera_movement))
+            if self.tracker.keyframe_detector is not None:
+                arrays['keyframe'] = self.tracker.keyframe_detector.keyframes
+            meta['state'] = self.tracker.detection_state()
+            self.detection_frame = frame_range[1]
+            return arrays, meta
+
+        arrays, meta = self.cached('detections', self.detections_key, compute)
+        detections = unpack_detections(arrays, meta)
+        if detections:
+            self.previous_detections = detections[-1]
+            self.detection_state = meta.get('state')
+        return detections
+
+    def get_camera_transforms(self, frames, frame_range):
+        estimator = self.camera_estimator
+        params = {'motion_model': estimator.motion_model, 'flow_scale': estimator.flow_scale,
+                  'minimum_distance': estimator.minimum_distance, 'ransac_threshold': estimator.ransac_threshold}
+        if 'camera_motion' in self.video_io:
+            # another decoder resamples the frames differently
+            params['decode'] = self.video_io['camera_motion']
+        self.camera_key = StageCache.key(
+            'camera_motion', video=self.video_key, frames=frame_range, inputs=[self.camera_key], params=params)
+
+        def compute():
+            if self.camera_frame != frame_range[0] and self.previous_camera_frame is not None:
+                # earlier chunks came from the cache, so the estimator has to catch up
+                estimator.prime(self.previous_camera_frame)
+            transforms = estimator.get_camera_transforms_chunk(frames)
+            self.camera_frame = frame_range[1]
+            return {'transforms': transforms}, {}
+
+        arrays, _ = self.cached('camera_motion', self.camera_key, compute)
+        return arrays['transforms']
+
+    def get_teams(self, frames, frame_range, table):
+        team_assigner = self.team_assigner
+        self.teams_key = StageCache.key(
+            'teams', video=self.video_key, frames=frame_range, inputs=[self.detections_key, self.teams_key],
+            params={'crop_size': team_assigner.crop_size,
+                    'kmeans_iterations': team_assigner.kmeans_iterations,
+                    'confidence_threshold': team_assigner.confidence_threshold})
+
+        def compute():
+            players = table.as_tracks()['players']
+            for frame_num, frame in enumerate(frames):
+                self.assign_teams(frame, players[frame_num])
+            team_colors = {str(k): np.asarray(v).tolist() for k, v in team_assigner.team_colors.items()}
+            return {'team_id': table.team_id.copy()}, {'team_colors': team_colors}
+
+        arrays, meta = self.cached('teams', self.teams_key, compute)
+        if not team_assigner.team_colors and meta['team_colors']:
+            team_assigner.team_colors = {int(k): np.array(v) for k, v in meta['team_colors'].items()}
+        team_id = np.asarray(arrays['team_id'])
+        table.set_column('team_id', team_id)
+        if team_assigner.team_colors:
+            colors = np.full((len(team_id), 3), np.nan, dtype=np.float32)
+            for team, color in team_assigner.team_colors.items():
+                colors[team_id == team] = color
+            table.set_column('team_color', colors)
+
+    def get_frame_homographies(self, camera_transforms):
+        """
+        Frame-to-reference homographies of a chunk, chained onto the previous
+        chunks, or None when the pitch mapping does not follow the camera.
+        """
+        if not self.pitch_follows_camera:
+            return None
+        reference_to_frame = ViewTransformer.accumulate_camera_transforms(
+            camera_transforms, initial=self.reference_to_frame)
+        self.reference_to_frame = reference_to_frame[-1]
+        return np.linalg.inv(reference_to_frame)
+
+    def assign_teams(self, frame, players):
+        if not self.team_assigner.team_colors:
+            # without two distinct jersey colors yet, the fit waits for a later frame
+            if len(players) < 2 or not self.team_assigner.assign_team_color(frame, players):
+                return
+
+        teams = self.team_assigner.get_player_teams(frame, players)
+        for player_id, team_id in teams.items():
+            players[player_id]['team_id'] = team_id
+            players[player_id]['team_color'] = self.team_assigner.team_colors[team_id]
+
+    def finalize(self, pending, count):
+        """
+        Complete and annotate the oldest `count` records of the window.
+
+        The remaining records are only used as look-ahead; their raw ball
+        detections are left untouched so they can be interpolated again
+        once more frames have arrived.
+        Args:
+            pending: Records that have not been written yet, in order.
+            count: Number of records to finalize.
+
+        Yields:
+            Annotated frames.
+        """
+        if count <= 0:
+            return
+
+        profiler = self.profiler
+        with profiler.stage('ball_interpolation', count):
+            ball_frame, ball_bbox = BallInterpolator.from_ball_tracks([record['ball'] for record in pending],
+                                                                      frame_offset=self.frame_count)
+            ball_bbox, interpolated = self.tracker.ball_interpolator.update(
+                ball_frame, ball_bbox, len(pending), count, frame_offset=self.frame_count)
+            ball = {'ball': BallInterpolator.to_ball_tracks(ball_bbox, interpolated)}
+            self.tracker.add_positions_to_tracks(ball)
+            self.camera_estimator.add_adjust_positions_to_tracks(
+                ball, [record['camera_movement'] for record in pending[:count]])
+            frame_homographies = None
+            if self.pitch_follows_camera:
+                frame_homographies = [record['frame_homography'] for record in pending[:count]]
+            self.view_transformer.add_transformed_position_to_tracks(ball, frame_homographies)
+
+        with profiler.stage('speed', count):
+            self.speed_estimator.update({'players': [record['players'] for record in pending[:count]]},
+                                        frame_offset=self.frame_count)
+
+        with profiler.stage('possession', count):
+            block = {'players': [record['players'] for record in pending[:count]], 'ball': ball['ball']}
+            possession = self.player_assigner.assign_ball_to_tracks(block)
+
+        if self.exporter is not None:
+            with profiler.stage('export', count):
+                if self.team_assigner.team_colors and 'team_colors' not in self.exporter.metadata:
+                    # recorded before the first rows, so clips can be drawn from the export alone
+                    self.exporter.metadata['team_colors'] = {
+                        str(team): np.asarray(color).tolist() for team, color in self.team_assigner.team_colors.items()}
+                block['referees'] = [record['referees'] for record in pending[:count]]
+                self.exporter.write(TrackTable.from_tracks(block), frame_offset=self.frame_count,
+                                    possession_team=possession['team_id'])
+
+        for frame_num in range(count):
+            record = pending[frame_num]
+            record['ball'] = ball['ball'][frame_num]
+            with profiler.stage('render'):
+                self.possession_stats.update(possession['team_id'][frame_num])
+                self.render(record)
+            self.frame_count += 1
+            profiler.add_frames()
+            yield record['frame']
+
+    def render(self, record):
+        """
+        Draw the overlays of a finalized record onto its frame.
+        """
+        frame_tracks = {obj: record[obj] for obj in OBJECT_TYPES}
+        self.renderer.render(record['frame'], frame_tracks, self.possession_stats, record['camera_movement'])
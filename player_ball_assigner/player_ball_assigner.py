@@ -1,9 +1,35 @@
 
 import numpy as np
+from scipy.spatial import cKDTree
+from utils import as_track_table, TrackTable
 
 class PlayerBallAssigner:
-    def __init__(self):
+    def __init__(self, hysteresis_frames=0, index='auto', kdtree_min_candidates=64):
+        """
+        Args:
+            hysteresis_frames: Number of consecutive frames a new player has
+                to be the closest before possession switches to them. 0
+                disables hysteresis.
+            index: 'brute' compares every ball with every player of its
+                frame, 'kdtree' queries a KD-tree, 'auto' picks the KD-tree
+                when a frame can have more than `kdtree_min_candidates`
+                ball-player pairs.
+            kdtree_min_candidates: Threshold used by index='auto'.
+        """
         self.max_player_distance = 70  # Maximum distance to consider a player as the ball holder
+        self.hysteresis_frames = hysteresis_frames
+        self.index = index
+        self.kdtree_min_candidates = kdtree_min_candidates
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the current ball holder, e.g. before a new video.
+        """
+        self.holder = -1
+        self.pending_id = -1
+        self.pending_length = 0
+
     def calculate_distance(self, bbox1, bbox2):
         """
         Calculate the Euclidean distance between the centers of two bounding boxes.
@@ -38,5 +64,158 @@ class PlayerBallAssigner:
 
         return closest_player_id
 
-    
-        
\ No newline at end of file
+    def assign_ball_to_tracks(self, tracks):
+        """
+        Assign the ball to a player in every frame at once.
+
+        Uses the same rule as `assign_ball` (closest bbox center within
+        `max_player_distance`), then applies hysteresis. When a frame has
+        several balls the closest ball-player pair wins. The rows of the
+        ball holders get 'has_ball' set.
+        Args:
+            tracks: A TrackTable or the legacy dict of per-frame track lists.
+
+        Returns:
+            Dict of per-frame arrays:
+                'player_id': track ID of the ball holder, -1 for none.
+                'player_row': table row of the holder in that frame, -1 for none.
+                'team_id': team of the holder, 0 for none or unknown.
+                'distance': ball-holder distance before hysteresis, NaN for none.
+        """
+        table = as_track_table(tracks)
+        number_of_frames = table.num_frames
+        player_rows = table.rows_of_type('players')
+        ball_rows = table.rows_of_type('ball')
+        player_rows = player_rows[np.isfinite(table.bbox[player_rows]).all(axis=1)]
+        ball_rows = ball_rows[np.isfinite(table.bbox[ball_rows]).all(axis=1)]
+
+        closest_row = np.full(number_of_frames, -1, dtype=np.int64)
+        closest_distance = np.full(number_of_frames, np.nan)
+        if len(player_rows) and len(ball_rows):
+            ball_index, player_index, distance = self._closest_pairs(table, player_rows, ball_rows)
+            found = player_index >= 0
+            # keep the closest ball-player pair of every frame
+            frames = table.frame[ball_rows[found]]
+            order = np.lexsort((distance[found], frames))
+            frames = frames[order]
+            first = np.ones(len(frames), dtype=bool)
+            first[1:] = frames[1:] != frames[:-1]
+            closest_row[frames[first]] = player_rows[player_index[found][order][first]]
+            closest_distance[frames[first]] = distance[found][order][first]
+
+        raw_player_id = np.where(closest_row >= 0, table.track_id[np.maximum(closest_row, 0)], -1)
+        player_id = self._apply_hysteresis(raw_player_id)
+        player_row = self._find_rows(table, player_rows, player_id)
+
+        team_id = np.zeros(number_of_frames, dtype=np.int8)
+        holder = player_row >= 0
+        if 'team_id' in table.filled:
+            team_id[holder] = table.team_id[player_row[holder]]
+        table.set_column('has_ball', True, rows=player_row[holder])
+        table.write_back(tracks, ['has_ball'])
+
+        return {
+            'player_id': player_id,
+            'player_row': player_row,
+            'team_id': team_id,
+            'distance': closest_distance,
+        }
+
+    def _closest_pairs(self, table, player_rows, ball_rows):
+        """
+        Closest player of every ball in the same frame within range.
+
+        Returns:
+            ball_index, player_index (into player_rows, -1 if none) and
+            distance arrays, one entry per ball row.
+        """
+        player_centers = self._centers(table.bbox[player_rows])
+        ball_centers = self._centers(table.bbox[ball_rows])
+        player_frames = table.frame[player_rows]
+        ball_frames = table.frame[ball_rows]
+
+        frame_starts = np.searchsorted(player_frames, np.arange(table.num_frames + 1))
+        players_per_frame = np.diff(frame_starts)
+        candidates = players_per_frame[ball_frames]
+
+        index = self.index
+        if index == 'auto':
+            index = 'kdtree' if candidates.max(initial=0) > self.kdtree_min_candidates else 'brute'
+
+        ball_index = np.arange(len(ball_rows))
+        if index == 'kdtree':
+            # frames are spread along a third axis so cross-frame pairs are out of range
+            spacing = 4.0 * self.max_player_distance
+            tree = cKDTree(np.column_stack([player_centers, player_frames * spacing]))
+            distance, player_index = tree.query(np.column_stack([ball_centers, ball_frames * spacing]),
+                                                k=1, distance_upper_bound=self.max_player_distance)
+            missing = ~np.isfinite(distance) | (distance >= self.max_player_distance)
+            player_index = np.where(missing, -1, player_index)
+            return ball_index, player_index, np.where(missing, np.nan, distance)
+
+        # brute force over every (ball, player of the same frame) pair
+        pair_ball = np.repeat(ball_index, candidates)
+        offsets = np.arange(len(pair_ball)) - np.repeat(np.cumsum(candidates) - candidates, candidates)
+        pair_player = frame_starts[ball_frames[pair_ball]] + offsets
+        pair_distance = np.linalg.norm(player_centers[pair_player] - ball_centers[pair_ball], axis=1)
+        in_range = pair_distance < self.max_player_distance
+
+        player_index = np.full(len(ball_rows), -1, dtype=np.int64)
+        distance = np.full(len(ball_rows), np.nan)
+        order = np.lexsort((pair_distance[in_range], pair_ball[in_range]))
+        balls = pair_ball[in_range][order]
+        first = np.ones(len(balls), dtype=bool)
+        first[1:] = balls[1:] != balls[:-1]
+        player_index[balls[first]] = pair_player[in_range][order][first]
+        distance[balls[first]] = pair_distance[in_range][order][first]
+        return ball_index, player_index, distance
+
+    @staticmethod
+    def _centers(bboxes):
+        bboxes = bboxes.astype(np.float64)
+        return np.column_stack([(bboxes[:, 0] + bboxes[:, 2]) / 2, (bboxes[:, 1] + bboxes[:, 3]) / 2])
+
+    def _apply_hysteresis(self, raw_player_id):
+        """
+        Only hand possession to a new player once they have been the closest
+        for `hysteresis_frames` consecutive frames; until then the previous
+        holder keeps it. State carries over between calls, so consecutive
+        chunks of a stream behave like one long call.
+        """
+        if self.hysteresis_frames <= 0 or len(raw_player_id) == 0:
+            return raw_player_id
+
+        player_id = raw_player_id.copy()
+        run_starts = np.flatnonzero(np.diff(raw_player_id, prepend=raw_player_id[0] - 1))
+        run_ends = np.append(run_starts[1:], len(raw_player_id))
+        for start, end in zip(run_starts, run_ends):
+            candidate = raw_player_id[start]
+            if candidate == -1 or candidate == self.holder:
+                self.pending_id, self.pending_length = -1, 0
+                continue
+            length = end - start
+            if candidate == self.pending_id:
+                length += self.pending_length
+            if length >= self.hysteresis_frames:
+                self.holder = candidate
+                self.pending_id, self.pending_length = -1, 0
+            else:
+                player_id[start:end] = self.holder
+                self.pending_id, self.pending_length = candidate, length
+        return player_id
+
+    @staticmethod
+    def _find_rows(table, player_rows, player_id):
+        """
+        Table row of each frame's player, -1 where they are not in the frame.
+        """
+        number_of_frames = table.num_frames
+        row_keys = table.track_keys(player_rows) * (number_of_frames + 1) + table.frame[player_rows]
+        order = np.argsort(row_keys)
+        row_keys = row_keys[order]
+        wanted = TrackTable.key_for('players', player_id) * (number_of_frames + 1) + np.arange(number_of_frames)
+        if len(row_keys) == 0:
+            return np.full(number_of_frames, -1, dtype=np.int64)
+        position = np.minimum(np.searchsorted(row_keys, wanted), len(row_keys) - 1)
+        found = (row_keys[position] == wanted) & (player_id >= 0)
+        return np.where(found, player_rows[order[position]], -1)
@@ -0,0 +1,124 @@
+import numpy as np
+
+
+class PossessionStatistics:
+    """
+    Running ball-control counters per team.
+
+    Every frame is credited to the team in control of the ball, or to the
+    team that last had it when nobody does, and updates cost O(1) per frame.
+    Besides the whole-match totals, any number of rolling windows (e.g. the
+    last 5 minutes) are kept with ring buffers, so memory depends on the
+    window lengths only. `update` and `extend` give identical results, so
+    streaming and whole-video runs agree.
+    """
+    number_of_teams = 2
+
+    def __init__(self, windows=None):
+        """
+        Args:
+            windows: Optional dict of window name to length in frames.
+        """
+        self.totals = np.zeros(self.number_of_teams + 1, dtype=np.int64)
+        self.last_team = 0
+        self.frames = 0
+        self.windows = {}
+        for name, length in (windows or {}).items():
+            self.windows[name] = {
+                'length': int(length),
+                'buffer': np.zeros(int(length), dtype=np.int8),
+                'position': 0,
+                'filled': 0,
+                'counts': np.zeros(self.number_of_teams + 1, dtype=np.int64),
+            }
+
+    def prime(self, totals, last_team):
+        """
+        Continue from counts taken elsewhere, e.g. a checkpoint of a match
+        export. The rolling windows start empty, so extend the statistics
+        with at least a window's worth of frames before reading them.
+        Args:
+            totals: Frames credited to nobody and to each team so far.
+            last_team: Team that last had the ball, 0 if none yet.
+        """
+        self.totals[:] = totals
+        self.frames = int(self.totals.sum())
+        self.last_team = int(last_team)
+
+    def update(self, team_id):
+        """
+        Credit one frame.
+        Args:
+            team_id: Team in control of the ball, 0 if nobody is.
+        """
+        team_id = int(team_id)
+        if team_id > 0:
+            self.last_team = team_id
+        team_id = self.last_team
+        self.totals[team_id] += 1
+        self.frames += 1
+
+        for window in self.windows.values():
+            buffer = window['buffer']
+            position = window['position']
+            if window['filled'] == window['length']:
+                window['counts'][buffer[position]] -= 1
+            else:
+                window['filled'] += 1
+            buffer[position] = team_id
+            window['counts'][team_id] += 1
+            window['position'] = (position + 1) % window['length']
+
+    def extend(self, team_ids):
+        """
+        Credit many consecutive frames at once.
+        Args:
+            team_ids: Team in control of the ball per frame, 0 if nobody is.
+        """
+        team_ids = np.asarray(team_ids, dtype=np.int64).reshape(-1)
+        if len(team_ids) == 0:
+            return
+        # carry the last known team forward over frames without possession
+        known = np.where(team_ids > 0, np.arange(len(team_ids)), -1)
+        known = np.maximum.accumulate(known)
+        credited = np.where(known >= 0, team_ids[np.maximum(known, 0)], self.last_team)
+        self.last_team = int(credited[-1])
+        self.totals += np.bincount(credited, minlength=self.number_of_teams + 1)
+        self.frames += len(credited)
+
+        for window in self.windows.values():
+            length = window['length']
+            history = np.roll(window['buffer'], -window['position'])[length - window['filled']:]
+            recent = np.concatenate([history, credited.astype(np.int8)])[-length:]
+            window['filled'] = len(recent)
+            window['buffer'][:] = 0
+            window['buffer'][:len(recent)] = recent
+            window['position'] = len(recent) % length
+            window['counts'] = np.bincount(recent, minlength=self.number_of_teams + 1).astype(np.int64)
+
+    def shares(self, window=None):
+        """
+        Fraction of credited frames per team, over the match or a window.
+        Args:
+            window: Name of a rolling window, or None for the whole match.
+
+        Returns:
+            Dict of team ID to share in [0, 1].
+        """
+        counts = self.totals if window is None else self.windows[window]['counts']
+        controlled = counts[1:].sum()
+        return {team_id: float(counts[team_id] / (controlled + 1e-6))  # Avoid division by zero
+                for team_id in range(1, self.number_of_teams + 1)}
+
+    def as_dict(self):
+        """
+        Plain-Python summary for JSON or CSV export.
+        """
+        return {
+            'frames': self.frames,
+            'frames_per_team': {team_id: int(self.totals[team_id])
+                                for team_id in range(1, self.number_of_teams + 1)},
+            'shares': self.shares(),
+            'windows': {name: {'length': window['length'], 'shares': self.shares(name)}
+                        for name, window in self.windows.items()},
+        }
@@ -1,76 +1,236 @@
 
 
-import cv2
 import numpy as np
+from utils import as_track_table, OBJECT_TYPES, FrameRenderer
 
 
 class SpeedAndDistanceEstimator():
-    def __init__(self):
-        self.frame_window = 5
-        self.frame_rate = 24  # Assuming a frame rate of 24 FPS
+    """
+    Per-track kinematics of the players on the pitch.
 
+    Works on whole-track arrays of the transformed (metric) positions.
+    Positions are smoothed with a trailing rolling mean over `frame_window`
+    frames; speed is the displacement of the smoothed position since the
+    last row at least a window earlier, acceleration the change of speed
+    over the same span, and distance the cumulative path length of the
+    smoothed position. Speed is only given once the run is long enough for
+    both smoothed positions to average a full window, so the first frames
+    of a run are not underestimated. A track that is
+    missing for more than `max_gap` frames, or leaves the mapped part of
+    the pitch, starts a new run: nothing is differenced or accumulated
+    across the gap, but the distance and per-track summary carry on.
+
+    `add_speed_and_distance_to_tracks` handles a whole video at once;
+    `update` gives the same values for a stream fed one block of frames at
+    a time, since every value only depends on past frames.
+    """
+    def __init__(self, frame_rate=24, frame_window=5, max_gap=12, sprint_speed=25.0, sprint_duration=1.0):
+        """
+        Args:
+            frame_rate: Frames per second of the video; pass the value read
+                from the file, e.g. with `get_video_fps`.
+            frame_window: Frames of the rolling smoothing and speed window.
+            max_gap: Frames a track may be missing and still be followed
+                across the gap.
+            sprint_speed: Speed in km/h above which a player is sprinting.
+            sprint_duration: Seconds a player has to stay above
+                `sprint_speed` for it to count as a sprint.
+        """
+        self.frame_window = frame_window
+        self.frame_rate = frame_rate
+        self.max_gap = max_gap
+        self.sprint_speed = sprint_speed
+        self.sprint_duration = sprint_duration
+        self.renderer = FrameRenderer()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all tracks, e.g. before a new video.
+        """
+        self.history = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, 2)))
+        # track key -> [distance, top speed, sprints, start frame of the current fast streak or -1]
+        self.track_state = {}
 
     def add_speed_and_distance_to_tracks(self, tracks):
-        total_distance = {}
-        for obj, obj_tracks in tracks.items():
-            if obj=='ball' or obj=='referees':
-                continue
-            number_of_frames = len(obj_tracks)
-
-            for frame_num in range(0, number_of_frames, self.frame_window):
-                if frame_num not in obj_tracks:
-                    continue
-                last_frame = min(frame_num + self.frame_window, number_of_frames - 1)
-
-                for track_id, _ in obj_tracks[frame_num].items():
-                    if track_id not in obj_tracks[last_frame]:
-                        continue
-
-                    if 'position' not in obj_tracks[frame_num][track_id]:
-                        continue
-
-                    current_position = np.array(obj_tracks[frame_num][track_id]['position_transformed'])
-                    previous_position = np.array(obj_tracks[last_frame][track_id]['position_transformed'])
-
-                    if current_position is None or previous_position is None:
-                        continue
-
-                    distance = np.linalg.norm(current_position - previous_position)
-                    speed = distance / (self.frame_window / self.frame_rate)
-                    speed = speed * 3.6  # Convert m/s to km/h
-                    
-                    if obj not in total_distance:
-                        total_distance[obj] = {}
-                    if track_id not in total_distance[obj]:
-                        total_distance[obj][track_id] = 0
-
-                    total_distance[obj][track_id] += distance
-
-                    for frame_num_batch in range(frame_num, last_frame):
-                        if track_id not in obj_tracks[frame_num_batch]:
-                            continue
-                        obj_tracks[frame_num_batch][track_id]['speed'] = speed
-                        obj_tracks[frame_num_batch][track_id]['distance'] = total_distance[obj][track_id]
+        """
+        Add speed (km/h), acceleration (m/s^2) and cumulative distance (m)
+        to every player row of a whole video.
+        Args:
+            tracks: A TrackTable or the legacy dict of per-frame track lists.
+        """
+        self.reset()
+        table = as_track_table(tracks)
+        self._add_kinematics(table, frame_offset=0, keep_history=False)
+        table.write_back(tracks, ['speed', 'acceleration', 'distance'])
+
+    def update(self, tracks, frame_offset=0):
+        """
+        Add the kinematics of the next block of a stream.
+        Args:
+            tracks: A TrackTable or the legacy dict of per-frame track lists
+                of consecutive frames, following the frames of the previous
+                call.
+            frame_offset: Video frame number of the first frame of `tracks`.
+        """
+        table = as_track_table(tracks)
+        self._add_kinematics(table, frame_offset=frame_offset, keep_history=True)
+        table.write_back(tracks, ['speed', 'acceleration', 'distance'])
+
+    def summary(self):
+        """
+        Per-player totals of everything processed since the last reset.
+
+        Returns:
+            Dict of player track ID to a dict with 'distance' (m),
+            'top_speed' (km/h) and 'sprints'.
+        """
+        player_type = OBJECT_TYPES.index('players')
+        return {int(key & 0xffffffff): {'distance': distance, 'top_speed': top_speed, 'sprints': sprints}
+                for key, (distance, top_speed, sprints, _) in sorted(self.track_state.items())
+                if key >> 32 == player_type}
+
+    def _add_kinematics(self, table, frame_offset, keep_history):
+        rows = table.track_order
+        rows = rows[table.object_type[rows] == OBJECT_TYPES.index('players')]
+        rows = rows[np.isfinite(table.position_transformed[rows]).all(axis=1)]
+        if len(rows) == 0 and not keep_history:
+            return
+
+        history_keys, history_frame, history_position = self.history
+        keys = np.concatenate([history_keys, table.track_keys(rows)])
+        frame = np.concatenate([history_frame, table.frame[rows].astype(np.int64) + frame_offset])
+        position = np.concatenate([history_position, table.position_transformed[rows].astype(np.float64)])
+        is_new = np.arange(len(keys)) >= len(history_keys)
+        order = np.lexsort((frame, keys))
+        keys, frame, position, is_new = keys[order], frame[order], position[order], is_new[order]
+
+        speed, acceleration, distance = self._kinematics(keys, frame, position, is_new)
+        new_rows = rows[order[is_new] - len(history_keys)]
+        table.set_column('speed', speed[is_new], rows=new_rows)
+        table.set_column('acceleration', acceleration[is_new], rows=new_rows)
+        table.set_column('distance', distance[is_new], rows=new_rows)
+
+        if keep_history:
+            # enough past frames for the smoothing, speed and acceleration windows, each of which may
+            # span a gap, and for the run start checks
+            last_frame = frame_offset + table.num_frames - 1
+            keep = frame > last_frame - 3 * (self.frame_window + self.max_gap + 1)
+            self.history = (keys[keep], frame[keep], position[keep])
+
+    def _kinematics(self, keys, frame, position, is_new):
+        """
+        Kinematics of rows sorted by (track key, frame). Only the rows
+        flagged `is_new` are accumulated into the track state; the others
+        are history from earlier calls.
+
+        Returns:
+            speed (km/h), acceleration (m/s^2) and cumulative distance (m)
+            per row; speed is NaN until the run reaches back a window past
+            its first full smoothing window, and acceleration a window
+            further.
+        """
+        n = len(keys)
+        if n == 0:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+        window = self.frame_window
+        index = np.arange(n)
+
+        # runs: consecutive rows of one track without a gap longer than max_gap
+        new_track = np.ones(n, dtype=bool)
+        new_track[1:] = keys[1:] != keys[:-1]
+        new_run = new_track.copy()
+        new_run[1:] |= np.diff(frame) > self.max_gap + 1
+        run = np.cumsum(new_run)
+        stride = int(frame.max()) + window + 2
+        run_frame = run * stride + frame
+
+        # trailing rolling mean of the position within the run
+        start = np.searchsorted(run_frame, run_frame - window + 1)
+        cumulative = np.concatenate([np.zeros((1, 2)), np.cumsum(position, axis=0)])
+        smoothed = (cumulative[index + 1] - cumulative[start]) / (index + 1 - start)[:, None]
+
+        # the last row of the run at least a window earlier, whose smoothing covers a full window
+        reference = np.searchsorted(run_frame, run_frame - window, side='right') - 1
+        reference_frame = run_frame[np.maximum(reference, 0)]
+        run_first_frame = run_frame[np.flatnonzero(new_run)][run - 1]
+        has_reference = (reference >= 0) & (reference_frame >= run_first_frame) & \
+            (reference_frame - run_first_frame >= window - 1)
+        reference = np.maximum(reference, 0)
+        seconds = np.maximum(frame - frame[reference], 1) / self.frame_rate
+        displacement = np.linalg.norm(smoothed - smoothed[reference], axis=1)
+        speed = np.where(has_reference, displacement / seconds * 3.6, np.nan)  # km/h
+        acceleration = np.where(has_reference, (speed - speed[reference]) / 3.6 / seconds, np.nan)
+
+        step = np.zeros(n)
+        step[1:] = np.linalg.norm(np.diff(smoothed, axis=0), axis=1)
+        step[new_run | ~is_new] = 0
+
+        # per-track state carried over from earlier calls
+        unique_keys, track_index = np.unique(keys, return_inverse=True)
+        state = np.array([self.track_state.get(key, [0.0, 0.0, 0, -1]) for key in unique_keys.tolist()],
+                         dtype=np.float64).reshape(-1, 4)
+
+        step_sum = np.cumsum(step)
+        track_start = np.flatnonzero(new_track)
+        distance = step_sum - (step_sum - step)[track_start][np.cumsum(new_track) - 1] + state[track_index, 0]
+
+        sprints, streak_start = self._count_sprints(frame, speed, new_run, new_track, is_new, track_index,
+                                                    state[:, 3])
+
+        last_row = np.concatenate([track_start[1:], [n]]) - 1
+        has_new = np.bincount(track_index[is_new], minlength=len(unique_keys)) > 0
+        new_speed = np.where(is_new, speed, np.nan)
+        top_speed = np.full(len(unique_keys), -np.inf)
+        np.fmax.at(top_speed, track_index, new_speed)
+        state[:, 0] = np.where(has_new, distance[last_row], state[:, 0])
+        state[:, 1] = np.fmax(state[:, 1], top_speed)
+        state[:, 2] += sprints
+        state[:, 3] = streak_start
+        for key, entry in zip(unique_keys.tolist(), state.tolist()):
+            self.track_state[key] = [entry[0], entry[1], int(entry[2]), int(entry[3])]
+        return speed, acceleration, distance
+
+    def _count_sprints(self, frame, speed, new_run, new_track, is_new, track_index, carried_start):
+        """
+        Count the fast streaks of each track that reach `sprint_duration`
+        within the new rows.
+
+        Returns:
+            sprints: New sprints per track.
+            streak_start: Frame where each track's fast streak at its last
+                row began, or -1 when that row is not fast.
+        """
+        min_frames = max(1, int(round(self.sprint_duration * self.frame_rate)))
+        fast = np.nan_to_num(speed) >= self.sprint_speed
+        begins = fast.copy()
+        begins[1:] &= new_run[1:] | ~fast[:-1]
+        streak = np.cumsum(begins)
+        begin_frames = np.concatenate([[-1], frame[begins]])
+        streak_start = begin_frames[streak]
+
+        # a streak still running at the last history row began where the previous call said
+        track_start = np.flatnonzero(new_track)
+        history_rows = np.bincount(track_index[~is_new], minlength=len(track_start))
+        history_last = track_start + history_rows - 1
+        continues = (history_rows > 0) & (carried_start >= 0)
+        continues[continues] &= fast[history_last[continues]]
+        carried = np.full(len(begin_frames), -1)
+        carried[streak[history_last[continues]]] = carried_start[continues]
+        streak_start = np.where(carried[streak] >= 0, carried[streak], streak_start)
+
+        duration = frame - streak_start + 1
+        previous_duration = np.zeros_like(duration)
+        previous_duration[1:] = frame[:-1] - streak_start[1:] + 1
+        reached = fast & is_new & (duration >= min_frames) & (begins | (previous_duration < min_frames))
+        sprints = np.bincount(track_index[reached], minlength=len(track_start))
+
+        last_row = np.concatenate([track_start[1:], [len(frame)]]) - 1
+        return sprints, np.where(fast[last_row], streak_start[last_row], -1)
 
     def draw_speed_and_distance(self, frames, tracks):
         output_frames = []
         for frame_num, frame in enumerate(frames):
-            for obj, obj_tracks in tracks.items():
-                if obj == 'ball' or obj == 'referees':
-                    continue
-                for _, track_data in obj_tracks[frame_num].items():
-                    if 'speed' in track_data:
-                        speed = track_data.get('speed', None)
-                        distance = track_data.get('distance', None)
-                        if speed is None or distance is None:
-                            continue
-                        bbox = track_data['bbox']
-                        position = int((bbox[0] + bbox[2]) / 2), int(bbox[3])
-                        position = list(position)
-                        position[1] += 40
-                        position = tuple(map(int, position))
-                        cv2.putText(frame, f'Speed: {speed:.2f} km/h', position, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
-                        cv2.putText(frame, f'Distance: {distance:.2f} m', (position[0], position[1] + 20), cv2.FONT_HERSHEY_SIMPLEX,
-                                    0.5, (0, 0, 0), 2)
+            self.renderer.draw_speed_and_distance(frame, tracks['players'][frame_num])
             output_frames.append(frame)
         return output_frames
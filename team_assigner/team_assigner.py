@@ -1,10 +1,100 @@
+from collections import OrderedDict
 import cv2
 import numpy as np
 from sklearn.cluster import KMeans
 class TeamAssigner:
-    def __init__(self):
+    def __init__(self, crop_size=16, kmeans_iterations=6, confidence_threshold=1.0,
+                 max_cached_players=512):
+        """
+        Args:
+            crop_size: Side of the square every jersey crop is resampled to
+                before clustering.
+            kmeans_iterations: Fixed number of 2-means iterations per crop.
+            confidence_threshold: Accumulated classification margin after
+                which a player's team is no longer re-evaluated.
+            max_cached_players: Number of track IDs kept in the team cache;
+                the least recently seen are evicted first.
+        """
+        self.crop_size = crop_size
+        self.kmeans_iterations = kmeans_iterations
+        self.confidence_threshold = confidence_threshold
+        self.max_cached_players = max_cached_players
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the team colors and cached player teams, e.g. before a new match.
+        """
         self.team_colors = {}
-        self.player_teams_dict = {}
+        self.player_teams_dict = OrderedDict()
+
+    def get_player_crops(self, frame, bboxes):
+        """
+        Resample the top half of every bounding box to `crop_size` pixels.
+        Args:
+            frame: The video frame.
+            bboxes: Bounding boxes of the players.
+
+        Returns:
+            crops: (N, crop_size * crop_size, 3) float32 array of pixels.
+            valid: Boolean array, False for boxes with no pixels in the frame.
+        """
+        height, width = frame.shape[:2]
+        crops = np.zeros((len(bboxes), self.crop_size * self.crop_size, 3), dtype=np.float32)
+        valid = np.zeros(len(bboxes), dtype=bool)
+        for i, bbox in enumerate(bboxes):
+            x1, y1, x2, y2 = map(int, bbox)
+            x1, x2 = max(x1, 0), min(x2, width)
+            y1, y2 = max(y1, 0), min(y2, height)
+            top_half = frame[y1:y1 + (y2 - y1) // 2, x1:x2]
+            if top_half.size == 0:
+                continue
+            resized = cv2.resize(top_half, (self.crop_size, self.crop_size),
+                                 interpolation=cv2.INTER_NEAREST)
+            crops[i] = resized.reshape(-1, 3)
+            valid[i] = True
+        return crops, valid
+
+    def get_player_colors(self, frame, bboxes):
+        """
+        Get the jersey color of many players at once.
+
+        Runs a fixed number of 2-means iterations on all crops together,
+        then, as before, treats the cluster owning most corner pixels as
+        background and returns the other cluster's center.
+        Args:
+            frame: The video frame.
+            bboxes: Bounding boxes of the players.
+
+        Returns:
+            colors: (N, 3) array of dominant colors, NaN for empty crops.
+        """
+        crops, valid = self.get_player_crops(frame, bboxes)
+        colors = np.full((len(bboxes), 3), np.nan, dtype=np.float32)
+        if not valid.any():
+            return colors
+        pixels = crops[valid]
+
+        size = self.crop_size
+        corners = np.array([0, size - 1, size * (size - 1), size * size - 1])
+        middle = size * (size // 2) + size // 2
+        # background guess from the corners, player guess from the middle
+        centers = np.stack([pixels[:, corners].mean(axis=1), pixels[:, middle]], axis=1)
+
+        for _ in range(self.kmeans_iterations):
+            distances = ((pixels[:, :, None, :] - centers[:, None, :, :]) ** 2).sum(axis=3)
+            labels = distances.argmin(axis=2)
+            for cluster in range(2):
+                members = (labels == cluster)[:, :, None]
+                count = members.sum(axis=1)
+                total = (pixels * members).sum(axis=1)
+                centers[:, cluster] = np.where(count > 0, total / np.maximum(count, 1), centers[:, cluster])
+
+        corner_clusters = labels[:, corners]
+        non_player_cluster = (corner_clusters.sum(axis=1) > 2).astype(int)
+        player_cluster = 1 - non_player_cluster
+        colors[valid] = centers[np.arange(len(pixels)), player_cluster]
+        return colors
 
     def get_player_color(self, frame, bbox):
         """
@@ -16,38 +106,119 @@ class TeamAssigner:
         Returns:
             color: The dominant color of the player.
         """
-        x1, y1, x2, y2 = map(int, bbox)
-        player_region = frame[y1:y2, x1:x2]
-        top_half = player_region[:player_region.shape[0] // 2, :, :]
-        kmeans = KMeans(n_clusters=2)
-        kmeans.fit(top_half.reshape(-1, 3))
-        labels = kmeans.labels_
-        clustered_image = labels.reshape(top_half.shape[0], top_half.shape[1])
-        corner_clusters = [clustered_image[0, 0], clustered_image[0, -1], clustered_image[-1, 0], clustered_image[-1, -1]]
-        non_player_cluster = max(set(corner_clusters), key=corner_clusters.count)
-        player_cluster = 1 - non_player_cluster
-        dominant_color = kmeans.cluster_centers_[player_cluster]
-        return dominant_color
+        return self.get_player_colors(frame, [bbox])[0]
 
     def assign_team_color(self, frame, player_detections):
-        
-        players_color = []
-        for _, player_detection in player_detections.items():
-            bbox = player_detection['bbox']
-            player_color = self.get_player_color(frame, bbox)
-            players_color.append(player_color)
-
-        kmeans = KMeans(n_clusters=2)
+        """
+        Fit the team colors on the players of one frame, see `fit_team_colors`.
+
+        Returns:
+            True when the team colors were fitted.
+        """
+        bboxes = [player_detection['bbox'] for player_detection in player_detections.values()]
+        players_color = self.get_player_colors(frame, bboxes)
+        return self.fit_team_colors(players_color)
+
+    def fit_team_colors(self, players_color):
+        """
+        Cluster jersey colors into the two team colors.
+        Args:
+            players_color: (N, 3) jersey colors; NaN rows are ignored.
+
+        Returns:
+            True when the team colors were fitted, False when fewer than
+            two distinct valid colors were given, e.g. with players cut off
+            at the frame edge; the team colors are then left unset so a
+            later frame can be used.
+        """
+        players_color = np.asarray(players_color)
+        players_color = players_color[~np.isnan(players_color).any(axis=1)]
+        if len(np.unique(players_color, axis=0)) < 2:
+            return False
+
+        kmeans = KMeans(n_clusters=2, random_state=0)
         kmeans.fit(players_color)
         self.kmeans = kmeans
         self.team_colors[1] = kmeans.cluster_centers_[0]
         self.team_colors[2] = kmeans.cluster_centers_[1]
+        return True
 
-    def get_player_team(self, frame, player_bbox, player_id):
-        if player_id in self.player_teams_dict:
-            return self.player_teams_dict[player_id]
+    def predict_teams(self, colors):
+        """
+        Classify jersey colors against the team colors.
+        Args:
+            colors: (N, 3) array of jersey colors.
+
+        Returns:
+            team_ids: (N,) array of team IDs (1 or 2).
+            confidence: (N,) margin in [0, 1]; 0 means equally close to both.
+        """
+        centers = np.stack([self.team_colors[1], self.team_colors[2]])
+        distances = np.linalg.norm(colors[:, None, :] - centers[None, :, :], axis=2)
+        team_ids = distances.argmin(axis=1) + 1
+        confidence = np.abs(distances[:, 0] - distances[:, 1]) / (distances.sum(axis=1) + 1e-6)
+        return team_ids, confidence
 
-        player_color = self.get_player_color(frame, player_bbox)
-        team_id = self.kmeans.predict(player_color.reshape(1, -1))[0] + 1
-        self.player_teams_dict[player_id] = team_id
-        return team_id
\ No newline at end of file
+    def get_player_teams(self, frame, players):
+        """
+        Get the team of every player in a frame with one batched classification.
+
+        Players whose cached team is confident enough are answered from the
+        cache; the others are classified together and their votes added to
+        the cache, so an uncertain early guess can still be corrected.
+        Args:
+            frame: The video frame.
+            players: Dict of player ID to track data with a 'bbox'.
+
+        Returns:
+            Dict of player ID to team ID. Players that could not be
+            classified yet are left out.
+        """
+        teams = {}
+        to_classify = []
+        for player_id, player_data in players.items():
+            entry = self.player_teams_dict.get(player_id)
+            if entry is not None:
+                self.player_teams_dict.move_to_end(player_id)
+                teams[player_id] = entry['team_id']
+                if entry['confidence'] >= self.confidence_threshold:
+                    continue
+            to_classify.append((player_id, player_data['bbox']))
+
+        if not to_classify:
+            return teams
+
+        colors = self.get_player_colors(frame, [bbox for _, bbox in to_classify])
+        valid = ~np.isnan(colors).any(axis=1)
+        team_ids, confidence = self.predict_teams(np.nan_to_num(colors))
+
+        for (player_id, _), is_valid, team_id, margin in zip(to_classify, valid, team_ids, confidence):
+            if not is_valid:
+                continue
+            entry = self.player_teams_dict.setdefault(player_id, {'votes': np.zeros(2), 'team_id': 0,
+                                                                  'confidence': 0.0})
+            self.player_teams_dict.move_to_end(player_id)
+            entry['votes'][team_id - 1] += margin
+            entry['team_id'] = int(entry['votes'].argmax()) + 1
+            entry['confidence'] = float(abs(entry['votes'][0] - entry['votes'][1]))
+            teams[player_id] = entry['team_id']
+
+        while len(self.player_teams_dict) > self.max_cached_players:
+            self.player_teams_dict.popitem(last=False)
+        return teams
+
+    def get_cached_player_teams(self, players):
+        """
+        Team of every player already in the cache, without classifying
+        anyone, e.g. to skip the re-evaluation of a frame under load.
+        Args:
+            players: Dict of player ID to track data.
+
+        Returns:
+            Dict of player ID to team ID for the cached players.
+        """
+        return {player_id: self.player_teams_dict[player_id]['team_id'] for player_id in players
+                if player_id in self.player_teams_dict}
+
+    def get_player_team(self, frame, player_bbox, player_id):
+        return self.get_player_teams(frame, {player_id: {'bbox': player_bbox}}).get(player_id)
@@ -0,0 +1,78 @@
+import numpy as np
+from trackers.ball_interpolator import BallInterpolator
+
+
+def ball_bbox(x, y):
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    return np.column_stack([x - 5, y - 5, x + 5, y + 5])
+
+
+def test_rejects_detections_too_fast_on_both_sides():
+    frame = np.arange(10)
+    x = 100 + 5.0 * frame
+    x[5] += 500
+    interpolator = BallInterpolator(max_gap=5, max_speed=60)
+    bbox, interpolated, rejected = interpolator.interpolate(frame, ball_bbox(x, 0 * x), 10)
+
+    assert rejected.tolist() == [i == 5 for i in range(10)]
+    assert interpolated.tolist() == [i == 5 for i in range(10)]
+    np.testing.assert_allclose(bbox[5], ball_bbox([125], [0])[0])
+
+
+def test_keeps_one_sided_jumps_and_the_ends():
+    interpolator = BallInterpolator(max_gap=5, max_speed=60)
+    # the ball really moved: the jump is fast coming in but slow going out
+    frame = np.arange(10)
+    x = np.where(frame < 5, 100.0, 600.0)
+    assert not interpolator.find_outliers(frame, ball_bbox(x, 0 * x)).any()
+
+    # the first and last detection have only one neighbour
+    x = np.array([900.0, 100, 105, 110, 115, 900])
+    assert not interpolator.find_outliers(np.arange(6), ball_bbox(x, 0 * x)).any()
+
+
+def test_jumps_across_unfilled_gaps_are_not_outliers():
+    frame = np.array([0, 1, 20, 40, 41])
+    x = np.array([100.0, 105, 900, 100, 105])
+    interpolator = BallInterpolator(max_gap=5, max_speed=60)
+    assert not interpolator.find_outliers(frame, ball_bbox(x, 0 * x)).any()
+
+
+def random_detections(seed, num_frames=400):
+    """
+    A ball bouncing around with short and long gaps and occasional
+    teleporting false detections.
+    """
+    rng = np.random.default_rng(seed)
+    position = np.cumsum(rng.normal(0, 8, (num_frames, 2)), axis=0) + 500
+    seen = rng.random(num_frames) < 0.6
+    for start in rng.integers(0, num_frames, 4):
+        seen[start:start + rng.integers(8, 30)] = False
+    frame = np.flatnonzero(seen)
+    position = position[frame]
+    outliers = rng.random(len(frame)) < 0.05
+    position[outliers] += rng.choice([-1, 1], (outliers.sum(), 2)) * 400
+    return frame, ball_bbox(position[:, 0], position[:, 1])
+
+
+def test_streaming_matches_whole_video():
+    num_frames = 400
+    for seed in range(5):
+        frame, bbox = random_detections(seed, num_frames)
+        whole = BallInterpolator(max_gap=6, max_speed=40)
+        expected_bbox, expected_interpolated, _ = whole.interpolate(frame, bbox, num_frames)
+
+        for count in (1, 7, 50):
+            stream = BallInterpolator(max_gap=6, max_speed=40)
+            look_ahead = 2 * (stream.max_gap + 1)
+            streamed_bbox, streamed_interpolated = [], []
+            for offset in range(0, num_frames, count):
+                stop = min(offset + count + look_ahead, num_frames)
+                window = (frame >= offset) & (frame < stop)
+                result, interpolated = stream.update(frame[window], bbox[window], stop - offset,
+                                                     min(count, num_frames - offset), frame_offset=offset)
+                streamed_bbox.append(result)
+                streamed_interpolated.append(interpolated)
+
+            np.testing.assert_allclose(np.concatenate(streamed_bbox), expected_bbox)
+            np.testing.assert_array_equal(np.concatenate(streamed_interpolated), expected_interpolated)
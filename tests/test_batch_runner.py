@@ -0,0 +1,97 @@
+import json
+import os
+import pytest
+from pipeline import BatchRunner, load_manifest
+from pipeline.batch_runner import fit_frame_budget, video_fingerprint
+
+
+def test_frame_budget_keeps_settings_that_fit():
+    assert fit_frame_budget(1000, chunk_size=64, lookahead=98, io_queue_size=64) == (64, 98, 64)
+
+
+def test_frame_budget_shrinks_queues_then_lookahead_then_chunks():
+    # 2 * 64 + 24 frames of queues and look-ahead alone exceed 100 frames
+    assert fit_frame_budget(100, chunk_size=64, lookahead=24, io_queue_size=64) == (52, 24, 12)
+    assert fit_frame_budget(40, chunk_size=64, lookahead=98, io_queue_size=64) == (20, 10, 5)
+
+
+@pytest.mark.parametrize('max_frames', range(1, 200, 7))
+def test_frame_budget_is_never_exceeded(max_frames):
+    chunk_size, lookahead, io_queue_size = fit_frame_budget(max_frames, 64, 98, 64)
+    assert min(chunk_size, lookahead, io_queue_size) >= 1
+    # below 4 frames nothing fits, and the smallest settings are used
+    assert 2 * io_queue_size + lookahead + chunk_size <= max(max_frames, 4)
+
+
+def test_frame_budget_respects_min_lookahead():
+    assert fit_frame_budget(8, 64, 98, 64, min_lookahead=3)[1] == 3
+
+
+def test_load_csv_manifest(tmp_path):
+    (tmp_path / 'jobs').mkdir()
+    manifest = tmp_path / 'jobs' / 'manifest.csv'
+    manifest.write_text('video,output,export\n'
+                        'videos/a.mp4,out/a.avi,out/a.parquet\n'
+                        f'{tmp_path}/b.mp4,out/b.avi,\n')
+
+    assert load_manifest(str(manifest)) == [
+        {'video': str(tmp_path / 'jobs' / 'videos' / 'a.mp4'), 'output': str(tmp_path / 'jobs' / 'out' / 'a.avi'),
+         'export': str(tmp_path / 'jobs' / 'out' / 'a.parquet')},
+        {'video': str(tmp_path / 'b.mp4'), 'output': str(tmp_path / 'jobs' / 'out' / 'b.avi')},
+    ]
+
+
+def test_load_json_manifest(tmp_path):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps([{'video': 'a.mp4', 'output': 'a.avi'}]))
+    assert load_manifest(str(manifest)) == [{'video': str(tmp_path / 'a.mp4'), 'output': str(tmp_path / 'a.avi')}]
+
+    manifest.write_text(json.dumps([{'video': 'a.mp4'}]))
+    with pytest.raises(ValueError):
+        load_manifest(str(manifest))
+
+
+@pytest.fixture
+def finished_batch(tmp_path):
+    """
+    Two jobs whose outputs exist and an earlier report saying both are done.
+    """
+    jobs = []
+    for name, size in (('small', 10), ('large', 1000)):
+        video, output = tmp_path / f'{name}.mp4', tmp_path / f'{name}.avi'
+        video.write_bytes(os.urandom(size))
+        output.write_bytes(b'annotated')
+        jobs.append({'video': str(video), 'output': str(output)})
+    report_path = str(tmp_path / 'report.json')
+    BatchRunner.write_report({'jobs': [dict(job, status='done', frames=100, fingerprint=video_fingerprint(job['video']))
+                                       for job in jobs]}, report_path)
+    return jobs, report_path
+
+
+def test_resume_skips_done_jobs_on_unchanged_videos(finished_batch):
+    jobs, report_path = finished_batch
+    runner = BatchRunner(model_path=None)
+
+    # the pool is never started when every job is skipped, also on a second resume
+    for _ in range(2):
+        report = runner.run(jobs, report_path)
+        assert [job['status'] for job in report['jobs']] == ['skipped', 'skipped']
+        assert report['summary']['skipped'] == 2
+
+
+def test_resume_reruns_changed_failed_and_missing_jobs(finished_batch):
+    jobs, report_path = finished_batch
+    previous = BatchRunner.load_report(report_path)
+
+    with open(jobs[1]['video'], 'ab') as f:
+        f.write(b'more footage')
+    entries, pending = BatchRunner.resume(jobs, previous)
+    assert entries[0]['status'] == 'skipped' and entries[1] is None
+    assert [index for index, _ in pending] == [1]
+
+    os.remove(jobs[0]['output'])
+    previous[(jobs[1]['video'], jobs[1]['output'])]['status'] = 'failed'
+    entries, pending = BatchRunner.resume(jobs, previous)
+    assert entries == [None, None]
+    # the largest video first
+    assert [index for index, _ in pending] == [1, 0]
@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+import pytest
+from pipeline import ClipRenderer
+from player_ball_assigner import PossessionStatistics
+from .test_match_store import NUM_FRAMES, export, synthetic_match
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def video_path(tmp_path):
+    path = str(tmp_path / 'match.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (64, 48))
+    for frame_num in range(NUM_FRAMES):
+        writer.write(np.full((48, 64, 3), frame_num, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+@pytest.mark.parametrize('start', [0, 10, 25, 37, 60, 99])
+@pytest.mark.parametrize('suffix', ['parquet', 'arrow'])
+def test_clip_possession_matches_the_full_run(tmp_path, video_path, start, suffix):
+    table, possession_team = synthetic_match()
+    export(tmp_path / f'match.{suffix}', table, possession_team)
+    windows = {'Last 0.8 s': 0.8}
+    clip = ClipRenderer(str(tmp_path / f'match.{suffix}'), video_path=video_path, possession_windows=windows)
+    panels = []
+    clip.renderer.render = lambda frame, tracks, possession, camera_movement: panels.append(possession.as_dict())
+
+    frames = list(clip.iter_clip(frames=(start, start + 15)))
+
+    # the full run updates its statistics with every frame before drawing it
+    full = PossessionStatistics({name: seconds * 25 for name, seconds in windows.items()})
+    full.extend(possession_team[:start])
+    expected = []
+    for team in possession_team[start:start + 15]:
+        full.update(team)
+        expected.append(full.as_dict())
+    assert len(frames) == len(expected)
+    assert abs(int(frames[0][0, 0, 0]) - start) <= 2
+    assert panels == expected
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from trackers.detector_backends import ExportedDetector, letterbox, non_max_suppression
+
+
+def test_letterbox_pads_to_the_stride():
+    image = np.zeros((720, 1280, 3), dtype=np.uint8)
+    image[:] = (255, 0, 0)  # blue in BGR
+    blob, ratio, pad = letterbox([image, image], 640, stride=32)
+
+    # 1280x720 -> 640x360, padded up to 384 rows, 12 on each side
+    assert blob.shape == (2, 3, 384, 640)
+    assert ratio == 0.5
+    assert pad == (0, 12)
+    np.testing.assert_allclose(blob[0, :, :12], 114 / 255)
+    np.testing.assert_allclose(blob[0, :, -12:], 114 / 255)
+    np.testing.assert_allclose(blob[1, :, 12:-12].mean(axis=(1, 2)), [0, 0, 1])
+
+
+def test_letterbox_fills_a_static_input_shape():
+    image = np.zeros((720, 1280, 3), dtype=np.uint8)
+    blob, ratio, pad = letterbox([image], 640, input_shape=(640, 640))
+
+    assert blob.shape == (1, 3, 640, 640)
+    assert ratio == 0.5
+    assert pad == (0, 140)
+
+
+def head_output(boxes, num_classes=2, anchors=16):
+    """
+    Raw YOLOv8 head output of one image holding `boxes`, a list of
+    (center x, center y, width, height, class ID, confidence).
+    """
+    prediction = np.zeros((4 + num_classes, anchors), dtype=np.float32)
+    for anchor, (x, y, width, height, class_id, confidence) in enumerate(boxes):
+        prediction[:4, anchor] = (x, y, width, height)
+        prediction[4 + class_id, anchor] = confidence
+    return prediction
+
+
+def test_nms_keeps_the_best_box_per_class():
+    prediction = head_output([
+        (100, 100, 40, 40, 0, 0.9),
+        (102, 101, 40, 40, 0, 0.8),  # overlaps the first, same class
+        (101, 100, 40, 40, 1, 0.7),  # overlaps the first, other class
+        (300, 300, 20, 20, 0, 0.6),
+        (500, 500, 20, 20, 0, 0.2),  # below the confidence threshold
+    ])
+    xyxy, confidence, class_id = non_max_suppression(prediction, conf=0.25, iou=0.7, max_det=300)
+
+    np.testing.assert_allclose(xyxy, [[80, 80, 120, 120], [81, 80, 121, 120], [290, 290, 310, 310]])
+    np.testing.assert_allclose(confidence, [0.9, 0.7, 0.6])
+    assert class_id.tolist() == [0, 1, 0]
+
+
+def test_nms_limits_and_handles_empty_output():
+    prediction = head_output([(100 * i, 100, 20, 20, 0, 0.5 + 0.01 * i) for i in range(1, 6)])
+    xyxy, confidence, class_id = non_max_suppression(prediction, conf=0.25, iou=0.7, max_det=2)
+    np.testing.assert_allclose(confidence, [0.55, 0.54])
+
+    xyxy, confidence, class_id = non_max_suppression(head_output([]), conf=0.25, iou=0.7, max_det=300)
+    assert xyxy.shape == (0, 4) and len(confidence) == 0 and len(class_id) == 0
+
+
+class StaticBatchDetector(ExportedDetector):
+    """
+    A model with a static batch of 4 that finds one box, drawn at the same
+    place in every image.
+    """
+    def __init__(self):
+        super().__init__({0: 'ball', 1: 'player'}, input_shape=(640, 640), batch_size=4)
+        self.batches = []
+
+    def infer(self, blob):
+        if len(blob) != self.batch_size:
+            raise ValueError(f'Static batch of {self.batch_size}, got {len(blob)}')
+        self.batches.append(len(blob))
+        # a 40x40 box at (100, 240) of the 640x640 input, tagged with its place in the batch
+        return np.stack([head_output([(100, 240, 40, 40, 1, 0.5 + 0.01 * i)]) for i in range(len(blob))])
+
+
+@pytest.mark.parametrize('count', [1, 4, 6])
+def test_static_batch_pads_the_last_slice(count):
+    detector = StaticBatchDetector()
+    frames = [np.zeros((720, 1280, 3), dtype=np.uint8)] * count
+    results = detector.predict(frames, conf=0.25)
+
+    assert detector.batches == [4] * -(-count // 4)
+    assert len(results) == count
+    for i, result in enumerate(results):
+        # mapped back through the 0.5 scale and 140 rows of padding
+        np.testing.assert_allclose(result.boxes.xyxy.cpu().numpy(), [[160, 160, 240, 240]])
+        np.testing.assert_allclose(result.boxes.conf.cpu().numpy(), [0.5 + 0.01 * (i % 4)])
+        assert result.names[int(result.boxes.cls[0])] == 'player'
@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+from player_ball_assigner import PossessionStatistics
+from utils import MatchExporter, MatchStore, TrackTable, OBJECT_TYPES
+
+pytest.importorskip('pyarrow')
+
+NUM_FRAMES = 100
+EMPTY_FRAME = 50
+
+
+def camera_movement(frame):
+    return np.stack([frame * 0.5, frame * -0.25], axis=-1).astype(np.float32)
+
+
+def synthetic_match(seed=0):
+    """
+    Three players, a referee and the ball in every frame but one, with
+    every column filled, and the team in possession of each frame.
+    """
+    rng = np.random.default_rng(seed)
+    frame, object_type, track_id = [], [], []
+    for frame_num in range(NUM_FRAMES):
+        if frame_num == EMPTY_FRAME:
+            continue
+        objects = [('players', 1), ('players', 2), ('players', 3), ('referees', 9)]
+        if frame_num % 7:
+            objects.append(('ball', 1))
+        for obj, tid in objects:
+            frame.append(frame_num)
+            object_type.append(OBJECT_TYPES.index(obj))
+            track_id.append(tid)
+    frame, object_type, track_id = np.array(frame), np.array(object_type), np.array(track_id)
+    n = len(frame)
+    players = object_type == OBJECT_TYPES.index('players')
+    corner = rng.integers(0, 1800, (n, 2)).astype(np.float32)
+    position = corner + 10
+    pitch = rng.uniform(0, 100, (n, 2)).astype(np.float32)
+    pitch[object_type == OBJECT_TYPES.index('ball')] = np.nan
+    speed = np.where(players & (frame > 5), rng.uniform(0, 30, n), np.nan).astype(np.float32)
+    columns = {
+        'bbox': np.concatenate([corner, corner + 20], axis=1),
+        'position': position,
+        'position_adjusted': position - camera_movement(frame),
+        'position_transformed': pitch,
+        'team_id': np.where(players, track_id % 2 + 1, 0),
+        'has_ball': players & (track_id == frame % 3 + 1),
+        'interpolated': (object_type == OBJECT_TYPES.index('ball')) & (frame % 5 == 0),
+        'speed': speed,
+        'acceleration': speed / 10,
+        'distance': np.where(players, frame * 0.3, np.nan),
+    }
+    table = TrackTable(NUM_FRAMES, frame, object_type, track_id, columns)
+    possession_team = rng.choice([0, 0, 1, 2], NUM_FRAMES).astype(np.int8)
+    possession_team[EMPTY_FRAME] = 0
+    return table, possession_team
+
+
+def export(path, table, possession_team, chunk=13):
+    """
+    Write `table` the way a streaming run does, one chunk at a time.
+    """
+    with MatchExporter(str(path), fps=25, row_group_frames=25, metadata={'video': 'match.mp4'}) as exporter:
+        exporter.metadata['team_colors'] = {'1': [255, 0, 0], '2': [0, 0, 255]}
+        for start in range(0, NUM_FRAMES, chunk):
+            stop = min(start + chunk, NUM_FRAMES)
+            rows = np.arange(table.frame_offsets[start], table.frame_offsets[stop])
+            exporter.write(table.select(rows, num_frames=stop - start, frame_offset=start), frame_offset=start,
+                           possession_team=possession_team[start:stop])
+    return MatchStore(str(path))
+
+
+@pytest.fixture(params=['match.parquet', 'match.arrow'])
+def match_path(request, tmp_path):
+    return tmp_path / request.param
+
+
+def test_round_trip(match_path):
+    table, possession_team = synthetic_match()
+    store = export(match_path, table, possession_team)
+
+    assert store.num_frames == NUM_FRAMES
+    assert store.metadata['video'] == 'match.mp4'
+    assert store.team_colors == {1: (255, 0, 0), 2: (0, 0, 255)}
+    assert store.group_ranges[0] == (0, 25)
+
+    start, stop = 30, 70
+    expected = table.select(np.arange(table.frame_offsets[start], table.frame_offsets[stop]),
+                            num_frames=stop - start, frame_offset=start)
+    loaded = store.track_table(frames=(start, stop))
+    assert loaded.num_frames == stop - start
+    np.testing.assert_array_equal(loaded.frame, expected.frame)
+    np.testing.assert_array_equal(loaded.object_type, expected.object_type)
+    np.testing.assert_array_equal(loaded.track_id, expected.track_id)
+    for name in expected.filled:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(expected, name), err_msg=name)
+    colors = loaded.team_color[loaded.team_id == 1]
+    assert len(colors) and (colors == [255, 0, 0]).all()
+
+
+def test_camera_movement_and_possession_round_trip(match_path):
+    table, possession_team = synthetic_match()
+    store = export(match_path, table, possession_team)
+
+    movement = camera_movement(np.arange(30, 70))
+    # a frame without objects repeats the movement of the frame before it
+    movement[EMPTY_FRAME - 30] = movement[EMPTY_FRAME - 31]
+    np.testing.assert_array_equal(store.camera_movement(frames=(30, 70)), movement)
+    np.testing.assert_array_equal(store.possession_team(frames=(30, 70)), possession_team[30:70])
+    np.testing.assert_array_equal(store.possession_team(), possession_team)
+
+
+@pytest.mark.parametrize('frame', [0, 1, 24, 25, 26, 49, 51, 77, 99, 100])
+def test_checkpoint_and_replay_match_a_full_replay(match_path, frame):
+    table, possession_team = synthetic_match()
+    store = export(match_path, table, possession_team)
+    window = 20
+
+    full = PossessionStatistics({'recent': window})
+    full.extend(possession_team[:frame])
+
+    # as ClipRenderer does: the last checkpoint a whole window before the frame, then the rows since
+    checkpoint = store.possession_checkpoint(frame - window)
+    assert checkpoint['frame'] <= max(frame - window, 0)
+    seeded = PossessionStatistics({'recent': window})
+    seeded.prime(checkpoint['totals'], checkpoint['last_team'])
+    seeded.extend(store.possession_team(frames=(checkpoint['frame'], frame)))
+
+    assert seeded.as_dict() == full.as_dict()
+    assert seeded.last_team == full.last_team
+
+
+def test_checkpoints_do_not_depend_on_write_chunks(match_path):
+    table, possession_team = synthetic_match()
+    chunked = export(match_path, table, possession_team, chunk=13).checkpoints
+    whole = export(match_path, table, possession_team, chunk=NUM_FRAMES).checkpoints
+
+    assert chunked == whole
+    assert [checkpoint[0] for checkpoint in whole] == [0, 25, 50, 75]
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+from pipeline import ParallelPipeline
+from utils import TrackTable, OBJECT_TYPES
+
+PLAYER = OBJECT_TYPES.index('players')
+BALL = OBJECT_TYPES.index('ball')
+
+
+def player_box(player, frame):
+    return [50 * player + frame, 100, 50 * player + frame + 20, 140]
+
+
+def segment_table(tracks, first_frame, num_frames, ball=False):
+    """
+    TrackTable of frames [first_frame, first_frame + num_frames) from
+    `tracks`, a dict of track ID to the video frames the track is in. Every
+    track is drawn at the box of the player with the same ID, unless given
+    as (track ID, player).
+    """
+    rows = []
+    for frame in range(first_frame, first_frame + num_frames):
+        for track, frames in tracks.items():
+            track_id, player = track if isinstance(track, tuple) else (track, track)
+            if frame in frames:
+                rows.append((frame - first_frame, PLAYER, track_id, player_box(player, frame)))
+        if ball:
+            rows.append((frame - first_frame, BALL, 1, [500 + frame, 300, 510 + frame, 310]))
+    frame, object_type, track_id, bbox = zip(*rows)
+    return TrackTable(num_frames, frame, object_type, track_id, {'bbox': bbox})
+
+
+@pytest.fixture
+def pipeline():
+    return ParallelPipeline(model_path=None, workers=1, segment_length=20, overlap=5, min_link_frames=3)
+
+
+def test_segments_cover_every_frame_once(pipeline):
+    segments = pipeline.segments(70)
+    assert segments == [(0, 0, 20), (15, 20, 40), (35, 40, 60), (55, 60, None)]
+    assert pipeline.segments(0) == [(0, 0, None)]
+
+
+def test_link_tracks_matches_one_to_one(pipeline):
+    previous = segment_table({10: range(0, 20), 11: range(0, 20), 12: range(0, 20)}, 0, 20)
+    # local 2 follows player 10 and local 1 player 11; local 3 also overlaps player 10, 8 px to the side
+    table = segment_table({(2, 10): range(15, 40), (1, 11): range(15, 40), (3, 10): range(15, 40)}, 15, 25)
+    table.bbox[table.track_id == 3, ::2] += 8
+    pipeline.min_link_iou = 0.3
+
+    links = pipeline.link_tracks(previous, 0, table, 15, 5)
+
+    assert links == {2: 10, 1: 11}
+
+
+@pytest.mark.parametrize('overlap_frames, linked', [(2, False), (3, True)])
+def test_link_tracks_needs_min_link_frames(pipeline, overlap_frames, linked):
+    # the player only appears in the last `overlap_frames` frames of the overlap
+    previous = segment_table({10: range(20 - overlap_frames, 20)}, 0, 20)
+    table = segment_table({(4, 10): range(20 - overlap_frames, 40)}, 15, 25)
+
+    links = pipeline.link_tracks(previous, 0, table, 15, 5)
+
+    assert links == ({4: 10} if linked else {})
+
+
+def analyse_segments(pipeline, players, num_frames, local_ids):
+    """
+    What the workers would return for `players`, a dict of player to the
+    frames they are in, with the track IDs of each segment's ByteTrack
+    given by `local_ids`, one dict of player to local ID per segment.
+    """
+    segments = pipeline.segments(num_frames)
+    results = []
+    for (decode_start, start, stop), ids in zip(segments, local_ids):
+        stop = num_frames if stop is None else stop
+        tracks = {(ids[player], player): frames for player, frames in players.items()}
+        table = segment_table(tracks, decode_start, stop - decode_start, ball=True)
+        results.append({'table': table, 'colors': np.full((len(table), 3), np.nan, dtype=np.float32),
+                        'transforms': np.tile(np.eye(3), (stop - decode_start, 1, 1)), 'frame_shape': None})
+    return segments, results
+
+
+def test_stitch_gives_every_track_one_global_id(pipeline):
+    players = {1: range(0, 70), 2: range(0, 30), 3: range(25, 70), 4: range(58, 70), 5: range(42, 48)}
+    # each segment's ByteTrack numbers its tracks from 1 again, colliding with the IDs of the others
+    local_ids = [{1: 1, 2: 2, 3: 3, 4: 4, 5: 5}, {1: 3, 2: 1, 3: 2, 4: 4, 5: 5},
+                 {1: 2, 2: 5, 3: 1, 4: 3, 5: 4}, {1: 1, 2: 2, 3: 5, 4: 4, 5: 3}]
+    segments, results = analyse_segments(pipeline, players, 70, local_ids)
+
+    pipeline.stitch(segments, results)
+    table = pipeline.table
+
+    # every frame once, with the boxes the workers found
+    assert table.num_frames == 70
+    assert len(pipeline.camera_transforms) == 70
+    player_rows = table.object_type == PLAYER
+    assert player_rows.sum() == sum(len(frames) for frames in players.values())
+    keys = set(zip(table.frame[player_rows].tolist(), table.track_id[player_rows].tolist()))
+    assert len(keys) == player_rows.sum()
+    assert (table.track_id[table.object_type == BALL] == 1).all()
+
+    # which player a row belongs to follows from its box
+    player = np.round((table.bbox[:, 0] - table.frame) / 50).astype(int)
+    global_ids = {p: set(table.track_id[player_rows & (player == p)].tolist()) for p in players}
+    # player 4 is only in the last 2 overlap frames before the seam, too few to re-link
+    assert [len(global_ids[p]) for p in players] == [1, 1, 1, 2, 1]
+    all_ids = [track_id for ids in global_ids.values() for track_id in ids]
+    assert len(all_ids) == len(set(all_ids))
+    assert table.track_id[player_rows & (player == 4) & (table.frame >= 60)].min() > max(
+        global_ids[1] | global_ids[2] | global_ids[3] | global_ids[5])
+
+
+def test_stitch_does_not_depend_on_local_numbering(pipeline):
+    players = {1: range(0, 70), 2: range(10, 50), 3: range(30, 70)}
+    first = analyse_segments(pipeline, players, 70, [{1: 1, 2: 2, 3: 3}] * 4)
+    second = analyse_segments(pipeline, players, 70, [{1: 1, 2: 2, 3: 3}, {1: 9, 2: 4, 3: 2},
+                                                      {1: 2, 2: 1, 3: 7}, {1: 5, 2: 6, 3: 1}])
+
+    pipeline.stitch(*first)
+    expected = pipeline.table
+    pipeline.stitch(*second)
+
+    np.testing.assert_array_equal(pipeline.table.track_id, expected.track_id)
+    np.testing.assert_array_equal(pipeline.table.bbox, expected.bbox)
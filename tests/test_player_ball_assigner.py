@@ -0,0 +1,74 @@
+import numpy as np
+from player_ball_assigner import PlayerBallAssigner
+from utils import TrackTable, OBJECT_TYPES
+
+
+def ball_near(holders, num_players=2):
+    """
+    Legacy tracks where the ball touches player `holders[frame]` in every
+    frame, -1 for a loose ball. Player i stands at x = 200 * i.
+    """
+    tracks = {obj: [] for obj in OBJECT_TYPES}
+    for holder in holders:
+        tracks['players'].append({i: {'bbox': [200 * i, 0, 200 * i + 20, 40]} for i in range(1, num_players + 1)})
+        tracks['referees'].append({})
+        x = 200 * holder if holder > 0 else 1000
+        tracks['ball'].append({1: {'bbox': [x + 5, 15, x + 15, 25]}})
+    return tracks
+
+
+def test_hysteresis_ignores_short_runs():
+    holders = [1] * 10 + [2] * 2 + [1] * 3 + [2] * 5 + [-1] * 2 + [2]
+    assigner = PlayerBallAssigner(hysteresis_frames=3)
+    player_id = assigner.assign_ball_to_tracks(ball_near(holders))['player_id']
+
+    assert player_id.tolist() == [1] * 15 + [2] * 5 + [-1] * 2 + [2]
+
+
+def test_hysteresis_carries_over_between_chunks():
+    holders = [1] * 6 + [2] * 2 + [1] + [2] * 4 + [1] * 3 + [2] * 2
+    whole = PlayerBallAssigner(hysteresis_frames=3).assign_ball_to_tracks(ball_near(holders))['player_id']
+
+    assigner = PlayerBallAssigner(hysteresis_frames=3)
+    chunks = [assigner.assign_ball_to_tracks(ball_near(holders[start:start + 4]))['player_id']
+              for start in range(0, len(holders), 4)]
+
+    np.testing.assert_array_equal(np.concatenate(chunks), whole)
+
+
+def random_table(seed, num_frames=200, players_per_frame=30, balls_per_frame=2, size=400):
+    """
+    A crowded, small pitch, so players of neighbouring frames often stand
+    within reach of a ball. Some frames have no players at all.
+    """
+    rng = np.random.default_rng(seed)
+    frame, object_type, track_id = [], [], []
+    for frame_num in range(num_frames):
+        players = 0 if frame_num % 17 == 0 else players_per_frame
+        frame += [frame_num] * (players + balls_per_frame)
+        object_type += [OBJECT_TYPES.index('players')] * players + [OBJECT_TYPES.index('ball')] * balls_per_frame
+        track_id += list(range(1, players + 1)) + list(range(1, balls_per_frame + 1))
+    corner = rng.uniform(0, size, (len(frame), 2))
+    bbox = np.column_stack([corner, corner + rng.uniform(5, 30, (len(frame), 2))])
+    return TrackTable(num_frames, frame, object_type, track_id, {'bbox': bbox})
+
+
+def test_kdtree_matches_brute_force():
+    for seed in range(3):
+        brute = PlayerBallAssigner(index='brute').assign_ball_to_tracks(random_table(seed))
+        kdtree = PlayerBallAssigner(index='kdtree').assign_ball_to_tracks(random_table(seed))
+
+        np.testing.assert_array_equal(kdtree['player_id'], brute['player_id'])
+        np.testing.assert_array_equal(kdtree['player_row'], brute['player_row'])
+        np.testing.assert_allclose(kdtree['distance'], brute['distance'])
+
+
+def test_kdtree_ignores_players_of_other_frames():
+    tracks = {obj: [{}, {}, {}] for obj in OBJECT_TYPES}
+    tracks['players'][0] = {7: {'bbox': [100, 100, 120, 140]}}
+    tracks['ball'][1] = {1: {'bbox': [105, 135, 115, 145]}}
+    tracks['players'][2] = {8: {'bbox': [100, 100, 120, 140]}}
+
+    for index in ('brute', 'kdtree'):
+        result = PlayerBallAssigner(index=index).assign_ball_to_tracks(tracks)
+        assert result['player_id'].tolist() == [-1, -1, -1]
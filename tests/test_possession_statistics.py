@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from player_ball_assigner import PossessionStatistics
+
+WINDOWS = {'short': 7, 'long': 40}
+
+
+def possession(seed=0, n=300):
+    """
+    Team in control per frame, with runs of frames where nobody is and none
+    at the start.
+    """
+    rng = np.random.default_rng(seed)
+    teams = np.repeat(rng.choice([0, 0, 1, 2], n // 5), 5)
+    teams[:12] = 0
+    return teams
+
+
+def credited(teams):
+    """
+    The team each frame is credited to, one frame at a time.
+    """
+    last, result = 0, []
+    for team in teams:
+        last = team if team > 0 else last
+        result.append(last)
+    return np.array(result)
+
+
+def test_windows_count_the_last_frames():
+    teams = possession()
+    statistics = PossessionStatistics(WINDOWS)
+    expected = credited(teams)
+
+    for frame, team in enumerate(teams):
+        statistics.update(team)
+        for name, length in WINDOWS.items():
+            recent = expected[max(frame + 1 - length, 0):frame + 1]
+            counts = statistics.windows[name]['counts']
+            assert counts.tolist() == np.bincount(recent, minlength=3).tolist()
+
+    np.testing.assert_array_equal(statistics.totals, np.bincount(expected, minlength=3))
+    assert statistics.frames == len(teams)
+    # frames before anyone had the ball do not count towards the shares
+    assert sum(statistics.shares().values()) == pytest.approx(1)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_extend_matches_update(seed):
+    teams = possession(seed)
+    updated = PossessionStatistics(WINDOWS)
+    for team in teams:
+        updated.update(team)
+
+    # chunks shorter and longer than the windows, including empty ones
+    rng = np.random.default_rng(seed)
+    extended = PossessionStatistics(WINDOWS)
+    bounds = np.sort(np.concatenate([[0, len(teams)], rng.integers(0, len(teams), 15)]))
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        extended.extend(teams[start:stop])
+
+    assert extended.as_dict() == updated.as_dict()
+    assert extended.last_team == updated.last_team
+    for name in WINDOWS:
+        assert extended.windows[name]['counts'].tolist() == updated.windows[name]['counts'].tolist()
+
+    # and updates after an extend roll the window on from the right place
+    for team in teams[:50]:
+        updated.update(team)
+        extended.update(team)
+    assert extended.as_dict() == updated.as_dict()
+
+
+def test_prime_continues_the_totals():
+    teams = possession(seed=7)
+    full = PossessionStatistics(WINDOWS)
+    full.extend(teams)
+
+    half = PossessionStatistics()
+    half.extend(teams[:150])
+    primed = PossessionStatistics(WINDOWS)
+    primed.prime(half.totals, half.last_team)
+    # a window's worth of frames fills the rolling windows
+    primed.extend(teams[150:])
+
+    assert primed.as_dict() == full.as_dict()
+
+
+def test_updates_after_extending_a_partly_filled_window():
+    teams = np.tile([1, 1, 2, 0, 2, 2, 0], 20)
+    updated = PossessionStatistics(WINDOWS)
+    extended = PossessionStatistics(WINDOWS)
+    for team in teams[:20]:
+        updated.update(team)
+    extended.extend(teams[:20])
+
+    for team in teams[20:]:
+        updated.update(team)
+        extended.update(team)
+        assert extended.as_dict() == updated.as_dict()
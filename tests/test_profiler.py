@@ -0,0 +1,60 @@
+import csv
+import json
+import pytest
+from pipeline import StreamingPipeline
+from utils import StageProfiler, get_peak_rss_mb
+
+
+def test_stages_report_their_growth_of_the_peak():
+    if get_peak_rss_mb() is None:
+        pytest.skip('peak memory can not be read on this platform')
+    profiler = StageProfiler()
+    with profiler.stage('idle'):
+        pass
+    # as if the peak had risen by 10 MiB during each of two calls
+    for _ in range(2):
+        profiler.record('allocate', 0.01, rss_before=get_peak_rss_mb() - 10)
+
+    stages = {stage['stage']: stage for stage in profiler.report()['stages']}
+    assert stages['idle']['peak_rss_growth_mb'] < 1
+    assert stages['allocate']['peak_rss_growth_mb'] == pytest.approx(20, abs=1)
+
+    # calls recorded without a reading leave the growth unknown
+    profiler.record('decode', 0.01)
+    assert profiler.report()['stages'][-1]['peak_rss_growth_mb'] is None
+
+
+def test_write_report(tmp_path):
+    profiler = StageProfiler()
+    for _ in range(3):
+        with profiler.stage('detect', frames=4):
+            pass
+    profiler.add_frames(12)
+    profiler.stop()
+
+    report = profiler.write_report(str(tmp_path / 'profile.json'))
+    assert json.loads((tmp_path / 'profile.json').read_text()) == report
+
+    profiler.write_report(str(tmp_path / 'profile.csv'))
+    with open(tmp_path / 'profile.csv') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['stage'] for row in rows] == ['detect', 'total']
+    assert rows[0]['frames'] == '12' and rows[0]['calls'] == '3'
+    assert rows[1]['frames'] == '12' and 'peak_rss_mb' in rows[1]
+
+
+def test_begin_keeps_the_stages_of_a_running_profile():
+    profiler = StageProfiler()
+    pipeline = StreamingPipeline(model_path=None, profiler=profiler)
+
+    # what `run` does before its readers decode the first frames
+    profiler.start()
+    pipeline.profiling = True
+    profiler.record('decode', 0.01)
+    pipeline.begin()
+    assert [stage['stage'] for stage in profiler.report()['stages']] == ['decode']
+
+    # on its own, `process` starts a new profile
+    pipeline.profiling = False
+    pipeline.begin()
+    assert profiler.report()['stages'] == []
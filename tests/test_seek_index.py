@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from utils import SeekIndex
+
+
+@pytest.fixture
+def index():
+    return SeekIndex(keyframes=[3, 10, 20], timestamps=np.arange(30) / 25, fps=25)
+
+
+def test_keyframe_before(index):
+    assert [index.keyframe_before(frame) for frame in (0, 2, 3, 9, 10, 19, 20, 29)] == [0, 0, 3, 3, 10, 10, 20, 20]
+    assert SeekIndex([], np.arange(30) / 25, 25).keyframe_before(17) == 17
+
+
+def test_decode_cost(index):
+    assert index.decode_cost(5, 8) == 5
+    assert index.decode_cost(1, 2) == 2
+    assert index.decode_cost(10, 30) == 20
+    assert index.decode_cost(5, 5) == 0
+
+
+def test_frame_at_exact_and_in_between_timestamps(index):
+    assert index.frame_at(0) == 0
+    assert index.frame_at(0.4) == 10
+    # the first frame shown at or after the time
+    assert index.frame_at(0.41) == 11
+    assert index.frame_at(0.439) == 11
+    assert index.frame_at(100) == 30
+
+
+def test_frame_at_millisecond_timestamps():
+    # containers report times in whole milliseconds, e.g. 0.042 for 1/24 s
+    index = SeekIndex([0, 12], np.round(np.arange(48) / 24, 3), fps=24)
+    assert [index.frame_at(frame / 24) for frame in range(48)] == list(range(48))
+    assert index.frame_at(0.5 + 0.01) == 13
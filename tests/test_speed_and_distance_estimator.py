@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+from speed_and_distance_estimator import SpeedAndDistanceEstimator
+from utils import TrackTable, OBJECT_TYPES
+
+PLAYER = OBJECT_TYPES.index('players')
+
+
+def player_table(frame, track_id, position, num_frames, frame_offset=0):
+    """
+    Table of player rows with transformed positions, for the frames
+    [frame_offset, frame_offset + num_frames) of a video.
+    """
+    frame, track_id, position = np.asarray(frame), np.asarray(track_id), np.asarray(position, dtype=np.float64)
+    keep = (frame >= frame_offset) & (frame < frame_offset + num_frames)
+    order = np.argsort(frame[keep], kind='stable')
+    return TrackTable(num_frames, frame[keep][order] - frame_offset, np.full(keep.sum(), PLAYER),
+                      track_id[keep][order], {'position_transformed': position[keep][order]})
+
+
+def straight_run(frames, speed, frame_rate=24):
+    """
+    Positions of a player running along x at `speed` m/s in `frames`.
+    """
+    frames = np.asarray(frames)
+    return np.column_stack([speed * frames / frame_rate, np.zeros(len(frames))])
+
+
+def test_constant_speed():
+    frames = np.arange(60)
+    table = player_table(frames, np.ones(60), straight_run(frames, 5.0), 60)
+    SpeedAndDistanceEstimator(frame_window=5).add_speed_and_distance_to_tracks(table)
+
+    # speed needs a full window of smoothing at both ends of its span
+    assert np.isnan(table.speed[:9]).all()
+    np.testing.assert_allclose(table.speed[9:], 18.0, rtol=1e-5)
+    np.testing.assert_allclose(table.acceleration[14:], 0.0, atol=1e-3)
+    # the smoothed position trails the last frame by half a window
+    np.testing.assert_allclose(table.distance[-1], 5.0 * (59 - 2) / 24, rtol=1e-5)
+
+
+def test_long_gap_starts_a_new_run():
+    estimator = SpeedAndDistanceEstimator(frame_window=5, max_gap=12)
+    frames = np.concatenate([np.arange(30), np.arange(50, 80)])
+    position = straight_run(frames, 5.0)
+    position[30:] += [100.0, 0.0]
+    table = player_table(frames, np.ones(60), position, 80)
+    estimator.add_speed_and_distance_to_tracks(table)
+
+    speed, distance = table.speed, table.distance
+    # nothing is differenced across the gap, and the distance carries on
+    assert np.isnan(speed[30:39]).all()
+    np.testing.assert_allclose(speed[39:], 18.0, rtol=1e-5)
+    assert distance[30] == pytest.approx(distance[29])
+    assert estimator.summary()[1]['distance'] == pytest.approx(5.0 * (27 + 27) / 24, rel=1e-5)
+
+
+def test_short_gap_is_followed():
+    frames = np.concatenate([np.arange(30), np.arange(40, 70)])
+    table = player_table(frames, np.ones(60), straight_run(frames, 5.0), 70)
+    SpeedAndDistanceEstimator(frame_window=5, max_gap=12).add_speed_and_distance_to_tracks(table)
+
+    assert np.isfinite(table.speed[30:]).all()
+    np.testing.assert_allclose(table.distance[-1], 5.0 * (69 - 2) / 24, rtol=1e-5)
+
+
+def sprint_profile(speeds, frame_rate=24):
+    """
+    Positions of a player running along x, given a list of
+    (seconds, speed in m/s) stretches.
+    """
+    steps = np.concatenate([np.full(int(seconds * frame_rate), speed / frame_rate) for seconds, speed in speeds])
+    return np.column_stack([np.cumsum(steps), np.zeros(len(steps))])
+
+
+def test_counts_sprints_long_enough():
+    # 36 km/h stretches of 2 s, 0.5 s and 1.5 s between 7.2 km/h jogs
+    position = sprint_profile([(1, 2.0), (2, 10.0), (1, 2.0), (0.5, 10.0), (1, 2.0), (1.5, 10.0), (1, 2.0)])
+    frames = np.arange(len(position))
+    table = player_table(frames, np.ones(len(frames)), position, len(frames))
+    estimator = SpeedAndDistanceEstimator(frame_window=1, sprint_speed=25.0, sprint_duration=1.0)
+    estimator.add_speed_and_distance_to_tracks(table)
+
+    summary = estimator.summary()[1]
+    assert summary['sprints'] == 2
+    assert summary['top_speed'] == pytest.approx(36.0, rel=1e-4)
+
+
+def random_players(seed, num_frames=300, num_players=6):
+    """
+    Players wandering over the pitch, dropping out for short and long
+    gaps and now and then stepping outside the mapped area.
+    """
+    rng = np.random.default_rng(seed)
+    frame, track_id, position = [], [], []
+    for player in range(1, num_players + 1):
+        velocity = rng.normal(0, 0.3, (num_frames, 2)) + rng.choice([0.05, 0.4], (num_frames, 1))
+        path = np.cumsum(velocity, axis=0)
+        present = rng.random(num_frames) < 0.9
+        for start in rng.integers(0, num_frames, 3):
+            present[start:start + rng.integers(3, 25)] = False
+        path[rng.random(num_frames) < 0.02] = np.nan
+        frame.append(np.flatnonzero(present))
+        track_id.append(np.full(present.sum(), player))
+        position.append(path[present])
+    return np.concatenate(frame), np.concatenate(track_id), np.concatenate(position)
+
+
+@pytest.mark.parametrize('chunk', [1, 7, 64])
+def test_streaming_matches_whole_video(chunk):
+    num_frames = 300
+    for seed in range(3):
+        frame, track_id, position = random_players(seed, num_frames)
+        whole = SpeedAndDistanceEstimator(frame_window=5, max_gap=12, sprint_speed=20.0, sprint_duration=0.5)
+        expected = player_table(frame, track_id, position, num_frames)
+        whole.add_speed_and_distance_to_tracks(expected)
+
+        stream = SpeedAndDistanceEstimator(frame_window=5, max_gap=12, sprint_speed=20.0, sprint_duration=0.5)
+        speed, acceleration, distance = [], [], []
+        for offset in range(0, num_frames, chunk):
+            table = player_table(frame, track_id, position, min(chunk, num_frames - offset), offset)
+            stream.update(table, frame_offset=offset)
+            speed.append(table.speed)
+            acceleration.append(table.acceleration)
+            distance.append(table.distance)
+
+        np.testing.assert_allclose(np.concatenate(speed), expected.speed, rtol=1e-5)
+        np.testing.assert_allclose(np.concatenate(acceleration), expected.acceleration, rtol=1e-4, atol=1e-3)
+        np.testing.assert_allclose(np.concatenate(distance), expected.distance, rtol=1e-5)
+
+        streamed, summary = stream.summary(), whole.summary()
+        assert streamed.keys() == summary.keys()
+        for player, totals in summary.items():
+            assert streamed[player]['distance'] == pytest.approx(totals['distance'])
+            assert streamed[player]['top_speed'] == pytest.approx(totals['top_speed'])
+            assert streamed[player]['sprints'] == totals['sprints']
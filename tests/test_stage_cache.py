@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import pytest
+from utils import StageCache
+
+
+def entries(cache, stage):
+    """
+    Every file and directory left under a stage, relative to it.
+    """
+    stage_dir = os.path.join(cache.cache_dir, stage)
+    return sorted(os.path.relpath(os.path.join(root, name), stage_dir)
+                  for root, dirs, files in os.walk(stage_dir) for name in dirs + files)
+
+
+def test_round_trip(tmp_path):
+    cache = StageCache(str(tmp_path))
+    key = StageCache.key('tracks', video='abc', frames=(0, 100), params={'conf': 0.1})
+    arrays = {'bbox': np.arange(12, dtype=np.float32).reshape(3, 4), 'frame': np.array([0, 1, 1])}
+    cache.save('tracks', key, arrays, {'num_frames': 100})
+
+    for mmap in (False, True):
+        loaded, meta = cache.load('tracks', key, mmap=mmap)
+        assert meta == {'num_frames': 100}
+        assert loaded.keys() == arrays.keys()
+        for name, array in arrays.items():
+            np.testing.assert_array_equal(loaded[name], array)
+            assert loaded[name].dtype == array.dtype
+
+
+def test_keys_depend_on_every_dependency():
+    key = StageCache.key('tracks', video='abc', params={'conf': 0.1})
+    assert key == StageCache.key('tracks', params={'conf': 0.1}, video='abc')
+    assert key != StageCache.key('tracks', version=2, video='abc', params={'conf': 0.1})
+    assert key != StageCache.key('tracks', video='abc', params={'conf': 0.2})
+    assert key != StageCache.key('teams', video='abc', params={'conf': 0.1})
+
+
+def test_get_or_compute_computes_once(tmp_path):
+    cache = StageCache(str(tmp_path))
+    key = StageCache.key('teams', video='abc')
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'team_id': np.array([1, 2, 1], dtype=np.int8)}, {}
+
+    first = cache.get_or_compute('teams', key, compute)
+    second = cache.get_or_compute('teams', key, compute)
+    assert len(calls) == 1
+    np.testing.assert_array_equal(first[0]['team_id'], second[0]['team_id'])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_interrupted_save_leaves_nothing_behind(tmp_path):
+    cache = StageCache(str(tmp_path))
+    key = StageCache.key('tracks', video='abc')
+    # the second array can not be written without pickling, failing half way through
+    arrays = {'bbox': np.zeros((3, 4)), 'broken': np.array([{}, []], dtype=object)}
+    with pytest.raises(ValueError):
+        cache.save('tracks', key, arrays)
+
+    assert cache.load('tracks', key) is None
+    assert entries(cache, 'tracks') == [key[:2]]
+
+
+def test_concurrent_save_keeps_the_first_entry(tmp_path):
+    cache = StageCache(str(tmp_path))
+    key = StageCache.key('tracks', video='abc')
+    cache.save('tracks', key, {'bbox': np.ones(4)}, {'worker': 1})
+    cache.save('tracks', key, {'bbox': np.zeros(4)}, {'worker': 2})
+
+    arrays, meta = cache.load('tracks', key)
+    assert meta == {'worker': 1}
+    np.testing.assert_array_equal(arrays['bbox'], np.ones(4))
+    assert entries(cache, 'tracks') == sorted([key[:2], os.path.join(key[:2], key),
+                                               os.path.join(key[:2], key, 'bbox.npy'),
+                                               os.path.join(key[:2], key, 'meta.json')])
@@ -0,0 +1,61 @@
+import numpy as np
+from pipeline import StreamingPipeline
+from trackers import BallInterpolator
+
+
+def ball_detections(seed, num_frames):
+    """
+    A wandering ball with gaps of up to two seconds, some of them just
+    longer than the interpolator fills, and a few false detections.
+    """
+    rng = np.random.default_rng(seed)
+    position = np.cumsum(rng.normal(0, 6, (num_frames, 2)), axis=0) + 500
+    seen = np.ones(num_frames, dtype=bool)
+    for start, length in zip(rng.integers(0, num_frames, 8), rng.choice([10, 30, 47, 48, 49, 60], 8)):
+        seen[start:start + length] = False
+    frame = np.flatnonzero(seen)
+    position = position[frame]
+    outliers = rng.random(len(frame)) < 0.02
+    position[outliers] += 500
+    return frame, np.column_stack([position - 5, position + 5])
+
+
+def stream_ball(pipeline, frame, bbox, num_frames):
+    """
+    Interpolate the ball the way `StreamingPipeline.process` finalizes
+    frames: chunk by chunk, keeping `lookahead` frames pending.
+    """
+    interpolator = pipeline.tracker.ball_interpolator
+    interpolator.reset()
+    results, finalized, pending = [], 0, 0
+
+    def finalize(count):
+        window = (frame >= finalized) & (frame < finalized + pending)
+        result, interpolated = interpolator.update(frame[window], bbox[window], pending, count,
+                                                   frame_offset=finalized)
+        results.append((result, interpolated))
+
+    for start in range(0, num_frames, pipeline.chunk_size):
+        pending += min(pipeline.chunk_size, num_frames - start)
+        ready = pending - pipeline.lookahead
+        if ready > 0:
+            finalize(ready)
+            finalized, pending = finalized + ready, pending - ready
+    finalize(pending)
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def test_default_lookahead_matches_whole_video_ball():
+    pipeline = StreamingPipeline(model_path=None)
+    interpolator = pipeline.tracker.ball_interpolator
+    assert pipeline.lookahead >= interpolator.lookahead
+
+    num_frames = 1000
+    for seed in range(5):
+        frame, bbox = ball_detections(seed, num_frames)
+        whole = BallInterpolator(interpolator.max_gap, interpolator.max_speed)
+        expected, expected_interpolated, _ = whole.interpolate(frame, bbox, num_frames)
+        streamed, interpolated = stream_ball(pipeline, frame, bbox, num_frames)
+
+        np.testing.assert_allclose(streamed, expected)
+        np.testing.assert_array_equal(interpolated, expected_interpolated)
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+from utils import TrackTable, OBJECT_TYPES
+
+
+def legacy_tracks():
+    """
+    Three frames in the legacy layout; frame 1 has no ball and frame 2 no
+    referee.
+    """
+    return {
+        'players': [
+            {1: {'bbox': [0, 0, 10, 20], 'team_id': 1}, 2: {'bbox': [30, 0, 40, 20], 'team_id': 2}},
+            {1: {'bbox': [1, 0, 11, 20], 'team_id': 1}},
+            {2: {'bbox': [32, 0, 42, 20], 'team_id': 2}, 1: {'bbox': [2, 0, 12, 20], 'team_id': 1}},
+        ],
+        'referees': [{7: {'bbox': [50, 0, 60, 20]}}, {7: {'bbox': [51, 0, 61, 20]}}, {}],
+        'ball': [{1: {'bbox': [20, 30, 24, 34]}}, {}, {1: {'bbox': [22, 30, 26, 34]}}],
+    }
+
+
+@pytest.fixture
+def table():
+    return TrackTable.from_tracks(legacy_tracks())
+
+
+def test_from_tracks(table):
+    assert table.num_frames == 3
+    assert len(table) == 9
+    np.testing.assert_array_equal(table.frame_offsets, [0, 4, 6, 9])
+    assert table.filled == {'bbox', 'team_id'}
+    rows = table.rows_for_frame(1)
+    np.testing.assert_array_equal(rows, [4, 5])
+    assert [OBJECT_TYPES[t] for t in table.object_type[rows]] == ['players', 'referees']
+    np.testing.assert_array_equal(table.team_id, [1, 2, 0, 0, 1, 0, 2, 1, 0])
+    assert np.isnan(table.speed).all()
+
+
+def test_track_rows_are_in_frame_order(table):
+    np.testing.assert_array_equal(table.track_rows('players', 1), [0, 4, 7])
+    np.testing.assert_array_equal(table.track_rows('ball', 1), [3, 8])
+    assert len(table.track_rows('players', 5)) == 0
+    assert table.track_starts().sum() == 4
+
+
+def test_select_shifts_frames(table):
+    part = table.select(table.rows_for_frame(1).tolist() + table.rows_for_frame(2).tolist(), num_frames=2,
+                        frame_offset=1)
+    assert part.num_frames == 2
+    np.testing.assert_array_equal(part.frame, [0, 0, 1, 1, 1])
+    np.testing.assert_array_equal(part.frame_offsets, [0, 2, 5])
+    np.testing.assert_array_equal(part.bbox, table.bbox[4:])
+    assert part.filled == table.filled
+
+
+def test_concatenate_inverts_select(table):
+    head = table.select(np.arange(table.frame_offsets[1]), num_frames=1)
+    tail = table.select(np.arange(table.frame_offsets[1], len(table)), frame_offset=1)
+    tail.set_column('speed', 5.0)
+
+    joined = TrackTable.concatenate([head, tail])
+
+    assert joined.num_frames == 3
+    np.testing.assert_array_equal(joined.frame, table.frame)
+    np.testing.assert_array_equal(joined.track_id, table.track_id)
+    np.testing.assert_array_equal(joined.bbox, table.bbox)
+    # a column computed for part of the frames is missing in the others
+    assert joined.filled == {'bbox', 'team_id', 'speed'}
+    assert np.isnan(joined.speed[:4]).all() and (joined.speed[4:] == 5).all()
+    assert len(TrackTable.concatenate([])) == 0
+
+
+def test_frames_view_reads_the_columns(table):
+    tracks = table.as_tracks()
+
+    assert len(tracks['players']) == 3
+    # in the order of the legacy dicts
+    assert list(tracks['players'][2]) == [2, 1]
+    assert tracks['ball'][1] == {}
+    player = tracks['players'][0][2]
+    assert player['bbox'] == [30, 0, 40, 20]
+    assert player['team_id'] == 2
+    assert dict(tracks['referees'][-2][7]) == {'bbox': [51, 0, 61, 20]}
+    assert 'speed' not in player
+    with pytest.raises(KeyError):
+        player['speed']
+    assert [len(frame) for frame in tracks['players'][1:]] == [1, 2]
+
+
+def test_frames_view_writes_to_the_columns(table):
+    tracks = table.as_tracks()
+
+    tracks['players'][1][1]['speed'] = 12.5
+    tracks['players'][1][1]['note'] = 'sprint'
+    tracks['players'][1][1]['position_transformed'] = None
+
+    row = table.track_rows('players', 1)[1]
+    assert table.speed[row] == 12.5
+    assert 'speed' in table.filled
+    assert np.isnan(table.speed[np.arange(len(table)) != row]).all()
+    # a missing pitch position reads back as None once the column is computed
+    assert tracks['players'][1][1]['position_transformed'] is None
+    assert table.extra == {(row, 'note'): 'sprint'}
+    assert tracks['players'][1][1]['note'] == 'sprint'
+    del tracks['players'][1][1]['speed']
+    assert 'speed' not in tracks['players'][1][1]
+
+
+def test_write_back_updates_legacy_dicts(table):
+    tracks = legacy_tracks()
+    table.set_column('speed', np.arange(len(table), dtype=np.float32))
+    table.set_column('position_transformed', np.nan)
+
+    table.write_back(tracks, ['speed', 'position_transformed'])
+
+    assert tracks['players'][2][1]['speed'] == 7
+    assert tracks['ball'][0][1]['speed'] == 3
+    assert tracks['referees'][1][7]['position_transformed'] is None
@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+import pytest
+from view_transformer import ViewTransformer
+
+
+@pytest.fixture
+def transformer():
+    return ViewTransformer()
+
+
+def random_points(seed=0, n=500):
+    rng = np.random.default_rng(seed)
+    return rng.uniform([0, 0], [1920, 1080], (n, 2))
+
+
+def test_points_inside_matches_the_polygon_test(transformer):
+    points = random_points()
+    points_inside = transformer.points_inside(points)
+    expected = [cv2.pointPolygonTest(transformer.pixel_verticies, (int(x), int(y)), False) >= 0 for x, y in points]
+    assert points_inside.tolist() == expected
+    assert 0 < points_inside.sum() < len(points)
+
+
+def test_points_inside_handles_nan(transformer):
+    assert transformer.points_inside([[np.nan, np.nan], [600, 600]]).tolist() == [False, True]
+
+
+def test_transform_points_matches_transform_point(transformer):
+    points = random_points(seed=1)
+    points[::50] = np.nan
+
+    transformed = transformer.transform_points(points)
+
+    assert transformed.dtype == np.float32
+    for point, court in zip(points, transformed):
+        expected = None if np.isnan(point).any() else transformer.transform_point(point)
+        if expected is None:
+            assert np.isnan(court).all()
+        else:
+            # cv2 maps in float32, which loses digits where the calibration stretches the most
+            np.testing.assert_allclose(court, expected[0], rtol=1e-4, atol=1e-3)
+
+
+def test_transform_points_follows_camera_motion(transformer):
+    points = random_points(seed=2, n=50)
+    # each point's frame is panned right of the calibrated frame by its index in pixels
+    shifts = np.arange(len(points), dtype=np.float64)
+    to_reference = np.tile(np.eye(3), (len(points), 1, 1))
+    to_reference[:, 0, 2] = -shifts
+
+    moved = transformer.transform_points(points + np.stack([shifts, np.zeros_like(shifts)], axis=1), to_reference)
+
+    np.testing.assert_allclose(moved, transformer.transform_points(points), rtol=1e-5, atol=1e-4)
+
+
+def random_transforms(n, seed=0):
+    rng = np.random.default_rng(seed)
+    transforms = np.tile(np.eye(3), (n, 1, 1))
+    transforms[:, :2, :2] += rng.normal(0, 0.01, (n, 2, 2))
+    transforms[:, :2, 2] = rng.normal(0, 3, (n, 2))
+    transforms[:, 2, :2] = rng.normal(0, 1e-5, (n, 2))
+    return transforms
+
+
+@pytest.mark.parametrize('n', [0, 1, 2, 3, 7, 64, 100])
+def test_accumulate_camera_transforms_chains_every_frame(n):
+    transforms = random_transforms(n)
+    initial = random_transforms(1, seed=1)[0]
+
+    expected, running = [], initial
+    for transform in transforms:
+        running = transform @ running
+        expected.append(running)
+
+    accumulated = ViewTransformer.accumulate_camera_transforms(transforms, initial=initial)
+
+    assert accumulated.shape == (n, 3, 3)
+    np.testing.assert_allclose(accumulated, np.reshape(expected, (n, 3, 3)), rtol=1e-9, atol=1e-9)
+    # the input is left untouched
+    np.testing.assert_array_equal(transforms, random_transforms(n))
+
+
+def test_accumulate_camera_transforms_continues_across_chunks():
+    transforms = random_transforms(50, seed=3)
+    whole = ViewTransformer.accumulate_camera_transforms(transforms)
+
+    head = ViewTransformer.accumulate_camera_transforms(transforms[:20])
+    tail = ViewTransformer.accumulate_camera_transforms(transforms[20:], initial=head[-1])
+
+    np.testing.assert_allclose(np.concatenate([head, tail]), whole, rtol=1e-9, atol=1e-9)
@@ -1 +1,6 @@
-from .tracker import Tracker 
\ No newline at end of file
+from .tracker import Tracker 
+from .inference_engine import InferenceEngine, FrameDetections, pack_detections, unpack_detections
+from .ball_interpolator import BallInterpolator
+from .keyframe_detector import KeyframeDetector
+from .ball_roi_detector import BallRoiDetector
+from .detector_backends import load_detector, export_detector, prepare_detector
@@ -0,0 +1,197 @@
+import numpy as np
+
+
+class BallInterpolator:
+    """
+    Fills the frames in which the ball was not detected.
+
+    Works on arrays of ball detections: the frame number and bbox of every
+    detection. Detections that teleport are dropped first: a detection is
+    an outlier when the ball would have to move faster than `max_speed`
+    both to reach it from the previous detection and to get from it to the
+    next one. The first and last detection can not be judged this way and
+    are always kept. Gaps of at most `max_gap` missing frames between the
+    remaining detections are filled linearly; the frames before the first
+    and after the last detection are held at that detection when there are
+    at most `max_gap` of them. Longer gaps stay empty instead of inventing
+    positions across an occlusion.
+
+    `update` runs the same interpolation over a sliding window of a stream,
+    carrying the last detection from one call to the next. It gives the
+    same result as interpolating the whole video at once when the window
+    looks at least `2 * (max_gap + 1)` frames ahead, enough to see the next
+    detection and that detection's own next neighbour. With a shorter
+    look-ahead, frames after the last detection in the window are held at
+    it while the gap may still turn out to be short.
+    """
+    def __init__(self, max_gap=48, max_speed=60.0):
+        """
+        Args:
+            max_gap: Longest run of missing frames that is filled, e.g.
+                two seconds at 24 fps. None fills every gap.
+            max_speed: Largest plausible ball speed, in pixels per frame
+                between bbox centers. None disables outlier rejection.
+        """
+        self.max_gap = max_gap
+        self.max_speed = max_speed
+        self.reset()
+
+    @property
+    def lookahead(self):
+        """
+        Frames of look-ahead `update` needs to match interpolating the whole
+        video, None when every gap is filled and no window is enough.
+        """
+        return None if self.max_gap is None else 2 * (self.max_gap + 1)
+
+    def reset(self):
+        """
+        Forget the detections of the previous window, e.g. before a new video.
+        """
+        self.anchor = None
+        self.previous = None
+
+    def find_outliers(self, frame, bbox, previous=None):
+        """
+        Flag detections that are too far from both of their neighbours.
+        Args:
+            frame: (N,) sorted frame numbers of the detections.
+            bbox: (N, 4) bboxes of the detections.
+            previous: Optional (frame, bbox) of the detection before
+                `frame[0]`, used as the first detection's previous neighbour.
+
+        Returns:
+            (N,) boolean array, True for rejected detections.
+        """
+        frame, bbox = self._with_anchor(frame, bbox, previous)
+        outliers = np.zeros(len(frame), dtype=bool)
+        if self.max_speed is not None and len(frame) > 2:
+            centers = (bbox[:, :2] + bbox[:, 2:]) / 2
+            steps = np.diff(frame)
+            speed = np.linalg.norm(np.diff(centers, axis=0), axis=1) / np.maximum(steps, 1)
+            too_fast = speed > self.max_speed
+            if self.max_gap is not None:
+                # detections separated by an unfilled gap are not neighbours
+                too_fast &= steps <= self.max_gap + 1
+            outliers[1:-1] = too_fast[:-1] & too_fast[1:]
+        return outliers[1:] if previous is not None else outliers
+
+    def interpolate(self, frame, bbox, num_frames, frame_offset=0, anchor=None, previous=None):
+        """
+        Interpolate the ball over a run of frames.
+        Args:
+            frame: (N,) sorted video frame numbers of the ball detections.
+                Frames before the first detection are counted from frame 0.
+            bbox: (N, 4) bboxes of the detections.
+            num_frames: Number of frames to fill, starting at `frame_offset`.
+            frame_offset: Frame number of the first frame to fill.
+            anchor: Optional (frame, bbox) of the last accepted detection
+                before the run, from which the first gap is interpolated.
+            previous: Optional (frame, bbox) of the last detection before
+                the run, accepted or not, for the outlier test.
+
+        Returns:
+            bbox: (num_frames, 4) ball bboxes, NaN where there is no ball.
+            interpolated: (num_frames,) True where the bbox was filled in
+                rather than detected.
+            rejected: (N,) True for the detections dropped as outliers.
+        """
+        frame = np.asarray(frame, dtype=np.int64).reshape(-1)
+        bbox = np.asarray(bbox, dtype=np.float64).reshape(-1, 4)
+        rejected = self.find_outliers(frame, bbox, previous)
+        known_frame, known_bbox = self._with_anchor(frame[~rejected], bbox[~rejected], anchor)
+
+        result = np.full((num_frames, 4), np.nan)
+        interpolated = np.zeros(num_frames, dtype=bool)
+        if len(known_frame) == 0 or num_frames == 0:
+            return result, interpolated, rejected
+
+        target = frame_offset + np.arange(num_frames)
+        right = np.searchsorted(known_frame, target)
+        has_right = right < len(known_frame)
+        right_frame = known_frame[np.minimum(right, len(known_frame) - 1)]
+        left_frame = known_frame[np.maximum(right - 1, 0)]
+        detected = has_right & (right_frame == target)
+        has_left = right > 0
+
+        max_gap = np.inf if self.max_gap is None else self.max_gap
+        inside = has_left & has_right & (right_frame - left_frame - 1 <= max_gap)
+        leading = ~has_left & (right_frame <= max_gap)
+        trailing = ~has_right & (frame_offset + num_frames - 1 - left_frame <= max_gap)
+        filled = detected | inside | leading | trailing
+
+        for i in range(4):
+            result[:, i] = np.interp(target, known_frame, known_bbox[:, i])
+        result[~filled] = np.nan
+        interpolated[filled & ~detected] = True
+        return result, interpolated, rejected
+
+    def update(self, frame, bbox, num_frames, count, frame_offset=0):
+        """
+        Interpolate a window of a stream and finalize its first `count`
+        frames.
+
+        The remaining frames of the window are only look-ahead: they are
+        used as the next neighbours of the finalized frames and are
+        interpolated again by the next call. The last detection and the
+        last accepted detection among the finalized frames are carried over
+        to the next call.
+        Args:
+            frame: (N,) sorted frame numbers of the detections in the window.
+            bbox: (N, 4) bboxes of the detections.
+            num_frames: Length of the window.
+            count: Number of frames to finalize.
+            frame_offset: Frame number of the first frame of the window.
+
+        Returns:
+            bbox and interpolated arrays of the `count` finalized frames,
+            as returned by `interpolate`.
+        """
+        frame = np.asarray(frame, dtype=np.int64).reshape(-1)
+        bbox = np.asarray(bbox, dtype=np.float64).reshape(-1, 4)
+        result, interpolated, rejected = self.interpolate(frame, bbox, num_frames, frame_offset, self.anchor,
+                                                          self.previous)
+        finalized = frame < frame_offset + count
+        accepted = np.flatnonzero(~rejected & finalized)
+        if len(accepted):
+            self.anchor = (int(frame[accepted[-1]]), bbox[accepted[-1]].copy())
+        if finalized.any():
+            last = np.flatnonzero(finalized)[-1]
+            self.previous = (int(frame[last]), bbox[last].copy())
+        return result[:count], interpolated[:count]
+
+    @staticmethod
+    def _with_anchor(frame, bbox, anchor):
+        if anchor is None:
+            return frame, bbox
+        anchor_frame, anchor_bbox = anchor
+        return (np.concatenate([[anchor_frame], frame]).astype(np.int64),
+                np.concatenate([np.asarray(anchor_bbox, dtype=np.float64).reshape(1, 4), bbox]))
+
+    @staticmethod
+    def from_ball_tracks(ball_positions, frame_offset=0):
+        """
+        Detection arrays from the legacy per-frame ball dicts.
+
+        Returns:
+            (frame, bbox) arrays.
+        """
+        frame = [frame_offset + frame_num for frame_num, ball in enumerate(ball_positions) if ball]
+        bbox = [ball[1]['bbox'] for ball in ball_positions if ball]
+        return np.asarray(frame, dtype=np.int64), np.asarray(bbox, dtype=np.float64).reshape(-1, 4)
+
+    @staticmethod
+    def to_ball_tracks(bbox, interpolated):
+        """
+        Legacy per-frame ball dicts from interpolated arrays. Filled-in
+        frames are marked with 'interpolated': True.
+        """
+        ball_positions = []
+        for ball_bbox, is_interpolated in zip(bbox, interpolated):
+            if np.isnan(ball_bbox[0]):
+                ball_positions.append({})
+            elif is_interpolated:
+                ball_positions.append({1: {'bbox': ball_bbox.tolist(), 'interpolated': True}})
+            else:
+                ball_positions.append({1: {'bbox': ball_bbox.tolist()}})
+        return ball_positions
@@ -0,0 +1,230 @@
+import numpy as np
+from .inference_engine import FrameDetections
+from utils import iter_chunks
+
+
+class BallRoiDetector:
+    """
+    Detects the players on the downscaled full frame and the ball on a
+    full-resolution crop around where the ball is expected.
+
+    The full-frame pass of the InferenceEngine runs as before for every
+    class. The ball is then looked for in a `crop_size` square crop at
+    native resolution, centered on the full-frame ball when that pass found
+    one and otherwise on the ball track extrapolated at constant velocity
+    from its last two positions. A ball found in the crop replaces the
+    full-frame one. When the ball has been missing for more than
+    `max_missed` frames and the full-frame pass has no hint, the whole frame
+    is searched in overlapping crop-sized tiles, every `search_interval`
+    frames until the ball is found again.
+
+    Crops go through the model `crop_batch_size` frames at a time, so the
+    track is extrapolated at most that many frames ahead. Frames are counted
+    in video frames, also when only some of them are refined, e.g. the
+    keyframes of a KeyframeDetector, which passes their frame numbers.
+    """
+    def __init__(self, inference_engine, crop_size=320, max_missed=12, search_interval=6, tile_overlap=32,
+                 crop_batch_size=8, ball_class='ball'):
+        """
+        Args:
+            inference_engine: InferenceEngine running the full-frame pass;
+                its model also runs on the crops.
+            crop_size: Side of the ball crops and tiles in frame pixels,
+                a multiple of 32. They are not resized.
+            max_missed: Frames the ball may be missing before it counts as
+                lost and the track is no longer extrapolated.
+            search_interval: Frames between two tiled searches while the
+                ball is lost.
+            tile_overlap: Overlap of neighbouring tiles in pixels, larger
+                than the ball.
+            crop_batch_size: Frames whose crops are predicted together.
+            ball_class: Class name of the ball.
+        """
+        if crop_size % 32:
+            raise ValueError(f"crop_size must be a multiple of 32, got {crop_size}")
+        self.inference_engine = inference_engine
+        self.crop_size = crop_size
+        self.max_missed = max_missed
+        self.search_interval = search_interval
+        self.tile_overlap = tile_overlap
+        self.crop_batch_size = max(1, crop_batch_size)
+        self.ball_class = ball_class
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the ball track, e.g. before a new video.
+        """
+        self.frame_num = 0
+        self.track = []
+        self.last_search = None
+        self.stats = {'frames': 0, 'crops': 0, 'searches': 0, 'crop_hits': 0}
+
+    def state(self):
+        """
+        JSON-serializable state carried from one call to the next.
+        """
+        return {'frame_num': self.frame_num, 'track': [[frame_num, float(x), float(y)]
+                                                       for frame_num, (x, y) in self.track],
+                'last_search': self.last_search}
+
+    def prime(self, state):
+        """
+        Continue from a `state()` taken after frames this detector did not
+        see, e.g. chunks whose detections came from the stage cache.
+        """
+        self.frame_num = state['frame_num']
+        self.track = [(frame_num, np.array([x, y])) for frame_num, x, y in state['track']]
+        self.last_search = state['last_search']
+
+    def seek(self, frame_num):
+        """
+        Continue at video frame `frame_num`, e.g. after frames that were
+        not refined.
+        """
+        self.frame_num = max(self.frame_num, frame_num)
+
+    def detect(self, frames):
+        """
+        Detect objects in consecutive frames following the previous call.
+
+        Returns:
+            A `FrameDetections` per frame.
+        """
+        frames = list(frames)
+        detections = self.inference_engine.detect(frames)
+        for start in range(0, len(frames), self.crop_batch_size):
+            stop = start + self.crop_batch_size
+            detections[start:stop] = self.refine(frames[start:stop], detections[start:stop])
+        return detections
+
+    def refine(self, frames, detections, frame_numbers=None):
+        """
+        Replace the full-frame ball of a few frames with the one found in
+        their crops or tiles, and advance the ball track.
+        Args:
+            frames: The frames, in video order.
+            detections: Their full-frame FrameDetections.
+            frame_numbers: Video frame number of each frame, increasing and
+                not before `frame_num`. Defaults to the frames right after
+                the previous call.
+        """
+        if not detections:
+            return detections
+        if frame_numbers is None:
+            frame_numbers = range(self.frame_num, self.frame_num + len(frames))
+        frame_numbers = [int(frame_num) for frame_num in frame_numbers]
+        ball_id = self.ball_class_id(detections[0].names)
+        crops, owners, offsets = [], [], []
+        for index, (frame, detection) in enumerate(zip(frames, detections)):
+            frame_num = frame_numbers[index]
+            center = self.best_ball_center(detection, ball_id)
+            if center is None and self.track and frame_num - self.track[-1][0] <= self.max_missed:
+                center = self.predict(frame_num)
+            if center is not None:
+                windows = [self.window(center, frame.shape)]
+            elif self.last_search is None or frame_num - self.last_search >= self.search_interval:
+                windows = self.tiles(frame.shape)
+                self.last_search = frame_num
+                self.stats['searches'] += 1
+            else:
+                windows = []
+            for x1, y1, x2, y2 in windows:
+                crops.append(frame[y1:y2, x1:x2])
+                owners.append(index)
+                offsets.append((x1, y1))
+
+        found = {}
+        for (xyxy, confidence), owner, offset in zip(self.find_balls(crops, ball_id), owners, offsets):
+            if xyxy is not None and (owner not in found or confidence > found[owner][1]):
+                found[owner] = (xyxy + np.tile(offset, 2), confidence)
+        self.stats['crops'] += len(crops)
+        self.stats['crop_hits'] += len(found)
+
+        refined = []
+        for index, detection in enumerate(detections):
+            if index in found:
+                xyxy, confidence = found[index]
+                keep = detection.class_id != ball_id
+                detection = FrameDetections(np.concatenate([detection.xyxy[keep], xyxy[None]]),
+                                            np.append(detection.confidence[keep], confidence),
+                                            np.append(detection.class_id[keep], ball_id), detection.names)
+            center = self.best_ball_center(detection, ball_id)
+            if center is not None:
+                self.track = (self.track + [(frame_numbers[index], center)])[-2:]
+            refined.append(detection)
+        self.frame_num = frame_numbers[-1] + 1
+        self.stats['frames'] += len(frames)
+        return refined
+
+    def ball_class_id(self, names):
+        for class_id, name in names.items():
+            if name == self.ball_class:
+                return class_id
+        return None
+
+    @staticmethod
+    def best_ball_center(detection, ball_id):
+        rows = np.flatnonzero(detection.class_id == ball_id)
+        if len(rows) == 0:
+            return None
+        x1, y1, x2, y2 = detection.xyxy[rows[np.argmax(detection.confidence[rows])]]
+        return np.array([(x1 + x2) / 2, (y1 + y2) / 2])
+
+    def predict(self, frame_num):
+        """
+        Ball center at `frame_num`, extrapolated from the last two positions.
+        """
+        if len(self.track) < 2:
+            return self.track[-1][1]
+        (previous_frame, previous), (last_frame, last) = self.track
+        velocity = (last - previous) / max(last_frame - previous_frame, 1)
+        return last + velocity * (frame_num - last_frame)
+
+    def window(self, center, frame_shape):
+        """
+        The crop-sized window around `center`, shifted inside the frame.
+        """
+        height, width = frame_shape[:2]
+        half = self.crop_size // 2
+        x1 = int(np.clip(round(center[0]) - half, 0, max(width - self.crop_size, 0)))
+        y1 = int(np.clip(round(center[1]) - half, 0, max(height - self.crop_size, 0)))
+        return x1, y1, min(x1 + self.crop_size, width), min(y1 + self.crop_size, height)
+
+    def tiles(self, frame_shape):
+        """
+        Overlapping crop-sized windows covering the whole frame.
+        """
+        height, width = frame_shape[:2]
+        stride = max(self.crop_size - self.tile_overlap, 1)
+
+        def starts(length):
+            last = max(length - self.crop_size, 0)
+            return sorted(set(list(range(0, last + 1, stride)) + [last]))
+
+        return [(x, y, min(x + self.crop_size, width), min(y + self.crop_size, height))
+                for y in starts(height) for x in starts(width)]
+
+    def find_balls(self, crops, ball_id):
+        """
+        Most confident ball of every crop.
+
+        Returns:
+            List of (xyxy in crop pixels, confidence), (None, 0.0) where the
+            crop holds no ball.
+        """
+        engine = self.inference_engine
+        balls = []
+        for batch in iter_chunks(crops, engine.max_batch_size):
+            results = engine.model.predict(batch, conf=engine.conf, imgsz=self.crop_size, verbose=False)
+            for result in results:
+                boxes = result.boxes
+                class_id = boxes.cls.cpu().numpy().astype(int)
+                confidence = boxes.conf.cpu().numpy()
+                rows = np.flatnonzero(class_id == ball_id)
+                if len(rows) == 0:
+                    balls.append((None, 0.0))
+                    continue
+                best = rows[np.argmax(confidence[rows])]
+                balls.append((boxes.xyxy.cpu().numpy()[best].astype(np.float32), float(confidence[best])))
+        return balls
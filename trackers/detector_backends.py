@@ -0,0 +1,531 @@
+import ast
+import os
+import shutil
+import tempfile
+import cv2
+import numpy as np
+from utils import iter_video, get_frame_count
+
+try:
+    from ultralytics import YOLO
+except ImportError:
+    YOLO = None
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+try:
+    import openvino as ov
+except ImportError:
+    ov = None
+
+try:
+    import nncf
+except ImportError:
+    nncf = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def available_backends():
+    """
+    Which detector backends can be used in this environment.
+
+    Returns:
+        Dict of backend name to True when its runtime is installed. INT8
+        export also needs `onnx` for 'onnx' and `nncf` for 'openvino'.
+    """
+    return {'pytorch': YOLO is not None, 'onnx': ort is not None, 'openvino': ov is not None}
+
+
+def usable_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class _Array(np.ndarray):
+    """
+    An array answering the `.cpu().numpy()` calls made on ultralytics tensors.
+    """
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return np.asarray(self)
+
+
+class _Boxes:
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).view(_Array)
+        self.conf = np.asarray(conf, dtype=np.float32).view(_Array)
+        self.cls = np.asarray(cls, dtype=np.float32).view(_Array)
+
+
+class _Result:
+    def __init__(self, xyxy, conf, cls, names):
+        self.boxes = _Boxes(xyxy, conf, cls)
+        self.names = names
+
+
+def letterbox(images, imgsz, stride=32, input_shape=None):
+    """
+    Resize and pad a batch of equally sized images into the input tensor of
+    an exported YOLO model, the way ultralytics does for its own models.
+    Args:
+        images: BGR images of the same shape.
+        imgsz: Inference size the long side is scaled to.
+        stride: Padding granularity of models with a dynamic input shape.
+        input_shape: (height, width) of models with a static input shape.
+
+    Returns:
+        (blob, ratio, (pad_x, pad_y)): the (N, 3, H, W) float32 RGB tensor
+        in [0, 1], the scale and the left/top padding applied to the images.
+    """
+    height, width = images[0].shape[:2]
+    target = input_shape or (imgsz, imgsz)
+    ratio = min(target[0] / height, target[1] / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    pad_x, pad_y = target[1] - new_width, target[0] - new_height
+    if input_shape is None:
+        # minimal padding up to the stride instead of a full square
+        pad_x, pad_y = pad_x % stride, pad_y % stride
+    left, top = int(round(pad_x / 2 - 0.1)), int(round(pad_y / 2 - 0.1))
+    right, bottom = pad_x - left, pad_y - top
+
+    blob = np.empty((len(images), 3, new_height + pad_y, new_width + pad_x), dtype=np.float32)
+    for i, image in enumerate(images):
+        if (new_height, new_width) != (height, width):
+            image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+        image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+        blob[i] = image[:, :, ::-1].transpose(2, 0, 1)
+    blob *= 1 / 255
+    return blob, ratio, (left, top)
+
+
+def non_max_suppression(prediction, conf, iou, max_det, max_wh=7680):
+    """
+    Per-class NMS over the raw output of a YOLOv8 detection head.
+    Args:
+        prediction: (4 + classes, anchors) array of center xywh boxes
+            followed by the class scores of one image.
+        conf: Minimum confidence.
+        iou: IoU above which the less confident of two boxes of the same
+            class is dropped.
+        max_det: Most detections kept.
+        max_wh: Offset separating the boxes of different classes.
+
+    Returns:
+        (xyxy, confidence, class_id) of the kept boxes, most confident first.
+    """
+    scores = prediction[4:].T
+    class_id = scores.argmax(axis=1)
+    confidence = scores[np.arange(len(scores)), class_id]
+    keep = confidence > conf
+    boxes, confidence, class_id = prediction[:4].T[keep], confidence[keep], class_id[keep]
+    xyxy = np.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2], axis=1)
+    if not len(xyxy):
+        return xyxy, confidence, class_id
+
+    # shifting every class to its own region makes a single NMS call per-class
+    rects = np.concatenate([xyxy[:, :2] + class_id[:, None] * max_wh, boxes[:, 2:]], axis=1)
+    indices = np.asarray(cv2.dnn.NMSBoxes(rects.tolist(), confidence.tolist(), conf, iou), dtype=int).reshape(-1)
+    indices = indices[np.argsort(-confidence[indices], kind='stable')][:max_det]
+    return xyxy[indices], confidence[indices], class_id[indices]
+
+
+class ExportedDetector:
+    """
+    Runs a YOLOv8 model exported from ultralytics without PyTorch.
+
+    Implements the `predict` call the InferenceEngine and BallRoiDetector
+    make on an ultralytics model: images are letterboxed here, the runtime
+    of the subclass produces the raw head output, and boxes are filtered by
+    confidence and per-class NMS and mapped back to image pixels.
+    """
+    def __init__(self, names, stride=32, input_shape=None, batch_size=None, iou=0.7, max_det=300):
+        """
+        Args:
+            names: Dict of class ID to class name.
+            stride: Largest stride of the model.
+            input_shape: (height, width) of a static input, None if dynamic.
+            batch_size: Static batch size of the model, None if dynamic.
+            iou: NMS IoU threshold, as in ultralytics.
+            max_det: Most detections per image, as in ultralytics.
+        """
+        if names is None:
+            raise ValueError("The exported model has no class names; pass names={0: 'ball', ...}")
+        self.names = {int(class_id): name for class_id, name in names.items()}
+        self.stride = stride
+        self.input_shape = input_shape
+        self.batch_size = batch_size
+        self.iou = iou
+        self.max_det = max_det
+
+    def infer(self, blob):
+        raise NotImplementedError
+
+    def predict(self, batch, conf=0.25, imgsz=640, verbose=False):
+        if not len(batch):
+            return []
+        if any(image.shape != batch[0].shape for image in batch):
+            return [result for image in batch for result in self.predict([image], conf, imgsz)]
+        blob, ratio, pad = letterbox(batch, imgsz, self.stride, self.input_shape)
+        step = self.batch_size or len(blob)
+        outputs = []
+        for i in range(0, len(blob), step):
+            part = blob[i:i + step]
+            if len(part) < step:
+                # a static batch only takes full batches; the outputs of the padding are dropped
+                part = np.concatenate([part, np.zeros((step - len(part),) + part.shape[1:], dtype=part.dtype)])
+            outputs.append(self.infer(part)[:len(blob) - i])
+        outputs = np.concatenate(outputs)
+
+        results = []
+        for image, prediction in zip(batch, outputs):
+            xyxy, confidence, class_id = non_max_suppression(prediction, conf, self.iou, self.max_det)
+            height, width = image.shape[:2]
+            xyxy = (xyxy - np.tile(pad, 2)) / ratio
+            xyxy = np.clip(xyxy, 0, [width, height, width, height])
+            results.append(_Result(xyxy, confidence, class_id, self.names))
+        return results
+
+
+def _static_dims(dims):
+    """
+    (batch size, (height, width)) of an NCHW input, None where dynamic.
+    """
+    batch = dims[0] if isinstance(dims[0], int) else None
+    shape = tuple(dims[2:]) if all(isinstance(dim, int) for dim in dims[2:]) else None
+    return batch, shape
+
+
+class OnnxDetector(ExportedDetector):
+    """
+    Runs an ONNX export on ONNX Runtime, FP32 or quantized to INT8.
+    """
+    def __init__(self, path, names=None, threads=None, inter_op_threads=1, providers=None, iou=0.7,
+                 max_det=300):
+        """
+        Args:
+            path: Path of the .onnx file.
+            names: Class names; read from the model metadata by default.
+            threads: Intra-op threads, i.e. threads working on one layer.
+                Defaults to the CPUs this process may use.
+            inter_op_threads: Threads running independent layers in
+                parallel. A YOLO graph is mostly a chain, so more than one
+                rarely helps.
+            providers: ONNX Runtime execution providers, CPU by default.
+            iou, max_det: As for ExportedDetector.
+        """
+        if ort is None:
+            raise RuntimeError("The 'onnx' detector backend needs ONNX Runtime: pip install onnxruntime")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or usable_cpus()
+        options.inter_op_num_threads = max(1, inter_op_threads)
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if inter_op_threads > 1 \
+            else ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=providers or ['CPUExecutionProvider'])
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch_size, input_shape = _static_dims(model_input.shape)
+        super().__init__(names or _parse_names(metadata.get('names')), stride=int(metadata.get('stride', 32)),
+                         input_shape=input_shape, batch_size=batch_size, iou=iou, max_det=max_det)
+
+    def infer(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVINODetector(ExportedDetector):
+    """
+    Runs an OpenVINO IR export on the OpenVINO CPU plugin, FP32 or INT8.
+    """
+    def __init__(self, path, names=None, threads=None, streams=None, performance_hint='LATENCY', device='CPU',
+                 iou=0.7, max_det=300):
+        """
+        Args:
+            path: The export directory or its .xml file.
+            names: Class names; read from the export's metadata.yaml by
+                default.
+            threads: Inference threads. Defaults to the CPUs this process
+                may use.
+            streams: Inference streams, i.e. requests the CPU is split
+                between. None leaves it to `performance_hint`.
+            performance_hint: 'LATENCY' for one request at a time, as the
+                pipelines run, or 'THROUGHPUT'.
+            device: OpenVINO device.
+            iou, max_det: As for ExportedDetector.
+        """
+        if ov is None:
+            raise RuntimeError("The 'openvino' detector backend needs OpenVINO: pip install openvino")
+        directory, xml_path = _openvino_paths(path)
+        config = {'PERFORMANCE_HINT': performance_hint, 'INFERENCE_NUM_THREADS': threads or usable_cpus()}
+        if streams is not None:
+            config['NUM_STREAMS'] = streams
+        core = ov.Core()
+        self.compiled = core.compile_model(core.read_model(xml_path), device, config)
+        self.request = self.compiled.create_infer_request()
+        partial_shape = self.compiled.input(0).get_partial_shape()
+        dims = [dim.get_length() if dim.is_static else None for dim in partial_shape]
+        batch_size, input_shape = _static_dims(dims)
+        metadata = _read_metadata(os.path.join(directory, 'metadata.yaml'))
+        super().__init__(names or metadata.get('names'), stride=int(metadata.get('stride', 32)),
+                         input_shape=input_shape, batch_size=batch_size, iou=iou, max_det=max_det)
+
+    def infer(self, blob):
+        self.request.infer({0: blob})
+        return self.request.get_output_tensor(0).data.copy()
+
+
+DETECTORS = {'onnx': OnnxDetector, 'openvino': OpenVINODetector}
+
+
+def _parse_names(names):
+    # ultralytics stores the class names as the repr of a dict
+    return ast.literal_eval(names) if isinstance(names, str) else names
+
+
+def _read_metadata(path):
+    if yaml is None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+
+def _openvino_paths(path):
+    """
+    (export directory, .xml path) of an OpenVINO export.
+    """
+    if path.endswith('.xml'):
+        return os.path.dirname(path), path
+    xml_files = sorted(name for name in os.listdir(path) if name.endswith('.xml'))
+    if not xml_files:
+        raise FileNotFoundError(f'No OpenVINO .xml model in {path}')
+    return path, os.path.join(path, xml_files[0])
+
+
+def export_path(model_path, backend, int8=False):
+    """
+    Where the `backend` export of the weights at `model_path` is kept, next
+    to them: best.onnx, best_int8.onnx, best_openvino_model/ or
+    best_int8_openvino_model/ for models/best.pt.
+    """
+    stem = os.path.splitext(model_path)[0] + ('_int8' if int8 else '')
+    if backend == 'onnx':
+        return stem + '.onnx'
+    if backend == 'openvino':
+        return stem + '_openvino_model'
+    raise ValueError(f"Unknown detector backend {backend!r}, expected one of {sorted(DETECTORS)}")
+
+
+def _is_current(path, source):
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source)
+
+
+def load_calibration_frames(sources, count=300):
+    """
+    Frames to calibrate INT8 quantization on, ideally from our own footage.
+    Args:
+        sources: Path, or list of paths, of videos and directories of
+            images.
+        count: Number of frames, spread evenly over the sources and over
+            the length of every video.
+
+    Returns:
+        List of BGR frames.
+    """
+    sources = [sources] if isinstance(sources, str) else list(sources)
+    per_source = max(1, -(-count // max(len(sources), 1)))
+    frames = []
+    for source in sources:
+        if os.path.isdir(source):
+            names = sorted(name for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS))
+            picked = [names[int(i)] for i in np.linspace(0, len(names) - 1, min(per_source, len(names)))]
+            frames.extend(cv2.imread(os.path.join(source, name)) for name in picked)
+        else:
+            total = get_frame_count(source)
+            for frame_num in np.unique(np.linspace(0, max(total - 1, 0), per_source).astype(int)):
+                frames.extend(iter_video(source, start=int(frame_num), stop=int(frame_num) + 1))
+    return [frame for frame in frames if frame is not None][:count]
+
+
+def _calibration_blobs(frames, imgsz):
+    # the same downscale as InferenceEngine.preprocess, then the same letterbox as at inference
+    for frame in frames:
+        scale = min(1.0, imgsz / max(frame.shape[:2]))
+        if scale < 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        yield letterbox([frame], imgsz)[0]
+
+
+def _quantize_onnx(source, target, blobs):
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, \
+        quantize_static
+
+    input_name = ort.InferenceSession(source, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.blobs = iter(blobs)
+
+        def get_next(self):
+            blob = next(self.blobs, None)
+            return None if blob is None else {input_name: blob}
+
+    # Only the convolutions are quantized: they hold nearly all the compute, and the box decoding of
+    # the head stays in float. QDQ with signed activations and weights is ONNX Runtime's recommended
+    # CPU format.
+    quantize_static(source, target, Reader(), quant_format=QuantFormat.QDQ, op_types_to_quantize=['Conv'],
+                    per_channel=True, activation_type=QuantType.QInt8, weight_type=QuantType.QInt8,
+                    calibrate_method=CalibrationMethod.MinMax,
+                    extra_options={'CalibMaxIntermediateOutputs': 16})
+    model = onnx.load(target)
+    if not {prop.key for prop in model.metadata_props} & {'names'}:
+        onnx.helper.set_model_props(model, {prop.key: prop.value for prop in onnx.load(source).metadata_props})
+        onnx.save(model, target)
+
+
+def _quantize_openvino(source, target, blobs):
+    if nncf is None:
+        raise RuntimeError("INT8 export for the 'openvino' backend needs NNCF: pip install nncf")
+    directory, xml_path = _openvino_paths(source)
+    blobs = list(blobs)
+    # the sigmoids and the box decoding of the head stay in float, as in ultralytics' own INT8 export
+    quantized = nncf.quantize(ov.Core().read_model(xml_path), nncf.Dataset(blobs), subset_size=len(blobs),
+                              preset=nncf.QuantizationPreset.MIXED,
+                              ignored_scope=nncf.IgnoredScope(types=['Sigmoid', 'Softmax', 'Subtract', 'Divide'],
+                                                              validate=False))
+    os.makedirs(target)
+    ov.save_model(quantized, os.path.join(target, os.path.basename(xml_path)))
+    metadata_path = os.path.join(directory, 'metadata.yaml')
+    if os.path.exists(metadata_path):
+        shutil.copy(metadata_path, target)
+
+
+def export_detector(model_path, backend='pytorch', int8=False, imgsz=640, calibration=None, calibration_frames=300,
+                    force_export=False, **options):
+    """
+    Export the YOLO weights for `backend`, unless an export at least as new
+    as the weights already exists.
+
+    The FP32 export goes through ultralytics with a dynamic input shape, so
+    frames are padded only up to the model stride and the ball crops run at
+    their own size. INT8 post-training quantization is calibrated on
+    `calibration_frames` frames of `calibration`, preprocessed exactly as
+    at inference. Neither is redone when the calibration footage changes;
+    use `force_export` then.
+    Args:
+        model_path: Path to the .pt weights, or to an existing export, which
+            is used as is.
+        backend: 'pytorch', 'onnx' or 'openvino'.
+        int8: Quantize the weights and activations to INT8.
+        imgsz: Inference size of the export and the calibration.
+        calibration: Video, image directory or list of them, see
+            `load_calibration_frames`. Required with `int8`.
+        calibration_frames: Number of calibration frames.
+        force_export: Export again even if an up-to-date export exists.
+        **options: Runtime options of the backend, ignored here.
+
+    Returns:
+        Path of the model the backend runs.
+    """
+    if backend == 'pytorch':
+        if int8:
+            raise ValueError("INT8 is only available for the 'onnx' and 'openvino' backends")
+        return model_path
+    if backend not in DETECTORS:
+        raise ValueError(f"Unknown detector backend {backend!r}, expected one of {sorted(DETECTORS)}")
+    if model_path.endswith(('.onnx', '.xml')) or os.path.isdir(model_path):
+        return model_path
+
+    path = export_path(model_path, backend)
+    if force_export or not _is_current(path, model_path):
+        if YOLO is None:
+            raise RuntimeError('Exporting the PyTorch weights needs ultralytics: pip install ultralytics')
+        exported = YOLO(model_path).export(format=backend, imgsz=imgsz, dynamic=True, half=False)
+        if os.path.abspath(exported) != os.path.abspath(path):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.replace(exported, path)
+    if not int8:
+        return path
+
+    fp32_path, path = path, export_path(model_path, backend, int8=True)
+    if not force_export and _is_current(path, fp32_path):
+        return path
+    if calibration is None:
+        raise ValueError('INT8 export needs calibration footage: pass calibration=<video or image directory>')
+    frames = load_calibration_frames(calibration, calibration_frames)
+    if not frames:
+        raise ValueError(f'No calibration frames could be read from {calibration!r}')
+    blobs = _calibration_blobs(frames, imgsz)
+    # built under a temporary name, so an interrupted export is never taken for a finished one
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_dir = tempfile.mkdtemp(dir=directory, suffix='.tmp')
+    try:
+        if backend == 'onnx':
+            temp_path = os.path.join(temp_dir, os.path.basename(path))
+            _quantize_onnx(fp32_path, temp_path, blobs)
+        else:
+            temp_path = os.path.join(temp_dir, 'model')
+            _quantize_openvino(fp32_path, temp_path, blobs)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(temp_path, path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return path
+
+
+def load_detector(model_path, backend='pytorch', int8=False, imgsz=640, calibration=None, calibration_frames=300,
+                  force_export=False, **options):
+    """
+    Load the detector model for `backend`, exporting it first if needed.
+    Args:
+        model_path: Path to the .pt weights, or to an existing export.
+        backend: 'pytorch' for the ultralytics model, 'onnx' for ONNX
+            Runtime or 'openvino' for OpenVINO.
+        int8, imgsz, calibration, calibration_frames, force_export:
+            As for `export_detector`.
+        **options: Runtime options of the backend, e.g. threads. See
+            OnnxDetector and OpenVINODetector.
+
+    Returns:
+        A model with the ultralytics `predict` call.
+    """
+    path = export_detector(model_path, backend, int8=int8, imgsz=imgsz, calibration=calibration,
+                           calibration_frames=calibration_frames, force_export=force_export)
+    if backend == 'pytorch':
+        if YOLO is None:
+            raise RuntimeError("The 'pytorch' detector backend needs ultralytics: pip install ultralytics")
+        return YOLO(path)
+    return DETECTORS[backend](path, **options)
+
+
+def prepare_detector(model_path, detector=None, workers=1):
+    """
+    Export the detector once before `workers` processes load it.
+
+    Returns:
+        The detector options for the workers: the export is not forced
+        again, and the CPUs are shared between the workers unless the
+        options set `threads` themselves.
+    """
+    detector = dict(detector or {})
+    if model_path is None or detector.get('backend', 'pytorch') == 'pytorch':
+        return detector
+    export_detector(model_path, **detector)
+    detector['force_export'] = False
+    detector.setdefault('threads', max(1, usable_cpus() // max(workers, 1)))
+    return detector
@@ -0,0 +1,167 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+import cv2
+import numpy as np
+import supervision as sv
+from utils import iter_chunks
+
+
+class FrameDetections:
+    """
+    Compact detections of a single frame.
+
+    Only the arrays the tracker needs are kept, so no reference to the
+    original image or to the ultralytics result object survives.
+    """
+    __slots__ = ('xyxy', 'confidence', 'class_id', 'names')
+
+    def __init__(self, xyxy, confidence, class_id, names):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.confidence = np.asarray(confidence, dtype=np.float32).reshape(-1)
+        self.class_id = np.asarray(class_id, dtype=int).reshape(-1)
+        self.names = names
+
+    def __len__(self):
+        return len(self.class_id)
+
+    def to_supervision(self):
+        return sv.Detections(xyxy=self.xyxy.copy(), confidence=self.confidence.copy(),
+                             class_id=self.class_id.copy())
+
+
+def pack_detections(detections):
+    """
+    Flatten a list of FrameDetections into arrays for the stage cache.
+
+    Returns:
+        (arrays, meta) where `arrays['offsets'][i]:arrays['offsets'][i + 1]`
+        are the rows of frame i.
+    """
+    detections = list(detections)
+    counts = [len(detection) for detection in detections]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    names = detections[0].names if detections else {}
+    arrays = {
+        'offsets': offsets,
+        'xyxy': np.concatenate([d.xyxy for d in detections]) if detections else np.zeros((0, 4), np.float32),
+        'confidence': np.concatenate([d.confidence for d in detections]) if detections else np.zeros(0, np.float32),
+        'class_id': np.concatenate([d.class_id for d in detections]) if detections else np.zeros(0, int),
+    }
+    return arrays, {'names': {str(k): v for k, v in names.items()}}
+
+
+def unpack_detections(arrays, meta):
+    """
+    Inverse of `pack_detections`.
+    """
+    names = {int(k): v for k, v in meta['names'].items()}
+    offsets = arrays['offsets']
+    return [FrameDetections(arrays['xyxy'][start:end], arrays['confidence'][start:end],
+                            arrays['class_id'][start:end], names)
+            for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class InferenceEngine:
+    """
+    Runs YOLO over a stream of frames in batches.
+
+    Letterbox resizing of batch N+1 runs on a helper thread while the model
+    is busy with batch N, and every result is reduced to a `FrameDetections`
+    as soon as its batch finishes.
+    """
+    # Rough peak memory of one 640x640 YOLOv8 forward pass, per input pixel,
+    # including the input tensor and intermediate activations.
+    activation_bytes_per_pixel = 120
+
+    def __init__(self, model, conf=0.1, imgsz=640, batch_size=None, memory_budget_mb=1024,
+                 max_batch_size=64):
+        """
+        Args:
+            model: A loaded ultralytics YOLO model.
+            conf: Minimum detection confidence.
+            imgsz: Inference image size.
+            batch_size: Fixed batch size. When None it is derived from
+                `memory_budget_mb`.
+            memory_budget_mb: Memory the in-flight batches may use.
+            max_batch_size: Upper bound for the automatic batch size.
+        """
+        self.model = model
+        self.conf = conf
+        self.imgsz = imgsz
+        self.batch_size = batch_size
+        self.memory_budget_mb = memory_budget_mb
+        self.max_batch_size = max_batch_size
+
+    def get_batch_size(self, frame_shape):
+        """
+        Pick the batch size for frames of `frame_shape`.
+
+        Two batches are alive at once (one being preprocessed, one in the
+        model), each costing its resized frames plus the model activations.
+        """
+        if self.batch_size is not None:
+            return self.batch_size
+
+        height, width = frame_shape[:2]
+        scale = self.get_scale(frame_shape)
+        resized_bytes = int(height * scale) * int(width * scale) * 3
+        activation_bytes = self.imgsz * self.imgsz * self.activation_bytes_per_pixel
+        per_frame = 2 * resized_bytes + activation_bytes
+        batch_size = int(self.memory_budget_mb * 1024 * 1024 // per_frame)
+        return max(1, min(batch_size, self.max_batch_size))
+
+    def get_scale(self, frame_shape):
+        return min(1.0, self.imgsz / max(frame_shape[:2]))
+
+    def preprocess(self, frames):
+        """
+        Downscale frames so their long side matches the inference size,
+        which leaves only padding for the model's own letterboxing.
+        """
+        scale = self.get_scale(frames[0].shape)
+        if scale == 1.0:
+            return frames, scale
+        resized = [cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                   for frame in frames]
+        return resized, scale
+
+    def predict(self, batch, scale):
+        results = self.model.predict(batch, conf=self.conf, imgsz=self.imgsz, verbose=False)
+        detections = []
+        for result in results:
+            boxes = result.boxes
+            detections.append(FrameDetections(
+                xyxy=boxes.xyxy.cpu().numpy() / scale,
+                confidence=boxes.conf.cpu().numpy(),
+                class_id=boxes.cls.cpu().numpy(),
+                names=result.names,
+            ))
+        return detections
+
+    def iter_detections(self, frames):
+        """
+        Detect objects in a stream of frames.
+        Args:
+            frames: Iterable of frames.
+
+        Yields:
+            A `FrameDetections` per frame, in order.
+        """
+        frames = iter(frames)
+        first_frame = next(frames, None)
+        if first_frame is None:
+            return
+        batch_size = self.get_batch_size(first_frame.shape)
+        batches = iter_chunks(chain([first_frame], frames), batch_size)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            batch = next(batches, None)
+            pending = executor.submit(self.preprocess, batch) if batch is not None else None
+            while pending is not None:
+                resized, scale = pending.result()
+                batch = next(batches, None)
+                pending = executor.submit(self.preprocess, batch) if batch is not None else None
+                yield from self.predict(resized, scale)
+
+    def detect(self, frames):
+        return list(self.iter_detections(frames))
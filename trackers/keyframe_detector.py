@@ -0,0 +1,207 @@
+import cv2
+import numpy as np
+from .inference_engine import FrameDetections
+
+
+class KeyframeDetector:
+    """
+    Runs the detector on keyframes only and carries the boxes through the
+    frames in between along the optical flow.
+
+    Keyframes are scheduled every `interval` frames. With a `motion_scale`,
+    camera movement brings the next keyframe closer: every frame counts
+    `1 + |movement| / motion_scale` toward the interval, so a fast pan is
+    detected more often than a static shot. The schedule only depends on
+    the camera movement, so it is the same however the video is chunked,
+    and all scheduled keyframes of a call are detected in one batch.
+
+    In between, every box of the previous frame is followed by a grid of
+    points tracked with pyramidal Lucas-Kanade and checked forward-backward;
+    the box moves by the median displacement of its good points. A box with
+    fewer than `min_points` good points moves with the camera instead and
+    counts as lost. With a `max_lost_fraction`, a frame losing more of its
+    boxes than that is detected as an extra keyframe. Propagated boxes keep
+    their class and confidence, so ByteTrack matches them to the same tracks.
+
+    The ball is too small and fast to follow this way; the classes in
+    `skip_classes` are left out of the in-between frames and the ball
+    interpolation fills them. With a BallRoiDetector, every keyframe,
+    scheduled or extra, is refined by it in frame order and under its video
+    frame number, so its track and timeouts stay in video frames.
+    """
+    def __init__(self, inference_engine, interval=4, motion_scale=None, max_lost_fraction=None,
+                 flow_scale=0.5, min_points=3, skip_classes=('ball',), ball_detector=None):
+        """
+        Args:
+            inference_engine: InferenceEngine running the detector.
+            interval: Largest number of frames from one scheduled keyframe
+                to the next. 1 detects every frame.
+            motion_scale: Pixels of camera movement that count as one extra
+                frame toward the next keyframe. None ignores camera motion.
+            max_lost_fraction: Fraction of lost boxes above which a frame is
+                detected as well. None never adds keyframes.
+            flow_scale: Downscale factor of the frames the boxes are
+                followed on.
+            min_points: Good flow points a box needs to be followed.
+            skip_classes: Class names dropped from in-between frames.
+            ball_detector: Optional BallRoiDetector refining the ball of
+                the keyframes.
+        """
+        self.inference_engine = inference_engine
+        self.ball_detector = ball_detector
+        self.interval = max(1, interval)
+        self.motion_scale = motion_scale
+        self.max_lost_fraction = max_lost_fraction
+        self.flow_scale = flow_scale
+        self.min_points = min_points
+        self.skip_classes = tuple(skip_classes)
+        # 4x4 points over the middle of every box, as fractions of its size
+        fractions = np.linspace(0.2, 0.8, 4)
+        self.grid = np.stack(np.meshgrid(fractions, fractions), axis=-1).reshape(-1, 2)
+        self.lk_params = dict(
+            winSize=(15, 15),
+            maxLevel=2,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
+        )
+        self.reset()
+
+    def reset(self):
+        """
+        Start a new video: its first frame is always a keyframe.
+        """
+        self.previous_gray = None
+        self.previous = None
+        self.drift = float(self.interval)
+        self.keyframes = np.zeros(0, dtype=bool)
+        self.stats = {'frames': 0, 'keyframes': 0, 'extra_keyframes': 0, 'propagated_boxes': 0, 'lost_boxes': 0}
+
+    def prime(self, frame, detections, drift):
+        """
+        Continue after frames that were not seen by this detector, e.g.
+        chunks whose detections came from the stage cache.
+        Args:
+            frame: The last of those frames.
+            detections: Its FrameDetections.
+            drift: `drift` after that frame, as stored with the detections.
+        """
+        self.previous_gray = self.to_gray(frame)
+        self.previous = detections
+        self.drift = drift
+
+    def to_gray(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        if self.flow_scale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.flow_scale, fy=self.flow_scale, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def schedule(self, num_frames, camera_movement=None):
+        """
+        Scheduled keyframes of the next `num_frames` frames, advancing
+        `drift`, the progress toward the next keyframe.
+
+        Returns:
+            (num_frames,) boolean keyframe mask.
+        """
+        step = np.ones(num_frames)
+        if self.motion_scale and camera_movement is not None:
+            movement = np.asarray(camera_movement, dtype=np.float64).reshape(-1, 2)
+            step += np.linalg.norm(movement, axis=1) / self.motion_scale
+        keyframes = np.zeros(num_frames, dtype=bool)
+        drift = self.drift
+        for frame_num in range(num_frames):
+            drift += step[frame_num]
+            if drift >= self.interval:
+                keyframes[frame_num] = True
+                drift = 0.0
+        self.drift = drift
+        return keyframes
+
+    def detect(self, frames, camera_movement=None):
+        """
+        Detections for consecutive frames following the previous call.
+        Args:
+            frames: Consecutive frames.
+            camera_movement: Optional (N, 2) camera movement of the frames,
+                used to schedule keyframes and to move lost boxes.
+
+        Returns:
+            A `FrameDetections` per frame. `keyframes` then holds the mask
+            of the frames that were actually detected.
+        """
+        frames = list(frames)
+        keyframes = self.schedule(len(frames), camera_movement)
+        scheduled = np.flatnonzero(keyframes)
+        # the full-frame pass is stateless, so all scheduled keyframes share one batch
+        detected = dict(zip(scheduled, self.inference_engine.detect([frames[i] for i in scheduled])))
+        first_frame = self.ball_detector.frame_num if self.ball_detector is not None else 0
+
+        results = []
+        for frame_num, frame in enumerate(frames):
+            gray = self.to_gray(frame)
+            if keyframes[frame_num]:
+                detections = self.refine(frame, detected[frame_num], first_frame + frame_num)
+            else:
+                movement = None if camera_movement is None else camera_movement[frame_num]
+                detections, lost = self.propagate(gray, movement)
+                if self.max_lost_fraction is not None and lost > self.max_lost_fraction * max(len(detections), 1):
+                    detections = self.refine(frame, self.inference_engine.detect([frame])[0],
+                                             first_frame + frame_num)
+                    keyframes[frame_num] = True
+                    self.stats['extra_keyframes'] += 1
+            self.previous_gray = gray
+            self.previous = detections
+            results.append(detections)
+
+        if self.ball_detector is not None:
+            self.ball_detector.seek(first_frame + len(frames))
+        self.keyframes = keyframes
+        self.stats['frames'] += len(frames)
+        self.stats['keyframes'] += int(keyframes.sum())
+        return results
+
+    def refine(self, frame, detections, frame_num):
+        """
+        A keyframe's detections with the ball refined by the ball detector,
+        if there is one. Keyframes have to come in frame order.
+        """
+        if self.ball_detector is None:
+            return detections
+        return self.ball_detector.refine([frame], [detections], [frame_num])[0]
+
+    def propagate(self, gray, camera_movement=None):
+        """
+        Move the previous frame's boxes onto `gray`.
+
+        Returns:
+            (FrameDetections, number of lost boxes)
+        """
+        previous = self.previous
+        skip = [class_id for class_id, name in previous.names.items() if name in self.skip_classes]
+        keep = ~np.isin(previous.class_id, skip)
+        xyxy = previous.xyxy[keep]
+        if len(xyxy) == 0:
+            return FrameDetections(xyxy, previous.confidence[keep], previous.class_id[keep], previous.names), 0
+
+        scaled = xyxy * self.flow_scale
+        size = scaled[:, 2:] - scaled[:, :2]
+        points = (scaled[:, None, :2] + self.grid[None] * size[:, None]).reshape(-1, 1, 2).astype(np.float32)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self.previous_gray, gray, points, None, **self.lk_params)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.previous_gray, moved, None, **self.lk_params)
+        good = (status.reshape(-1) == 1) & (back_status.reshape(-1) == 1)
+        good &= np.linalg.norm((back - points).reshape(-1, 2), axis=1) < 1.0
+        good = good.reshape(len(xyxy), -1)
+        displacement = (moved - points).reshape(len(xyxy), -1, 2)
+
+        followed = good.sum(axis=1) >= self.min_points
+        shift = np.zeros((len(xyxy), 2), dtype=np.float32)
+        if camera_movement is not None:
+            shift[:] = camera_movement
+        if followed.any():
+            masked = np.where(good[followed][..., None], displacement[followed], np.nan)
+            shift[followed] = np.nanmedian(masked, axis=1) / self.flow_scale
+
+        lost = int(len(xyxy) - followed.sum())
+        self.stats['propagated_boxes'] += len(xyxy)
+        self.stats['lost_boxes'] += lost
+        return FrameDetections(xyxy + np.tile(shift, 2), previous.confidence[keep], previous.class_id[keep],
+                               previous.names), lost
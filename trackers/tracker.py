@@ -1,80 +1,242 @@
-from ultralytics import YOLO
 import supervision as sv
 import pickle
 import os
-import pandas as pd
-import cv2
 import numpy as np
+from .inference_engine import InferenceEngine
+from .ball_interpolator import BallInterpolator
+from .keyframe_detector import KeyframeDetector
+from .ball_roi_detector import BallRoiDetector
+from .detector_backends import load_detector
+from utils import as_track_table, OBJECT_TYPES, FrameRenderer
+from utils.frame_renderer import draw_ellipse, draw_triangle
+from player_ball_assigner import PossessionStatistics
 
 class Tracker:
-    def __init__(self, model_path):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path, batch_size=None, memory_budget_mb=1024, conf=0.1, keyframe_interval=1,
+                 keyframe_motion_scale=None, keyframe_max_lost=None, ball_crop_size=None, detector=None):
+        """
+        Args:
+            model_path: Path to the YOLO weights. None creates a tracker
+                without a detector, for tracking cached detections and drawing.
+            batch_size: Fixed inference batch size, or None to derive it from
+                `memory_budget_mb`.
+            memory_budget_mb: Memory the in-flight inference batches may use.
+            conf: Minimum detection confidence.
+            keyframe_interval: Run YOLO at most every this many frames and
+                follow the boxes with optical flow in between. 1 detects
+                every frame. See `KeyframeDetector`.
+            keyframe_motion_scale: Pixels of camera movement that bring the
+                next keyframe one frame closer. None ignores camera motion.
+            keyframe_max_lost: Fraction of boxes the optical flow may lose
+                before a frame is detected anyway. None never adds keyframes.
+            ball_crop_size: Look for the ball in a full-resolution crop of
+                this size around its expected position, after the
+                downscaled full-frame pass. See `BallRoiDetector`. None
+                relies on the full-frame pass alone.
+            detector: Optional dict of detector backend options, see
+                `load_detector`, e.g. {'backend': 'onnx', 'int8': True,
+                'calibration': 'input_videos/match.mp4', 'threads': 4}.
+                Defaults to the ultralytics PyTorch model.
+        """
+        self.detector = dict(detector or {})
+        self.model = load_detector(model_path, **self.detector) if model_path is not None else None
+        self.tracker = sv.ByteTrack()
+        self.inference_engine = InferenceEngine(self.model, conf=conf, batch_size=batch_size,
+                                                memory_budget_mb=memory_budget_mb)
+        self.ball_detector = None
+        if ball_crop_size is not None:
+            self.ball_detector = BallRoiDetector(self.inference_engine, crop_size=ball_crop_size)
+        self.keyframe_detector = None
+        if keyframe_interval > 1:
+            self.keyframe_detector = KeyframeDetector(self.inference_engine,
+                                                      interval=keyframe_interval,
+                                                      motion_scale=keyframe_motion_scale,
+                                                      max_lost_fraction=keyframe_max_lost,
+                                                      ball_detector=self.ball_detector)
+        self.ball_interpolator = BallInterpolator()
+        self.renderer = FrameRenderer()
+        # running counters behind the legacy per-frame team ID arrays
+        self.ball_control = PossessionStatistics()
+    def reset(self):
+        """
+        Start tracking a new, unrelated sequence of frames.
+        """
         self.tracker = sv.ByteTrack()
+        self.ball_interpolator.reset()
+        self.ball_control = PossessionStatistics()
+        if self.keyframe_detector is not None:
+            self.keyframe_detector.reset()
+        if self.ball_detector is not None:
+            self.ball_detector.reset()
+
+    def detection_params(self):
+        """
+        Settings of the detection modes that carry state from one frame to
+        the next, e.g. for stage cache keys. Empty when every frame is
+        detected on its own.
+        """
+        params = {}
+        if self.keyframe_detector is not None:
+            detector = self.keyframe_detector
+            params['keyframes'] = {'interval': detector.interval, 'motion_scale': detector.motion_scale,
+                                   'max_lost_fraction': detector.max_lost_fraction,
+                                   'flow_scale': detector.flow_scale, 'min_points': detector.min_points,
+                                   'skip_classes': list(detector.skip_classes)}
+        if self.ball_detector is not None:
+            detector = self.ball_detector
+            # version 2 counts video frames rather than refined frames under keyframe detection
+            params['ball_roi'] = {'version': 2, 'crop_size': detector.crop_size, 'max_missed': detector.max_missed,
+                                  'search_interval': detector.search_interval,
+                                  'tile_overlap': detector.tile_overlap,
+                                  'crop_batch_size': detector.crop_batch_size}
+        return params
+
+    def detector_params(self):
+        """
+        Settings of the detector backend that change its detections, e.g.
+        for stage cache keys. Empty for the PyTorch model.
+        """
+        backend = self.detector.get('backend', 'pytorch')
+        if backend == 'pytorch':
+            return {}
+        return {'backend': backend, 'int8': bool(self.detector.get('int8', False))}
+
+    def detection_state(self):
+        """
+        JSON-serializable state of the detection modes after the last
+        `detect_frames` call.
+        """
+        state = {}
+        if self.keyframe_detector is not None:
+            state['drift'] = self.keyframe_detector.drift
+        if self.ball_detector is not None:
+            state['ball'] = self.ball_detector.state()
+        return state
+
+    def prime_detection(self, frame, detections, state):
+        """
+        Continue detecting after frames that were not run through
+        `detect_frames`, e.g. chunks whose detections came from a cache.
+        Args:
+            frame: The last of those frames.
+            detections: Its FrameDetections.
+            state: `detection_state()` after that frame.
+        """
+        if self.keyframe_detector is not None:
+            self.keyframe_detector.prime(frame, detections, state['drift'])
+        if self.ball_detector is not None:
+            self.ball_detector.prime(state['ball'])
+
     def add_positions_to_tracks(self, tracks):
-        
-        for obj, obj_data in tracks.items():
-            for frame_num, frame_data in enumerate(obj_data):
-                    for track_id, track_info in frame_data.items():
-                            bbox = track_info['bbox']
-                            if obj == 'ball':
-                                positions = [int((bbox[0] + bbox[2]) / 2), int((bbox[1] + bbox[3]) / 2)]
-                            else:
-                                positions = int((bbox[0] + bbox[2]) / 2), int(bbox[3])
-                            tracks[obj][frame_num][track_id]['positions'] = positions
+        """
+        Add the reference position of every object: the bbox center for the
+        ball and the foot position for everyone else.
+        Args:
+            tracks: A TrackTable or the legacy dict of per-frame track lists.
+        """
+        table = as_track_table(tracks)
+        bbox = table.bbox
+        is_ball = table.object_type == OBJECT_TYPES.index('ball')
+        x = np.trunc((bbox[:, 0] + bbox[:, 2]) / 2)
+        y = np.where(is_ball, np.trunc((bbox[:, 1] + bbox[:, 3]) / 2), np.trunc(bbox[:, 3]))
+        table.set_column('position', np.stack([x, y], axis=1))
+        table.write_back(tracks, ['position'])
 
 
     def interpolate_ball_positions(self, ball_positions):
-        ball_positions = [x.get(1,{}).get('bbox',[]) for x in ball_positions]
-        df_ball_positions = pd.DataFrame(ball_positions, columns=['x1', 'y1', 'x2', 'y2'])
+        """
+        Fill the frames without a ball detection, see `BallInterpolator`.
+        Args:
+            ball_positions: List of per-frame ball dicts.
 
-        df_ball_positions = df_ball_positions.interpolate()
-        df_ball_positions = df_ball_positions.bfill()
-        ball_positions = [{1:{'bbox':x}} for x in df_ball_positions.to_numpy().tolist()]
-        return ball_positions
-    
-    def detect_frames(self, frames):
+        Returns:
+            New list of per-frame ball dicts. Filled-in frames are marked
+            with 'interpolated'; frames in gaps longer than the
+            interpolator's `max_gap` and rejected outliers are left empty.
+        """
+        frame, bbox = BallInterpolator.from_ball_tracks(ball_positions)
+        bbox, interpolated, _ = self.ball_interpolator.interpolate(frame, bbox, len(ball_positions))
+        return BallInterpolator.to_ball_tracks(bbox, interpolated)
+
+    def interpolate_ball_rows(self, table):
+        """
+        Table version of `interpolate_ball_positions`.
+        Args:
+            table: TrackTable with at most one ball row per frame.
+
+        Returns:
+            New TrackTable whose ball rows are the interpolated ball, with
+            the 'interpolated' column set, or `table` itself when it has no
+            ball rows.
+        """
+        ball_rows = table.rows_of_type('ball')
+        if len(ball_rows) == 0:
+            return table
+        bbox, interpolated, _ = self.ball_interpolator.interpolate(
+            table.frame[ball_rows], table.bbox[ball_rows], table.num_frames)
+        frames = np.flatnonzero(~np.isnan(bbox[:, 0]))
+        return table.replace_object_rows('ball', frames, np.ones(len(frames)),
+                                         {'bbox': bbox[frames], 'interpolated': interpolated[frames]})
+
+    def detect_frames(self, frames, camera_movement=None):
         """
         Detect objects in a list of frames using the YOLO model.
+
+        Batches are sized from the engine's memory budget and the next batch
+        is preprocessed while the current one runs through the model. With a
+        keyframe interval, only keyframes go through the model and the
+        other frames get the boxes of the frame before, moved along the
+        optical flow. With a ball crop size, the ball comes from a crop
+        around its expected position.
         Args:
-            frames (list): List of frames to process.
+            frames (iterable): Frames to process.
+            camera_movement: Optional per-frame camera movement, used to
+                schedule keyframes.
 
         Returns:
-            detections: List of detection results for each frame.
+            detections: Iterable of compact `FrameDetections`, one per frame.
         """
+        if self.keyframe_detector is not None:
+            return self.keyframe_detector.detect(frames, camera_movement)
+        if self.ball_detector is not None:
+            return self.ball_detector.detect(frames)
+        return self.inference_engine.iter_detections(frames)
 
-        batch_size = 20
-        detections = []
-        for i in range(0, len(frames), batch_size):
-            batch = frames[i:i + batch_size]
-            results = self.model.predict(batch, conf=0.1)
-            detections.extend(results)
-        return detections
+    def track_frames(self, frames):
+        """
+        Detect and track objects in a chunk of consecutive frames.
 
-    def get_object_tracks(self, frame, read_from_stub=False, stub_path=None):
+        The ByteTrack state is kept on the instance, so calling this on
+        successive chunks of a video yields the same track IDs as a single
+        call on the whole video.
+        Args:
+            frames (list): Consecutive frames to process.
+
+        Returns:
+            tracks: Dict of per-frame track lists for the given frames only.
         """
-        Get object tracks from a single frame.
+        return self.track_detections(self.detect_frames(frames))
+
+    def track_detections(self, detections):
+        """
+        Run ByteTrack over per-frame detections, e.g. ones loaded from the
+        stage cache, continuing the tracker state of previous calls.
         Args:
-            frame: A single video frame.
+            detections (iterable): `FrameDetections` of consecutive frames.
 
         Returns:
-            tracks: List of tracked objects in the frame.
+            tracks: Dict of per-frame track lists for the given frames only.
         """
-        if read_from_stub and stub_path is not None and os.path.exists(stub_path):
-            with open(stub_path, 'rb') as f:
-                tracks = pickle.load(f)
-            return tracks
-        
         tracks = {
             'players':[],
             'referees':[],
             'ball':[],
         }
-        detections = self.detect_frames(frame)
 
         for frame_num, detection in enumerate(detections):
             cls_names = detection.names
             cls_names_inv = {v: k for k, v in cls_names.items()}
-            detection_supervision = sv.Detections.from_ultralytics(detection)
+            detection_supervision = detection.to_supervision()
 
             for object_id, class_id in enumerate(detection_supervision.class_id):
                 if cls_names[class_id] == 'goalkeeper':
@@ -104,6 +266,24 @@ class Tracker:
                 if class_id == cls_names_inv['ball']:
                     tracks['ball'][frame_num][1] = {'bbox': bbox}
 
+        return tracks
+
+    def get_object_tracks(self, frame, read_from_stub=False, stub_path=None):
+        """
+        Get object tracks from a single frame.
+        Args:
+            frame: A single video frame.
+
+        Returns:
+            tracks: List of tracked objects in the frame.
+        """
+        if read_from_stub and stub_path is not None and os.path.exists(stub_path):
+            with open(stub_path, 'rb') as f:
+                tracks = pickle.load(f)
+            return tracks
+        
+        tracks = self.track_frames(frame)
+
         if stub_path is not None:
             with open(stub_path, 'wb') as f:
                 pickle.dump(tracks, f)
@@ -122,19 +302,7 @@ class Tracker:
         Returns:
             Annotated frame with the triangle drawn.
         """
-        x1, y1, x2, y2 = map(int, bbox)
-        center = (x1 + x2) // 2
-        
-        points = [
-            (center, y1),
-            (x1 - 5, y1 - 10),
-            (x2 + 5, y1 - 10)
-        ]
-        
-        cv2.drawContours(frame, [np.array(points)], 0, color, cv2.FILLED)
-        cv2.drawContours(frame, [np.array(points)], 0,(0, 0, 0), 2)
-        
-        return frame
+        return draw_triangle(frame, bbox, color=color)
 
     def draw_ellipse(self, frame, bbox, color=(0, 255, 0), label=None):
         """
@@ -148,79 +316,54 @@ class Tracker:
         Returns:
             Annotated frame with the ellipse drawn.
         """
-        x1, y1, x2, y2 = map(int, bbox)
-        center = ((x1 + x2) // 2,  y2)
-        
-        cv2.ellipse(frame, center, axes=(x2 - x1, int(0.35*(x2 - x1))), angle=0.0, 
-                    startAngle=-45, 
-                    endAngle=235, color=color,
-                    lineType=cv2.LINE_4, 
-                    thickness=2)
-        if label:
-            center = (x1 + x2) // 2 
-            rect_width = 40
-            rect_height = 20
-            x1_rect = center - rect_width // 2
-            x2_rect = center + rect_width // 2
-            y1_rect = (y2 - rect_height // 2) + 15
-            y2_rect = (y2 + rect_height // 2) + 15
-            x1_text = x1_rect + 12
-            cv2.rectangle(frame, (x1_rect, y1_rect), (x2_rect, y2_rect), color, cv2.FILLED)
-            cv2.putText(frame, label, (x1_text, y2_rect - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 
-                        (0,0,0), 1)
-        return frame
+        return draw_ellipse(frame, bbox, color=color, label=label)
     def draw_team_ball_control(self, frame, frame_num, team_ball_control):
         """
         Draw the team ball control information on the frame.
         Args:
             frame: A single video frame.
             frame_num: The current frame number.
-            team_ball_control: List of team IDs controlling the ball.
+            team_ball_control: PossessionStatistics already updated up to
+                this frame, or the legacy array of team IDs per frame. An
+                array only credits the frames after those drawn before, so
+                drawing a video frame by frame stays O(1) per frame.
 
         Returns:
             Annotated frame with team ball control information.
         """
-        overlay = frame.copy()
-        cv2.rectangle(overlay, (1350, 850), (1900, 970), (255, 255, 255), -1)
-        alpha = 0.5
-        cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
-        team_ball_control_till_frame = team_ball_control[:frame_num + 1]
-        
-        team_1 = team_ball_control_till_frame[team_ball_control_till_frame == 1].shape[0]
-        team_2 = team_ball_control_till_frame[team_ball_control_till_frame == 2].shape[0]
-        team1 = team_1 / (team_1 + team_2 + 1e-6)  # Avoid division by zero
-        team2 = team_2 / (team_1 + team_2 + 1e-6)  # Avoid division by zero
-        # Draw the team ball control information
-        cv2.putText(frame, f'Team 1 Ball Control: {team1}', (1400, 870), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
-        cv2.putText(frame, f'Team 2 Ball Control: {team2}', (1400, 900), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
-
-        return frame
-
-    def draw_annotations(self, frame, tracks, team_ball_control):
+        if not isinstance(team_ball_control, PossessionStatistics):
+            if frame_num < self.ball_control.frames - 1:
+                # drawing an earlier frame again, e.g. a new video
+                self.ball_control = PossessionStatistics()
+            self.ball_control.extend(np.asarray(team_ball_control)[self.ball_control.frames:frame_num + 1])
+            team_ball_control = self.ball_control
+        # the panel is blended over its own region only
+        return self.renderer.draw_possession(frame, team_ball_control)
+
+    def draw_annotations(self, frame, tracks, team_ball_control, frame_offset=0):
+        """
+        Draw player, referee, ball and ball-control overlays on frames.
+        Args:
+            frame: List of frames to annotate.
+            tracks: Tracks aligned with `frame`.
+            team_ball_control: PossessionStatistics updated up to the frame
+                being drawn (only valid for a single frame), or the legacy
+                array of team IDs for every frame of the video so far,
+                indexed by absolute frame number.
+            frame_offset: Absolute frame number of `frame[0]`, used when
+                annotating one chunk of a streamed video.
+
+        Returns:
+            List of annotated frames.
+        """
         output = []
+        if not isinstance(team_ball_control, PossessionStatistics):
+            team_ball_control = np.asarray(team_ball_control)
 
         for frame_num, frame_data in enumerate(frame):
             annotated_frame = frame_data.copy()
-
-            for player_id, player_data in tracks['players'][frame_num].items():
-                bbox = player_data['bbox']
-                color = player_data.get('team_color', (0, 0, 255))
-                annotated_frame = self.draw_ellipse(annotated_frame, bbox, color=color, 
-                                                    label=f'{player_id}')
-                if player_data.get('has_ball'):
-                    annotated_frame = self.draw_triangle(annotated_frame, bbox, color=color)
-            for referee_id, referee_data in tracks['referees'][frame_num].items():
-                bbox = referee_data['bbox']
-                annotated_frame = self.draw_ellipse(annotated_frame, bbox, color=(255, 0, 0))
-
-            if tracks['ball'][frame_num]:
-                ball_data = tracks['ball'][frame_num][1]
-                bbox = ball_data['bbox']
-                annotated_frame = self.draw_triangle(annotated_frame, bbox, color=(0, 0, 255))
-            
-            self.draw_team_ball_control(annotated_frame, frame_num, team_ball_control)
+            self.renderer.draw_objects(annotated_frame, {obj: tracks[obj][frame_num] for obj in OBJECT_TYPES})
+            self.draw_team_ball_control(annotated_frame, frame_offset + frame_num, team_ball_control)
 
             output.append(annotated_frame)
         return output
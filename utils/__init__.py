@@ -1,3 +1,11 @@
-from .video_utils import read_video, write_video
+from .video_utils import read_video, write_video, iter_video, iter_chunks, get_video_fps, get_frame_count, get_frame_size
+from .threaded_video import ThreadedVideoReader, ThreadedVideoWriter, LiveVideoReader, QueueStats
+from .track_table import TrackTable, as_track_table, OBJECT_TYPES
+from .stage_cache import StageCache, file_checksum, video_fingerprint
+from .frame_renderer import FrameRenderer
+from .video_backends import FramePool, open_video_reader, open_video_writer, available_backends
+from .profiler import StageProfiler, get_peak_rss_mb
+from .match_store import MatchExporter, MatchStore
+from .seek_index import SeekIndex
 
-from .bbox_utils import get_center_of_bbox, get_bbox_width, measure_distance,measure_xy_distance,get_foot_position
\ No newline at end of file
+from .bbox_utils import get_center_of_bbox, get_bbox_width, measure_distance,measure_xy_distance,get_foot_position, get_bbox_iou
\ No newline at end of file
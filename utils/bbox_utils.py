@@ -1,3 +1,5 @@
+import numpy as np
+
 def get_center_of_bbox(bbox):
     x1,y1,x2,y2 = bbox
     return int((x1+x2)/2),int((y1+y2)/2)
@@ -13,4 +15,20 @@ def measure_xy_distance(p1,p2):
 
 def get_foot_position(bbox):
     x1,y1,x2,y2 = bbox
-    return int((x1+x2)/2),int(y2)
\ No newline at end of file
+    return int((x1+x2)/2),int(y2)
+
+def get_bbox_iou(boxes1, boxes2):
+    """
+    Pairwise intersection over union of two sets of (x1, y1, x2, y2) boxes.
+
+    Returns an (N, M) array.
+    """
+    boxes1 = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4)
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area1 = np.prod(boxes1[:, 2:] - boxes1[:, :2], axis=1)
+    area2 = np.prod(boxes2[:, 2:] - boxes2[:, :2], axis=1)
+    union = area1[:, None] + area2[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
\ No newline at end of file
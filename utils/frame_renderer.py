@@ -0,0 +1,157 @@
+import cv2
+import numpy as np
+
+
+class FrameRenderer:
+    """
+    Draws every overlay of a frame in a single pass, in place.
+
+    Objects are drawn straight onto the frame, and the translucent panels
+    are blended over their own region only, against a solid background
+    patch that is built once per panel size and color and then reused. No
+    full-frame copy is made, so the cost of a frame grows with the number
+    of overlays rather than with its resolution.
+    """
+    possession_panel = ((1350, 850), (1900, 970))
+    camera_panel = ((0, 0), (500, 100))
+
+    def __init__(self, possession_alpha=0.5, camera_alpha=0.6, panel_color=(255, 255, 255)):
+        """
+        Args:
+            possession_alpha: Opacity of the ball control panel.
+            camera_alpha: Opacity of the camera movement panel.
+            panel_color: BGR color of the panels.
+        """
+        self.possession_alpha = possession_alpha
+        self.camera_alpha = camera_alpha
+        self.panel_color = panel_color
+        self.backgrounds = {}
+
+    def render(self, frame, tracks, possession=None, camera_movement=None):
+        """
+        Draw the objects, speeds and panels of one frame.
+        Args:
+            frame: The frame to draw on; it is modified in place.
+            tracks: Dict of object type to the frame's `{track_id: track}`
+                dict, e.g. `{'players': {...}, 'referees': {...}, 'ball': {...}}`.
+            possession: PossessionStatistics updated up to this frame, or
+                None to skip the ball control panel.
+            camera_movement: (x, y) camera movement of this frame, or None
+                to skip the camera movement panel.
+
+        Returns:
+            The same frame.
+        """
+        self.draw_objects(frame, tracks)
+        if possession is not None:
+            self.draw_possession(frame, possession)
+        if camera_movement is not None:
+            self.draw_camera_movement(frame, camera_movement)
+        self.draw_speed_and_distance(frame, tracks.get('players', {}))
+        return frame
+
+    def draw_objects(self, frame, tracks):
+        for player_id, player_data in tracks.get('players', {}).items():
+            bbox = player_data['bbox']
+            color = player_data.get('team_color', (0, 0, 255))
+            draw_ellipse(frame, bbox, color=color, label=f'{player_id}')
+            if player_data.get('has_ball'):
+                draw_triangle(frame, bbox, color=color)
+        for referee_data in tracks.get('referees', {}).values():
+            draw_ellipse(frame, referee_data['bbox'], color=(255, 0, 0))
+        ball = tracks.get('ball', {})
+        if ball:
+            draw_triangle(frame, ball[1]['bbox'], color=(0, 0, 255))
+        return frame
+
+    def draw_speed_and_distance(self, frame, players):
+        for track_data in players.values():
+            speed = track_data.get('speed', None)
+            distance = track_data.get('distance', None)
+            if speed is None or distance is None:
+                continue
+            bbox = track_data['bbox']
+            position = int((bbox[0] + bbox[2]) / 2), int(bbox[3]) + 40
+            cv2.putText(frame, f'Speed: {speed:.2f} km/h', position, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
+            cv2.putText(frame, f'Distance: {distance:.2f} m', (position[0], position[1] + 20),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
+        return frame
+
+    def draw_possession(self, frame, possession):
+        """
+        Draw the ball control panel from a PossessionStatistics.
+        """
+        self.blend_panel(frame, self.possession_panel, self.possession_alpha)
+        shares = possession.shares()
+        cv2.putText(frame, f'Team 1 Ball Control: {shares[1]}', (1400, 870),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+        cv2.putText(frame, f'Team 2 Ball Control: {shares[2]}', (1400, 900),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+        for line, window in enumerate(list(possession.windows)[:1]):
+            window_shares = possession.shares(window)
+            cv2.putText(frame, f'{window}: Team 1 {window_shares[1]:.2f} / Team 2 {window_shares[2]:.2f}',
+                        (1400, 930 + 30 * line), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+        return frame
+
+    def draw_camera_movement(self, frame, camera_movement):
+        self.blend_panel(frame, self.camera_panel, self.camera_alpha)
+        x_movement, y_movement = camera_movement
+        cv2.putText(frame, f'Movement X: {x_movement:.2f}', (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 3)
+        cv2.putText(frame, f'Movement Y: {y_movement:.2f}', (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 3)
+        return frame
+
+    def blend_panel(self, frame, rect, alpha):
+        """
+        Blend a solid panel over `rect` of the frame, in place.
+        Args:
+            frame: The frame to draw on.
+            rect: ((x1, y1), (x2, y2)) corners of the panel, inclusive as
+                with cv2.rectangle; clipped to the frame.
+            alpha: Opacity of the panel.
+        """
+        (x1, y1), (x2, y2) = rect
+        roi = frame[max(y1, 0):y2 + 1, max(x1, 0):x2 + 1]
+        if roi.size == 0:
+            return frame
+        key = (roi.shape, self.panel_color)
+        background = self.backgrounds.get(key)
+        if background is None:
+            background = np.empty(roi.shape, dtype=frame.dtype)
+            background[:] = self.panel_color[:roi.shape[2]] if roi.ndim == 3 else self.panel_color[0]
+            self.backgrounds[key] = background
+        cv2.addWeighted(background, alpha, roi, 1 - alpha, 0, dst=roi)
+        return frame
+
+
+def draw_triangle(frame, bbox, color=(0, 0, 255)):
+    """
+    Draw a triangle pointing at the top of a bbox, in place.
+    """
+    x1, y1, x2, y2 = map(int, bbox)
+    center = (x1 + x2) // 2
+    points = np.array([(center, y1), (x1 - 5, y1 - 10), (x2 + 5, y1 - 10)])
+    cv2.drawContours(frame, [points], 0, color, cv2.FILLED)
+    cv2.drawContours(frame, [points], 0, (0, 0, 0), 2)
+    return frame
+
+
+def draw_ellipse(frame, bbox, color=(0, 255, 0), label=None):
+    """
+    Draw an ellipse under a bbox, with an optional label box, in place.
+    """
+    x1, y1, x2, y2 = map(int, bbox)
+    center = ((x1 + x2) // 2, y2)
+    cv2.ellipse(frame, center, axes=(x2 - x1, int(0.35 * (x2 - x1))), angle=0.0,
+                startAngle=-45, endAngle=235, color=color, lineType=cv2.LINE_4, thickness=2)
+    if label:
+        center = (x1 + x2) // 2
+        rect_width = 40
+        rect_height = 20
+        x1_rect = center - rect_width // 2
+        x2_rect = center + rect_width // 2
+        y1_rect = (y2 - rect_height // 2) + 15
+        y2_rect = (y2 + rect_height // 2) + 15
+        x1_text = x1_rect + 12
+        cv2.rectangle(frame, (x1_rect, y1_rect), (x2_rect, y2_rect), color, cv2.FILLED)
+        cv2.putText(frame, label, (x1_text, y2_rect - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+    return frame
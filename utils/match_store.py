@@ -0,0 +1,572 @@
+import json
+import os
+import tempfile
+import numpy as np
+from .track_table import TrackTable, OBJECT_TYPES
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+FORMAT_VERSION = 1
+
+# output column -> (TrackTable column, index into its per-row vector or None)
+VALUE_COLUMNS = {
+    'bbox_x1': ('bbox', 0), 'bbox_y1': ('bbox', 1), 'bbox_x2': ('bbox', 2), 'bbox_y2': ('bbox', 3),
+    'x': ('position', 0), 'y': ('position', 1),
+    'x_adjusted': ('position_adjusted', 0), 'y_adjusted': ('position_adjusted', 1),
+    'pitch_x': ('position_transformed', 0), 'pitch_y': ('position_transformed', 1),
+    'team_id': ('team_id', None),
+    'has_ball': ('has_ball', None),
+    'interpolated': ('interpolated', None),
+    'speed_kmh': ('speed', None),
+    'acceleration': ('acceleration', None),
+    'distance_m': ('distance', None),
+}
+
+# Every row is one tracked object in one frame. Rows are ordered by frame,
+# so the frame statistics of every row group give its exact frame range.
+# Positions are in frame pixels, except pitch_x/pitch_y in meters; missing
+# values are null rather than NaN, so they stay out of the statistics.
+SCHEMA_FIELDS = [
+    ('frame', 'int32'),
+    ('time_s', 'float32'),
+    ('object_type', 'dictionary'),
+    ('track_id', 'int32'),
+] + [(name, {'team_id': 'int8', 'has_ball': 'bool', 'interpolated': 'bool'}.get(name, 'float32'))
+     for name in VALUE_COLUMNS] + [
+    ('possession_team', 'int8'),
+]
+
+
+def _schema(metadata):
+    types = {'int32': pa.int32(), 'int8': pa.int8(), 'float32': pa.float32(), 'bool': pa.bool_(),
+             'dictionary': pa.dictionary(pa.int8(), pa.string())}
+    return pa.schema([(name, types[kind]) for name, kind in SCHEMA_FIELDS],
+                     metadata={'match_store': json.dumps(metadata)})
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError('The match export needs pyarrow: pip install pyarrow')
+
+
+def _is_arrow_path(path):
+    return path.endswith(('.arrow', '.feather', '.ipc'))
+
+
+def track_table_to_arrow(table, fps, frame_offset=0, possession_team=None, schema=None):
+    """
+    Rows of a TrackTable as an Arrow table in the match store layout.
+    Args:
+        table: The TrackTable, frames counted from `frame_offset`.
+        fps: Frame rate of the video, for `time_s`.
+        frame_offset: Video frame number of the table's frame 0.
+        possession_team: Optional per-frame team in possession of the
+            ball, 0 for none, indexed like the table's frames.
+        schema: Arrow schema to build, see `MatchExporter`.
+    """
+    _require_pyarrow()
+    schema = schema or _schema({})
+    frame = table.frame.astype(np.int32) + frame_offset
+    arrays = {
+        'frame': pa.array(frame, pa.int32()),
+        'time_s': pa.array((frame / fps).astype(np.float32), pa.float32()),
+        'object_type': pa.DictionaryArray.from_arrays(pa.array(table.object_type, pa.int8()),
+                                                      pa.array(OBJECT_TYPES, pa.string())),
+        'track_id': pa.array(table.track_id, pa.int32()),
+    }
+    for name, (column, index) in VALUE_COLUMNS.items():
+        values = getattr(table, column)
+        if index is not None:
+            values = values[:, index]
+        kind = schema.field(name).type
+        if column not in table.filled and values.dtype.kind != 'b' and column != 'bbox':
+            arrays[name] = pa.nulls(len(table), kind)
+        elif values.dtype.kind == 'f':
+            arrays[name] = pa.array(values, kind, mask=np.isnan(values))
+        elif column == 'team_id':
+            arrays[name] = pa.array(values, kind, mask=values == 0)
+        else:
+            arrays[name] = pa.array(values, kind)
+    if possession_team is None:
+        arrays['possession_team'] = pa.nulls(len(table), pa.int8())
+    else:
+        team = np.asarray(possession_team, dtype=np.int8)[table.frame]
+        arrays['possession_team'] = pa.array(team, pa.int8(), mask=team == 0)
+    return pa.Table.from_arrays([arrays[field.name] for field in schema], schema=schema)
+
+
+class MatchExporter:
+    """
+    Writes the finalized tracks of a match to a columnar file, chunk by
+    chunk, so analysts can query the numbers without the video.
+
+    A path ending in .parquet gives a compressed Parquet file with one row
+    group per `row_group_frames` frames and column statistics; a path
+    ending in .arrow or .feather gives an uncompressed Arrow IPC file that
+    is read zero-copy through a memory map. Either way the file only
+    appears under its name once `close` succeeds. See `MatchStore` for
+    reading it back.
+
+    The file is only opened by the first `write`, so entries added to
+    `metadata` until then, e.g. the team colors, are stored as well.
+
+    Every `row_group_frames` frames the running ball control counts are
+    stored as a checkpoint (in the footer of a Parquet file, with the
+    record batch of an Arrow file), so a reader can bring possession
+    statistics up to any frame without replaying the match from the start.
+    """
+    def __init__(self, path, fps, row_group_frames=1500, second_half_frame=None, metadata=None, compression='zstd'):
+        """
+        Args:
+            path: Output file, .parquet or .arrow/.feather.
+            fps: Frame rate of the video.
+            row_group_frames: Frames per row group (Parquet) or record
+                batch (Arrow), the unit a frame-range query reads.
+            second_half_frame: First frame of the second half. Defaults to
+                the middle of the video.
+            metadata: Dict of further JSON-serializable metadata, e.g. the
+                video path.
+            compression: Parquet compression codec.
+        """
+        _require_pyarrow()
+        self.path = path
+        self.fps = fps
+        self.row_group_frames = max(1, row_group_frames)
+        self.metadata = dict(metadata or {}, fps=fps, format_version=FORMAT_VERSION)
+        if second_half_frame is not None:
+            self.metadata['second_half_frame'] = second_half_frame
+        self.compression = compression
+        self.schema = None
+        self.temp_path = None
+        self.sink = None
+        self.writer = None
+        self.closed = False
+        self.pending = []
+        self.pending_start = None
+        # ball control counted up to the last frame written: [last team, frames per team 0, 1, 2]
+        self.possession = [0, 0, 0, 0]
+        self.checkpoints = []
+        self.attached_checkpoints = 0
+        self.num_frames = 0
+        self.rows = 0
+        self.row_groups = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self):
+        """
+        Create the temporary file with the metadata gathered so far.
+        """
+        if self.writer is not None or self.closed:
+            return
+        self.schema = _schema(self.metadata)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        if _is_arrow_path(self.path):
+            self.sink = pa.OSFile(self.temp_path, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+        else:
+            self.writer = pq.ParquetWriter(self.temp_path, self.schema, compression=self.compression,
+                                           sorting_columns=[pq.SortingColumn(0)])
+
+    def write(self, table, frame_offset=0, possession_team=None):
+        """
+        Add the rows of the next frames.
+        Args:
+            table: TrackTable of frames `frame_offset` onwards, after every
+                enrichment stage.
+            frame_offset: Video frame number of the table's frame 0. Calls
+                cover increasing frame ranges.
+            possession_team: Optional per-frame team in possession, 0 for
+                none.
+        """
+        self.open()
+        if possession_team is not None:
+            self.count_possession(np.asarray(possession_team)[:table.num_frames], frame_offset)
+        rows = track_table_to_arrow(table, self.fps, frame_offset, possession_team, self.schema)
+        self.num_frames = max(self.num_frames, frame_offset + table.num_frames)
+        if self.pending_start is None:
+            self.pending_start = frame_offset
+        self.pending.append(rows)
+        while self.pending and self.num_frames - self.pending_start >= self.row_group_frames:
+            self.flush(self.pending_start + self.row_group_frames)
+
+    def count_possession(self, team, frame_offset):
+        """
+        Advance the ball control counts over the frames of a `write` and
+        checkpoint them at every multiple of `row_group_frames`. Frames are
+        credited as by PossessionStatistics: to the team in control, or to
+        the last team that was when nobody is.
+        """
+        team = team.astype(np.int64)
+        if not len(team):
+            return
+        known = np.maximum.accumulate(np.where(team > 0, np.arange(len(team)), -1))
+        credited = np.where(known >= 0, team[np.maximum(known, 0)], self.possession[0])
+        counts = np.zeros((len(team) + 1, 3), dtype=np.int64)
+        counts[1:] = np.cumsum(credited[:, None] == np.arange(3), axis=0)
+        first = -(-frame_offset // self.row_group_frames) * self.row_group_frames
+        for frame in range(first, frame_offset + len(team), self.row_group_frames):
+            if self.checkpoints and self.checkpoints[-1][0] >= frame:
+                continue
+            index = frame - frame_offset
+            last_team = int(credited[index - 1]) if index else self.possession[0]
+            totals = [int(total) for total in np.add(self.possession[1:], counts[index])]
+            self.checkpoints.append([frame, last_team] + totals)
+        self.possession = [int(credited[-1])] + [int(total) for total in np.add(self.possession[1:], counts[-1])]
+
+    def flush(self, stop=None):
+        """
+        Write the pending rows of frames before `stop` (all by default) as
+        one row group.
+        """
+        if not self.pending:
+            return
+        rows = pa.concat_tables(self.pending)
+        split = len(rows) if stop is None else int(np.searchsorted(rows.column('frame').to_numpy(), stop))
+        head, tail = rows.slice(0, split), rows.slice(split)
+        if len(head):
+            if self.sink is None:
+                self.writer.write_table(head, row_group_size=len(head))
+            else:
+                # the checkpoints up to the end of the batch travel with it
+                attached = [checkpoint for checkpoint in self.checkpoints[self.attached_checkpoints:]
+                            if stop is None or checkpoint[0] < stop]
+                self.attached_checkpoints += len(attached)
+                self.writer.write_batch(head.combine_chunks().to_batches()[0],
+                                        custom_metadata={'match_store_possession': json.dumps(attached)})
+            self.rows += len(head)
+            self.row_groups += 1
+        self.pending = [tail] if len(tail) else []
+        self.pending_start = None if stop is None else stop
+
+    def close(self):
+        """
+        Write the remaining rows and move the file into place.
+
+        Returns:
+            Dict with the 'path', 'frames', 'rows' and 'row_groups' written.
+        """
+        if self.closed:
+            return self.summary()
+        self.open()
+        self.flush()
+        if self.sink is None:
+            # frames at the end without any object leave no rows behind, so the count is kept here
+            self.writer.add_key_value_metadata({'match_store_frames': str(self.num_frames),
+                                                'match_store_possession': json.dumps(self.checkpoints)})
+        self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+        os.replace(self.temp_path, self.path)
+        self.writer = None
+        self.closed = True
+        return self.summary()
+
+    def abort(self):
+        """
+        Drop the partial file, e.g. after a failed run.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.writer is not None:
+                self.writer.close()
+            if self.sink is not None:
+                self.sink.close()
+        finally:
+            self.writer = None
+            if self.temp_path is not None and os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+
+    def summary(self):
+        return {'path': self.path, 'frames': self.num_frames, 'rows': self.rows, 'row_groups': self.row_groups}
+
+
+class MatchStore:
+    """
+    Queries a match exported by MatchExporter without touching the video.
+
+    The file is memory-mapped, and a query only reads the columns it needs
+    from the row groups whose frame statistics overlap the requested frame
+    range, e.g. two columns of the second half:
+
+        store = MatchStore('output_videos/match.parquet')
+        store.top_speed(12, half=2)
+        store.query(['frame', 'pitch_x', 'pitch_y'], track_id=12, seconds=(60, 120)).to_pandas()
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path: A .parquet or .arrow/.feather file written by MatchExporter.
+        """
+        _require_pyarrow()
+        self.path = path
+        if _is_arrow_path(path):
+            self.source = pa.memory_map(path, 'r')
+            self.reader = pa.ipc.open_file(self.source)
+            self.schema = self.reader.schema
+            self.parquet = None
+            num_frames = None
+        else:
+            self.parquet = pq.ParquetFile(path, memory_map=True)
+            self.schema = self.parquet.schema_arrow
+            num_frames = (self.parquet.metadata.metadata or {}).get(b'match_store_frames')
+        self.metadata = json.loads((self.schema.metadata or {}).get(b'match_store', b'{}'))
+        self.fps = self.metadata.get('fps', 24)
+        self.group_ranges = self.frame_ranges()
+        self.num_frames = int(num_frames) if num_frames is not None else \
+            max((stop for _, stop in self.group_ranges), default=0)
+        self.second_half_frame = self.metadata.get('second_half_frame', self.num_frames // 2)
+        self.checkpoints = self.read_checkpoints()
+
+    @property
+    def columns(self):
+        return self.schema.names
+
+    def frame_ranges(self):
+        """
+        [start, stop) frames of every row group (Parquet) or record batch
+        (Arrow), from the statistics or the first and last rows.
+        """
+        ranges = []
+        if self.parquet is not None:
+            frame_column = self.schema.get_field_index('frame')
+            for index in range(self.parquet.metadata.num_row_groups):
+                statistics = self.parquet.metadata.row_group(index).column(frame_column).statistics
+                ranges.append((statistics.min, statistics.max + 1))
+            return ranges
+        for index in range(self.reader.num_record_batches):
+            # only the frame column of the mapped batch is touched
+            frame = self.reader.get_batch(index).column('frame')
+            ranges.append((frame[0].as_py(), frame[-1].as_py() + 1) if len(frame) else (0, 0))
+        return ranges
+
+    def read_checkpoints(self):
+        """
+        The ball control checkpoints of the file, sorted by frame, each a
+        [frame, last team, frames credited to nobody, team 1, team 2] list.
+        """
+        if self.parquet is not None:
+            return json.loads((self.parquet.metadata.metadata or {}).get(b'match_store_possession', b'[]'))
+        checkpoints = []
+        for index in range(self.reader.num_record_batches):
+            _, custom_metadata = self.reader.get_batch_with_custom_metadata(index)
+            checkpoints.extend(json.loads((custom_metadata or {}).get(b'match_store_possession', b'[]')))
+        return checkpoints
+
+    def possession_checkpoint(self, frame):
+        """
+        The last ball control checkpoint at or before `frame`.
+
+        Returns:
+            Dict with the checkpoint's 'frame', the 'last_team' in control
+            before it and the 'totals' of frames credited to nobody, team 1
+            and team 2 before it; all zero at frame 0.
+        """
+        position = np.searchsorted([checkpoint[0] for checkpoint in self.checkpoints], frame, side='right') - 1
+        if position < 0:
+            return {'frame': 0, 'last_team': 0, 'totals': [0, 0, 0]}
+        checkpoint = self.checkpoints[position]
+        return {'frame': checkpoint[0], 'last_team': checkpoint[1], 'totals': checkpoint[2:]}
+
+    def frame_range(self, frames=None, seconds=None, half=None):
+        """
+        [start, stop) frames selected by at most one of `frames` (a
+        (start, stop) pair of frame numbers), `seconds` (a (start, stop)
+        pair in seconds) or `half` (1 or 2). None selects the whole match.
+        """
+        if frames is not None:
+            start, stop = frames
+        elif seconds is not None:
+            start, stop = (None if value is None else int(np.ceil(value * self.fps)) for value in seconds)
+        elif half is not None:
+            if half not in (1, 2):
+                raise ValueError(f'half must be 1 or 2, got {half!r}')
+            start, stop = (0, self.second_half_frame) if half == 1 else (self.second_half_frame, None)
+        else:
+            start, stop = None, None
+        return (0 if start is None else start), (self.num_frames if stop is None else stop)
+
+    def query(self, columns=None, frames=None, seconds=None, half=None, object_type=None, track_id=None,
+              team_id=None):
+        """
+        Rows of the selected frames and objects.
+        Args:
+            columns: Columns to return; all by default. Only these and the
+                ones needed by the filters are read.
+            frames, seconds, half: Frame range, see `frame_range`.
+            object_type: 'players', 'referees' or 'ball'.
+            track_id: Track ID, or list of them.
+            team_id: Team ID.
+
+        Returns:
+            A pyarrow Table, e.g. for `.to_pandas()`.
+        """
+        start, stop = self.frame_range(frames, seconds, half)
+        columns = list(self.columns if columns is None else columns)
+        unknown = set(columns) - set(self.columns)
+        if unknown:
+            raise ValueError(f'Unknown columns {sorted(unknown)}, expected some of {self.columns}')
+        filters = {name: value for name, value in (('object_type', object_type), ('track_id', track_id),
+                                                   ('team_id', team_id)) if value is not None}
+        read = list(dict.fromkeys(columns + ['frame'] + list(filters)))
+
+        groups = [index for index, (group_start, group_stop) in enumerate(self.group_ranges)
+                  if group_start < stop and group_stop > start]
+        if self.parquet is not None:
+            rows = self.parquet.read_row_groups(groups, columns=read) if groups else \
+                self.schema.empty_table().select(read)
+        else:
+            batches = [self.reader.get_batch(index).select(read) for index in groups]
+            rows = pa.Table.from_batches(batches) if batches else self.schema.empty_table().select(read)
+
+        mask = pc.and_(pc.greater_equal(rows['frame'], start), pc.less(rows['frame'], stop))
+        for name, value in filters.items():
+            if name == 'object_type':
+                column = pc.cast(rows[name], pa.string())
+            else:
+                column = rows[name]
+            values = value if isinstance(value, (list, tuple, set, np.ndarray)) else [value]
+            mask = pc.and_(mask, pc.is_in(column, value_set=pa.array(list(values), column.type)))
+        return rows.filter(mask).select(columns)
+
+    @property
+    def team_colors(self):
+        """
+        Dict of team ID to the BGR color the pipeline drew it with, empty
+        when the export does not record them.
+        """
+        return {int(team): tuple(color) for team, color in self.metadata.get('team_colors', {}).items()}
+
+    def track_table(self, **frame_range):
+        """
+        The tracks of a frame range as a TrackTable whose frame 0 is the
+        first frame of the range, e.g. to draw them with a FrameRenderer.
+        Columns without any value in the range are left unfilled, and the
+        team colors are filled in from the metadata.
+        """
+        start, stop = self.frame_range(**frame_range)
+        rows = self.query(frames=(start, stop))
+        object_type = pc.dictionary_encode(pc.cast(rows['object_type'], pa.string())) if len(rows) else None
+        type_index = np.zeros(len(rows), dtype=np.int8)
+        if object_type is not None:
+            names = object_type.combine_chunks().dictionary.to_pylist()
+            mapping = np.array([OBJECT_TYPES.index(name) for name in names], dtype=np.int8)
+            type_index = mapping[object_type.combine_chunks().indices.to_numpy()]
+
+        def values(name, fill):
+            return rows[name].to_numpy(zero_copy_only=False) if rows[name].null_count == 0 else \
+                pc.fill_null(rows[name], fill).to_numpy(zero_copy_only=False)
+
+        columns = {}
+        for column in dict.fromkeys(column for column, _ in VALUE_COLUMNS.values()):
+            names = [name for name, (source, _) in VALUE_COLUMNS.items() if source == column]
+            if all(rows[name].null_count == len(rows) for name in names) and column != 'bbox':
+                continue
+            fill = {'team_id': 0, 'has_ball': False, 'interpolated': False}.get(column, np.nan)
+            stacked = [values(name, fill) for name in names]
+            columns[column] = np.stack(stacked, axis=1) if len(stacked) > 1 else stacked[0]
+        table = TrackTable(stop - start, values('frame', 0) - start, type_index, values('track_id', 0), columns)
+
+        colors = self.team_colors
+        if colors and 'team_id' in table.filled:
+            team_color = np.full((len(table), 3), np.nan, dtype=np.float32)
+            for team, color in colors.items():
+                team_color[table.team_id == team] = color
+            table.set_column('team_color', team_color)
+        return table
+
+    def camera_movement(self, **frame_range):
+        """
+        Per-frame (x, y) camera movement of a frame range.
+
+        It is not stored as such: every row holds both its raw and its
+        camera-adjusted position, and their difference is the movement of
+        its frame. Frames without any object repeat the previous movement.
+
+        Returns:
+            Float32 array of shape (frames, 2).
+        """
+        start, stop = self.frame_range(**frame_range)
+        rows = self.query(['frame', 'x', 'y', 'x_adjusted', 'y_adjusted'], frames=(start, stop)).drop_null()
+        movement = np.full((stop - start, 2), np.nan, dtype=np.float32)
+        if len(rows):
+            frame = rows['frame'].to_numpy() - start
+            movement[frame, 0] = rows['x'].to_numpy() - rows['x_adjusted'].to_numpy()
+            movement[frame, 1] = rows['y'].to_numpy() - rows['y_adjusted'].to_numpy()
+        known = np.where(~np.isnan(movement[:, 0]), np.arange(len(movement)), -1)
+        known = np.maximum.accumulate(known) if len(known) else known
+        return np.where(known[:, None] >= 0, movement[np.maximum(known, 0)], 0).astype(np.float32)
+
+    def possession_team(self, **frame_range):
+        """
+        Per-frame team in possession of the ball over a frame range, 0 for
+        none, as the pipelines pass it to PossessionStatistics.
+
+        Returns:
+            Int8 array with one entry per frame.
+        """
+        start, stop = self.frame_range(**frame_range)
+        rows = self.query(['frame', 'possession_team'], frames=(start, stop)).drop_null()
+        team = np.zeros(stop - start, dtype=np.int8)
+        team[rows['frame'].to_numpy() - start] = rows['possession_team'].to_numpy()
+        return team
+
+    def top_speed(self, track_id, object_type='players', **frame_range):
+        """
+        Highest speed of a track in a frame range, e.g. `top_speed(12, half=2)`.
+
+        Returns:
+            Dict with 'speed_kmh', 'frame' and 'time_s', or None when the
+            track has no speed there.
+        """
+        rows = self.query(['frame', 'time_s', 'speed_kmh'], object_type=object_type, track_id=track_id,
+                          **frame_range).drop_null()
+        if not len(rows):
+            return None
+        best = pc.index(rows['speed_kmh'], pc.max(rows['speed_kmh'])).as_py()
+        return {name: rows[name][best].as_py() for name in ('speed_kmh', 'frame', 'time_s')}
+
+    def distance_covered(self, track_id, object_type='players', **frame_range):
+        """
+        Meters covered by a track in a frame range, from its cumulative
+        distance, or None when it has no distance there.
+        """
+        distance = self.query(['distance_m'], object_type=object_type, track_id=track_id,
+                              **frame_range)['distance_m'].drop_null()
+        if not len(distance):
+            return None
+        # the cumulative distance of the first row was covered before the range
+        return round(distance[-1].as_py() - distance[0].as_py(), 2)
+
+    def possession(self, **frame_range):
+        """
+        Share of the frames with a ball holder that each team had the ball.
+
+        Returns:
+            Dict of team ID to fraction.
+        """
+        rows = self.query(['frame', 'possession_team'], **frame_range).drop_null()
+        if not len(rows):
+            return {}
+        # one row per frame is enough, the team is repeated on every row of a frame
+        frame = rows['frame'].to_numpy()
+        first = np.concatenate([[True], frame[1:] != frame[:-1]])
+        teams, counts = np.unique(rows['possession_team'].to_numpy()[first], return_counts=True)
+        return {int(team): round(float(count / counts.sum()), 4) for team, count in zip(teams, counts)}
@@ -0,0 +1,278 @@
+import bisect
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Upper edges of the latency histogram buckets, in milliseconds. The last
+# bucket collects everything slower than the last edge.
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+_BUCKET_LABELS = [f'<={edge}' for edge in LATENCY_BUCKETS_MS] + [f'>{LATENCY_BUCKETS_MS[-1]}']
+
+_DISABLED = nullcontext()
+
+
+def get_peak_rss_mb():
+    """
+    Peak resident set size of this process so far, in MiB, or None when it
+    can not be read on this platform.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes everywhere else
+        return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss) / (1 << 20)
+    return None
+
+
+class StageStats:
+    """
+    Timing of one pipeline stage: call and frame counts, total time and a
+    fixed-bucket histogram of the per-call latency.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.frames = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.peak_rss_growth_mb = None
+
+    def add(self, seconds, frames, rss_growth_mb=None):
+        if rss_growth_mb is not None:
+            self.peak_rss_growth_mb = (self.peak_rss_growth_mb or 0.0) + rss_growth_mb
+        self.calls += 1
+        self.frames += frames
+        self.total_time += seconds
+        self.max_time = max(self.max_time, seconds)
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+
+    def percentile_ms(self, q):
+        """
+        Upper bound of the latency of the `q` quantile of the calls, read off
+        the histogram, so it is exact only up to the bucket width.
+        """
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank and count:
+                if bucket < len(LATENCY_BUCKETS_MS):
+                    return min(float(LATENCY_BUCKETS_MS[bucket]), self.max_time * 1000)
+                break
+        return self.max_time * 1000
+
+    def as_dict(self, wall_time=None):
+        return {
+            'stage': self.name,
+            'calls': self.calls,
+            'frames': self.frames,
+            'total_time': round(self.total_time, 6),
+            'share': round(self.total_time / wall_time, 4) if wall_time else None,
+            'fps': round(self.frames / self.total_time, 2) if self.total_time > 0 else None,
+            'mean_ms': round(self.total_time * 1000 / self.calls, 3) if self.calls else 0.0,
+            'p50_ms': round(self.percentile_ms(0.5), 3),
+            'p95_ms': round(self.percentile_ms(0.95), 3),
+            'max_ms': round(self.max_time * 1000, 3),
+            'peak_rss_growth_mb': None if self.peak_rss_growth_mb is None else round(self.peak_rss_growth_mb, 1),
+            'histogram_ms': dict(zip(_BUCKET_LABELS, self.histogram)),
+        }
+
+
+class _StageTimer:
+    __slots__ = ('profiler', 'name', 'frames', 'start', 'rss')
+
+    def __init__(self, profiler, name, frames):
+        self.profiler = profiler
+        self.name = name
+        self.frames = frames
+
+    def __enter__(self):
+        self.rss = get_peak_rss_mb()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.record(self.name, time.perf_counter() - self.start, self.frames, rss_before=self.rss)
+
+
+class StageProfiler:
+    """
+    Collects the wall time, throughput, peak memory growth and latency
+    histogram of every pipeline stage, and the depths of the frame queues
+    between them.
+
+    Stages are timed with `with profiler.stage('detect', frames=len(chunk)):`.
+    A disabled profiler hands out one shared no-op context manager and
+    records nothing, so the instrumentation can stay in the pipeline at the
+    cost of a method call per stage call. Stages may be timed from several
+    threads, e.g. decoding and encoding.
+
+    A stage's `fps` is the rate it would reach running alone (frames over
+    the time spent in it), `share` its fraction of the run's wall time.
+    Stages that run on their own thread overlap with the others, so their
+    shares do not add up to one; the one with the largest share of the
+    analysis thread is the bottleneck. A stage's `peak_rss_growth_mb` is how
+    far the peak memory of the process rose during its calls, which points
+    at the stages that set the peak; a stage running while another thread
+    allocates is charged for that too.
+    """
+    def __init__(self, enabled=True, live_interval=None, log=print):
+        """
+        Args:
+            enabled: Whether anything is recorded.
+            live_interval: Seconds between live one-line summaries while a
+                run is in progress. None prints nothing until the end.
+            log: Callable receiving the live summary lines.
+        """
+        self.enabled = enabled
+        self.live_interval = live_interval
+        self.log = log
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.start()
+
+    def start(self):
+        """
+        Forget earlier stage measurements and start the wall clock of a new
+        run. Watched queues stay registered.
+        """
+        self.stages = {}
+        self.frames = 0
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        self.last_live = self.start_time
+
+    def stop(self):
+        self.end_time = time.perf_counter()
+
+    def stage(self, name, frames=1):
+        """
+        Context manager timing one call of stage `name` over `frames` frames.
+        """
+        if not self.enabled:
+            return _DISABLED
+        return _StageTimer(self, name, frames)
+
+    def record(self, name, seconds, frames=1, rss_before=None):
+        """
+        Add one call of stage `name`.
+        Args:
+            name: Stage name.
+            seconds: Duration of the call.
+            frames: Frames the call handled.
+            rss_before: `get_peak_rss_mb()` when the call began, to charge
+                the stage with the growth of the peak since.
+        """
+        growth = None
+        if rss_before is not None:
+            growth = get_peak_rss_mb() - rss_before
+        with self.lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats(name)
+            stats.add(seconds, frames, growth)
+        if self.live_interval is not None:
+            self.maybe_log()
+
+    def add_frames(self, frames=1):
+        """
+        Count frames that made it through the whole pipeline.
+        """
+        if self.enabled:
+            self.frames += frames
+
+    def watch_queue(self, name, stats):
+        """
+        Include a queue's QueueStats in the report, e.g. the decode queue.
+        """
+        if self.enabled:
+            self.queues[name] = stats
+
+    @property
+    def wall_time(self):
+        return (self.end_time or time.perf_counter()) - self.start_time
+
+    def maybe_log(self):
+        now = time.perf_counter()
+        if now - self.last_live < self.live_interval:
+            return
+        self.last_live = now
+        self.log(self.summary_line())
+
+    def summary_line(self):
+        wall_time = self.wall_time
+        fps = self.frames / wall_time if wall_time > 0 else 0.0
+        with self.lock:
+            stages = sorted(self.stages.values(), key=lambda stats: -stats.total_time)
+        parts = [f'{stats.name} {stats.total_time / wall_time:.0%}' for stats in stages[:4]] if wall_time > 0 else []
+        queues = [f"{name} {stats.as_dict()['mean_depth']:.1f}/{stats.maxsize}" for name, stats in self.queues.items()]
+        rss = get_peak_rss_mb()
+        return ' | '.join([f'{self.frames} frames {fps:.1f} fps', ', '.join(parts), ', '.join(queues),
+                           'peak rss ' + ('n/a' if rss is None else f'{rss:.0f} MiB')])
+
+    def report(self):
+        """
+        The measurements of the run as a dict with 'wall_time', 'frames',
+        'fps', 'peak_rss_mb', per-stage entries under 'stages' and queue
+        counters under 'queues'.
+        """
+        wall_time = self.wall_time
+        rss = get_peak_rss_mb()
+        with self.lock:
+            stages = [stats.as_dict(wall_time) for stats in self.stages.values()]
+        return {
+            'wall_time': round(wall_time, 6),
+            'frames': self.frames,
+            'fps': round(self.frames / wall_time, 2) if wall_time > 0 else 0.0,
+            'peak_rss_mb': None if rss is None else round(rss, 1),
+            'stages': stages,
+            'queues': {name: stats.as_dict() for name, stats in self.queues.items()},
+        }
+
+    def write_report(self, path):
+        """
+        Write the report as JSON, or as CSV with one row per stage when the
+        path ends in '.csv'. Queue counters are only part of the JSON report.
+        """
+        report = self.report()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not path.endswith('.csv'):
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            return report
+
+        rows = []
+        for stage in report['stages']:
+            row = {name: value for name, value in stage.items() if name != 'histogram_ms'}
+            row.update({f'latency_{bucket}ms': count for bucket, count in stage['histogram_ms'].items()})
+            rows.append(row)
+        rows.append({'stage': 'total', 'frames': report['frames'], 'total_time': report['wall_time'],
+                     'fps': report['fps'], 'peak_rss_mb': report['peak_rss_mb']})
+        fieldnames = list(rows[0])
+        fieldnames += [name for name in rows[-1] if name not in fieldnames]
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        return report
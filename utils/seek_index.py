@@ -0,0 +1,129 @@
+import cv2
+import numpy as np
+from .stage_cache import StageCache, video_fingerprint
+
+SEEK_INDEX_VERSION = 1
+
+
+class SeekIndex:
+    """
+    Keyframe positions and presentation times of every frame of a video.
+
+    It is built once per video by demuxing the file: the packets are read
+    but nothing is decoded, so building costs a small fraction of a decode
+    pass, and with a StageCache it is stored next to the stage results and
+    reused. With it a reader seeks straight to the keyframe before the
+    first frame it needs and decodes from there, and clip boundaries given
+    in seconds map to exact frame numbers even when the frame rate varies.
+    """
+    def __init__(self, keyframes, timestamps, fps):
+        """
+        Args:
+            keyframes: Sorted frame numbers of the keyframes. Empty when the
+                container does not tell, in which case every frame is
+                treated as a seek point and the decoder's own seeking is
+                relied on.
+            timestamps: Presentation time of every frame in seconds, from
+                the start of the video.
+            fps: Nominal frame rate of the video.
+        """
+        self.keyframes = np.asarray(keyframes, dtype=np.int64)
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.fps = fps
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def num_frames(self):
+        return len(self.timestamps)
+
+    @property
+    def duration(self):
+        return float(self.timestamps[-1]) + 1 / self.fps if len(self.timestamps) else 0.0
+
+    @classmethod
+    def build(cls, path):
+        """
+        Index a video by demuxing it with OpenCV.
+        Args:
+            path: Path to the video file.
+        """
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise ValueError(f'Cannot open video {path}')
+        fps = cap.get(cv2.CAP_PROP_FPS) or 24
+        # in raw mode grab() only demuxes the next packet instead of decoding a frame
+        raw = cap.set(cv2.CAP_PROP_FORMAT, -1)
+        timestamps, keyframe = [], []
+        try:
+            while cap.grab():
+                timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+                keyframe.append(bool(raw and cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+        finally:
+            cap.release()
+        # packets come in decoding order, which differs from presentation order with B-frames
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = np.asarray(timestamps, dtype=np.float64)[order]
+        keyframes = np.flatnonzero(np.asarray(keyframe, dtype=bool)[order]) if raw else []
+        return cls(keyframes, timestamps, fps)
+
+    @classmethod
+    def load_or_build(cls, path, cache=None):
+        """
+        The index of a video, from `cache` when it was built before.
+        Args:
+            path: Path to the video file.
+            cache: Optional StageCache, or its directory, storing the index
+                under the video's fingerprint.
+        """
+        if cache is None:
+            return cls.build(path)
+        if not isinstance(cache, StageCache):
+            cache = StageCache(cache)
+        key = StageCache.key('seek_index', version=SEEK_INDEX_VERSION, video=video_fingerprint(path))
+
+        def compute():
+            index = cls.build(path)
+            return {'keyframes': index.keyframes, 'timestamps': index.timestamps}, {'fps': index.fps}
+
+        arrays, meta = cache.get_or_compute('seek_index', key, compute)
+        return cls(arrays['keyframes'], arrays['timestamps'], meta['fps'])
+
+    def keyframe_before(self, frame):
+        """
+        The last keyframe at or before `frame`, where decoding has to start
+        to reach it; 0 for frames before the first keyframe.
+        """
+        if not len(self.keyframes):
+            return frame
+        position = np.searchsorted(self.keyframes, frame, side='right') - 1
+        return int(self.keyframes[position]) if position >= 0 else 0
+
+    def timestamp(self, frame):
+        """
+        Presentation time of `frame` in seconds; frames past the end are
+        extrapolated at the nominal frame rate.
+        """
+        if frame < len(self.timestamps):
+            return float(self.timestamps[frame])
+        return self.duration + (frame - len(self.timestamps)) / self.fps
+
+    def frame_at(self, seconds):
+        """
+        The first frame shown at or after `seconds`.
+        """
+        # a millisecond of slack absorbs the rounding of millisecond timestamps
+        return int(np.searchsorted(self.timestamps, seconds - 1e-3, side='left'))
+
+    def decode_cost(self, start, stop):
+        """
+        Frames that have to be decoded to read frames [start, stop).
+        """
+        return max(0, stop - self.keyframe_before(start)) if stop > start else 0
+
+    def as_dict(self):
+        gaps = np.diff(self.keyframes)
+        return {'frames': self.num_frames, 'keyframes': len(self.keyframes), 'fps': self.fps,
+                'duration_s': round(self.duration, 3),
+                'max_keyframe_interval': int(gaps.max()) if len(gaps) else None}
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+def file_checksum(path, block_size=1 << 20):
+    """
+    SHA-256 of a whole file, e.g. model weights.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def video_fingerprint(path, samples=16, sample_size=1 << 16):
+    """
+    Content fingerprint of a video file.
+
+    Hashing a multi-gigabyte match completely would cost as much as reading
+    it, so the fingerprint covers the file size plus `samples` evenly spaced
+    blocks, which changes whenever the video is re-encoded or trimmed.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        for i in range(samples):
+            f.seek(max(0, (size - sample_size) * i // max(samples - 1, 1)))
+            digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+
+class StageCache:
+    """
+    Versioned, content-addressed store for per-chunk stage results.
+
+    A result is addressed by a key hashed from everything it depends on:
+    the stage name and version, the video fingerprint, the frame range, the
+    model checksum, the stage parameters and the keys of the upstream
+    results it was computed from. Changing one stage's parameters therefore
+    only invalidates that stage and the stages downstream of it.
+
+    Each entry is a directory of `.npy` files, one per array, plus a
+    `meta.json`, so arrays can be memory-mapped and nothing is unpickled.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(stage, version=1, **dependencies):
+        """
+        Build the key of a stage result.
+        Args:
+            stage: Stage name.
+            version: Bump when the stage's output format or algorithm changes.
+            **dependencies: JSON-serializable values the result depends on,
+                e.g. video=..., frames=(start, end), model=..., params={...},
+                inputs=[upstream keys].
+
+        Returns:
+            Hex digest identifying the result.
+        """
+        payload = json.dumps({'stage': stage, 'version': version, **dependencies},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, stage, key):
+        return os.path.join(self.cache_dir, stage, key[:2], key)
+
+    def load(self, stage, key, mmap=False):
+        """
+        Load a cached result.
+
+        Returns:
+            (arrays, meta) or None when the entry does not exist.
+        """
+        path = self.path(stage, key)
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            self.misses += 1
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None,
+                                allow_pickle=False)
+                  for name in meta.pop('arrays')}
+        self.hits += 1
+        return arrays, meta
+
+    def save(self, stage, key, arrays, meta=None):
+        """
+        Store a result atomically, so an interrupted run never leaves a
+        half-written entry behind.
+        Args:
+            stage: Stage name.
+            key: Key from `StageCache.key`.
+            arrays: Dict of name to NumPy array.
+            meta: Optional JSON-serializable metadata.
+        """
+        path = self.path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=f'.{key[:8]}-', dir=os.path.dirname(path))
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, f'{name}.npy'), np.asarray(array), allow_pickle=False)
+            with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                json.dump({**(meta or {}), 'arrays': list(arrays)}, f)
+            try:
+                os.replace(staging, path)
+            except OSError:
+                # another worker stored the same entry first
+                pass
+        finally:
+            if os.path.exists(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+
+    def get_or_compute(self, stage, key, compute):
+        """
+        Return the cached result, or compute, store and return it.
+        Args:
+            compute: Callable returning (arrays, meta).
+        """
+        cached = self.load(stage, key)
+        if cached is not None:
+            return cached
+        arrays, meta = compute()
+        self.save(stage, key, arrays, meta)
+        return arrays, meta
@@ -0,0 +1,401 @@
+import collections
+import os
+import queue
+import threading
+import time
+import cv2
+from .profiler import StageProfiler
+from .video_backends import open_video_reader, open_video_writer
+
+_END = object()
+
+
+class QueueStats:
+    """
+    Counters describing how a bounded frame queue is being used.
+
+    `producer_stall_time` is the time the producer spent waiting for free
+    space (the consumer is the bottleneck), `consumer_stall_time` the time
+    the consumer spent waiting for frames (the producer is the bottleneck).
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.frames = 0
+        self.producer_stall_time = 0.0
+        self.consumer_stall_time = 0.0
+        self.max_depth = 0
+        self.depth_total = 0
+        self.depth_samples = 0
+        self.lock = threading.Lock()
+
+    def record_depth(self, depth):
+        with self.lock:
+            self.max_depth = max(self.max_depth, depth)
+            self.depth_total += depth
+            self.depth_samples += 1
+
+    def add_producer_stall(self, seconds, frames=1):
+        with self.lock:
+            self.producer_stall_time += seconds
+            self.frames += frames
+
+    def add_consumer_stall(self, seconds):
+        with self.lock:
+            self.consumer_stall_time += seconds
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'maxsize': self.maxsize,
+                'frames': self.frames,
+                'max_depth': self.max_depth,
+                'mean_depth': self.depth_total / self.depth_samples if self.depth_samples else 0.0,
+                'producer_stall_time': self.producer_stall_time,
+                'consumer_stall_time': self.consumer_stall_time,
+            }
+
+
+class _BoundedFrameQueue:
+    """
+    Bounded FIFO of frames shared by one producer and one consumer thread.
+
+    Blocking operations wake up periodically to check `stop_event`, so
+    neither side hangs when the other one goes away.
+    """
+    def __init__(self, maxsize, stop_event):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stop_event = stop_event
+        self.stats = QueueStats(maxsize)
+
+    def put(self, item):
+        start = time.perf_counter()
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.stats.add_producer_stall(time.perf_counter() - start, frames=int(item is not _END))
+        self.stats.record_depth(self.queue.qsize())
+        return not self.stop_event.is_set()
+
+    def get(self):
+        start = time.perf_counter()
+        while True:
+            try:
+                item = self.queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    item = _END
+                    break
+        self.stats.add_consumer_stall(time.perf_counter() - start)
+        return item
+
+
+class ThreadedVideoReader:
+    """
+    Decodes a video on a background thread into a bounded prefetch queue.
+
+    Iterating over the reader yields frames in order, like `iter_video`,
+    while the next `queue_size` frames are being decoded concurrently.
+    """
+    def __init__(self, path, queue_size=64, profiler=None, backend='opencv', pool=None, stage='decode', **options):
+        """
+        Args:
+            path: Path to the video file.
+            queue_size: Maximum number of decoded frames waiting to be consumed.
+            profiler: Optional StageProfiler timing every decoded frame as
+                the `stage` stage.
+            backend: Decoder, see `utils.video_backends.open_video_reader`.
+            pool: Optional FramePool the frames are decoded into.
+            stage: Name of the decode stage in the profile.
+            **options: Further reader options, e.g. scale or gray.
+        """
+        self.path = path
+        self.queue_size = queue_size
+        self.backend = backend
+        self.pool = pool
+        self.stage = stage
+        self.options = options
+        self.profiler = profiler if profiler is not None else StageProfiler(enabled=False)
+        self.stop_event = threading.Event()
+        self.frames = _BoundedFrameQueue(queue_size, self.stop_event)
+        self.thread = None
+        self.error = None
+
+    @property
+    def stats(self):
+        return self.frames.stats
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._decode, name='video-reader', daemon=True)
+            self.thread.start()
+        return self
+
+    def _decode(self):
+        frames = None
+        try:
+            frames = iter(open_video_reader(self.path, self.backend, pool=self.pool, **self.options))
+            while not self.stop_event.is_set():
+                with self.profiler.stage(self.stage):
+                    frame = next(frames, None)
+                if frame is None:
+                    break
+                if not self.frames.put(frame):
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            if frames is not None:
+                frames.close()
+            self.frames.put(_END)
+
+    def __iter__(self):
+        self.start()
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is _END:
+                    break
+                yield frame
+        finally:
+            self.close()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ThreadedVideoWriter:
+    """
+    Encodes frames on a background thread, draining a bounded queue.
+
+    `write` returns as soon as the frame is queued; it only blocks when
+    `queue_size` frames are already waiting for the encoder.
+    """
+    def __init__(self, path, fps=24, queue_size=64, fourcc='XVID', profiler=None, backend='opencv', pool=None,
+                 **options):
+        """
+        Args:
+            path: Path of the output video file.
+            fps: Frames per second of the output video.
+            queue_size: Maximum number of frames waiting to be encoded.
+            fourcc: FourCC code of the output codec of the 'opencv' backend.
+            profiler: Optional StageProfiler timing every encoded frame as
+                the 'encode' stage.
+            backend: Encoder, see `utils.video_backends.open_video_writer`.
+            pool: Optional FramePool every frame is released to once it
+                has been encoded.
+            **options: Further writer options, e.g. codec or crf.
+        """
+        self.path = path
+        self.profiler = profiler if profiler is not None else StageProfiler(enabled=False)
+        self.fps = fps
+        self.fourcc = fourcc
+        self.backend = backend
+        self.pool = pool
+        self.options = dict(options, fourcc=fourcc) if backend == 'opencv' else options
+        self.queue_size = queue_size
+        self.stop_event = threading.Event()
+        self.frames = _BoundedFrameQueue(queue_size, self.stop_event)
+        self.thread = None
+        self.error = None
+        self.closed = False
+
+    @property
+    def stats(self):
+        return self.frames.stats
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._encode, name='video-writer', daemon=True)
+            self.thread.start()
+        return self
+
+    def _encode(self):
+        out = None
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is _END:
+                    break
+                if out is None:
+                    height, width = frame.shape[:2]
+                    out = open_video_writer(self.path, self.fps, (width, height), self.backend, **self.options)
+                with self.profiler.stage('encode'):
+                    out.write(frame)
+                if self.pool is not None:
+                    self.pool.release(frame)
+        except Exception as e:
+            self.error = e
+            self.stop_event.set()
+        finally:
+            if out is not None:
+                try:
+                    out.close()
+                except Exception as e:
+                    self.error = self.error or e
+
+    def write(self, frame):
+        if self.closed:
+            raise ValueError("Cannot write to a closed ThreadedVideoWriter.")
+        if self.error is not None:
+            raise self.error
+        self.start()
+        self.frames.put(frame)
+
+    def close(self):
+        """
+        Flush the queued frames and wait for the encoder to finish.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.thread is not None:
+            self.frames.put(_END)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class LiveVideoReader:
+    """
+    Captures a live feed on a background thread, keeping only the newest
+    frames.
+
+    Unlike ThreadedVideoReader, capture never waits for the consumer: when
+    `buffer_size` frames are already waiting, the oldest one is dropped, so
+    a slow consumer falls behind by at most that many frames. Iterating
+    yields `(frame_num, frame, capture_time)` tuples, where `frame_num`
+    counts every captured frame, dropped or not, and `capture_time` is the
+    `time.perf_counter()` at which the frame arrived.
+
+    A local file or pipe can stand in for a feed: with `realtime`, frame
+    `i` is only released `i / fps` seconds after the first one, as a camera
+    would deliver it.
+    """
+    def __init__(self, source, buffer_size=2, realtime=None, default_fps=25, profiler=None):
+        """
+        Args:
+            source: RTSP/HTTP URL, camera index, or path to a video file or
+                pipe.
+            buffer_size: Maximum number of captured frames waiting to be
+                consumed.
+            realtime: Pace the frames at the frame rate of the source.
+                Defaults to True for regular files, which would otherwise be
+                read as fast as they decode.
+            default_fps: Frame rate assumed when the source reports none.
+            profiler: Optional StageProfiler timing every captured frame as
+                the 'decode' stage.
+        """
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)
+        self.source = source
+        self.buffer_size = max(1, buffer_size)
+        self.realtime = (isinstance(source, str) and os.path.isfile(source)) if realtime is None else realtime
+        self.profiler = profiler if profiler is not None else StageProfiler(enabled=False)
+        self.frames = collections.deque(maxlen=self.buffer_size)
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.finished = False
+        self.captured = 0
+        self.dropped = 0
+        self.thread = None
+        self.error = None
+
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open video source {source!r}")
+        # keep the driver from queueing frames of its own, where supported
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and 0 < fps < 1000 else default_fps
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._capture, name='live-reader', daemon=True)
+            self.thread.start()
+        return self
+
+    def _capture(self):
+        start = None
+        try:
+            while not self.stop_event.is_set():
+                with self.profiler.stage('decode'):
+                    ret, frame = self.cap.read()
+                if not ret:
+                    break
+                now = time.perf_counter()
+                if self.realtime:
+                    if start is None:
+                        start = now
+                    delay = start + self.captured / self.fps - now
+                    if delay > 0 and self.stop_event.wait(delay):
+                        break
+                    now = time.perf_counter()
+                with self.condition:
+                    if len(self.frames) == self.buffer_size:
+                        self.dropped += 1
+                    self.frames.append((self.captured, frame, now))
+                    self.captured += 1
+                    self.condition.notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.cap.release()
+            with self.condition:
+                self.finished = True
+                self.condition.notify()
+
+    def waiting(self):
+        """
+        Number of captured frames waiting to be consumed.
+        """
+        with self.condition:
+            return len(self.frames)
+
+    def __iter__(self):
+        self.start()
+        try:
+            while True:
+                with self.condition:
+                    while not self.frames and not self.finished:
+                        self.condition.wait(0.1)
+                    if not self.frames:
+                        break
+                    item = self.frames.popleft()
+                yield item
+        finally:
+            self.close()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        else:
+            self.cap.release()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,363 @@
+from collections.abc import Mapping, MutableMapping, Sequence
+import numpy as np
+
+OBJECT_TYPES = ('players', 'referees', 'ball')
+
+# name -> (dtype, per-row shape, missing value)
+COLUMNS = {
+    'bbox': (np.float32, (4,), np.nan),
+    'position': (np.float32, (2,), np.nan),
+    'position_adjusted': (np.float32, (2,), np.nan),
+    'position_transformed': (np.float32, (2,), np.nan),
+    'team_id': (np.int8, (), 0),
+    'team_color': (np.float32, (3,), np.nan),
+    'has_ball': (np.bool_, (), False),
+    'interpolated': (np.bool_, (), False),
+    'speed': (np.float32, (), np.nan),
+    'acceleration': (np.float32, (), np.nan),
+    'distance': (np.float32, (), np.nan),
+}
+
+
+def _is_missing(name, value):
+    missing = COLUMNS[name][2]
+    if isinstance(missing, float):
+        return bool(np.all(np.isnan(value)))
+    return bool(np.all(value == missing))
+
+
+class TrackTable:
+    """
+    Columnar store of every tracked object in a run of frames.
+
+    One row per (frame, object) with contiguous arrays for each column, so
+    enrichment stages can work on whole columns at once instead of walking
+    nested dicts. Rows are ordered by frame; `frame_offsets` indexes the rows
+    of each frame and `track_rows` the rows of each track.
+
+    `as_tracks()` exposes the legacy `{'players': [{track_id: {...}}]}`
+    layout as a view whose per-object dicts read from and write to the
+    columns.
+    """
+    def __init__(self, num_frames, frame, object_type, track_id, columns=None):
+        """
+        Args:
+            num_frames: Number of frames covered by the table.
+            frame: Frame index of each row, non-decreasing.
+            object_type: Index into OBJECT_TYPES of each row.
+            track_id: Track ID of each row.
+            columns: Optional initial values for the COLUMNS, by name.
+        """
+        self.num_frames = num_frames
+        self.frame = np.asarray(frame, dtype=np.int32)
+        self.object_type = np.asarray(object_type, dtype=np.int8)
+        self.track_id = np.asarray(track_id, dtype=np.int32)
+        self.filled = set()
+        self.extra = {}
+        self._track_index = None
+
+        n = len(self.frame)
+        columns = columns or {}
+        for name, (dtype, shape, missing) in COLUMNS.items():
+            if name in columns:
+                values = np.asarray(columns[name], dtype=dtype).reshape((n,) + shape)
+                self.filled.add(name)
+            else:
+                values = np.full((n,) + shape, missing, dtype=dtype)
+            setattr(self, name, values)
+        self.frame_offsets = np.searchsorted(self.frame, np.arange(num_frames + 1)).astype(np.int64)
+
+    def __len__(self):
+        return len(self.frame)
+
+    @classmethod
+    def from_tracks(cls, tracks):
+        """
+        Build a table from the legacy dict-of-lists layout.
+
+        Any enrichment already present in the dicts (positions, team, speed,
+        ...) is carried over.
+        """
+        num_frames = max((len(obj_tracks) for obj_tracks in tracks.values()), default=0)
+        frame, object_type, track_id = [], [], []
+        values = {name: [] for name in COLUMNS}
+        present = {name: False for name in COLUMNS}
+
+        for frame_num in range(num_frames):
+            for type_index, obj in enumerate(OBJECT_TYPES):
+                obj_tracks = tracks.get(obj)
+                if obj_tracks is None or frame_num >= len(obj_tracks):
+                    continue
+                for tid, track_info in obj_tracks[frame_num].items():
+                    frame.append(frame_num)
+                    object_type.append(type_index)
+                    track_id.append(tid)
+                    for name, (dtype, shape, missing) in COLUMNS.items():
+                        value = track_info.get(name)
+                        if value is None:
+                            value = missing if not shape else [missing] * shape[0]
+                        else:
+                            present[name] = True
+                        values[name].append(value)
+
+        columns = {name: values[name] for name in COLUMNS if present[name] or name == 'bbox'}
+        if not frame:
+            columns = {}
+        return cls(num_frames, frame, object_type, track_id, columns)
+
+    @classmethod
+    def concatenate(cls, tables):
+        """
+        Join tables of consecutive frame ranges into one table.
+        """
+        tables = list(tables)
+        if not tables:
+            return cls(0, [], [], [])
+        frame_offsets = np.cumsum([0] + [table.num_frames for table in tables])
+        filled = set().union(*(table.filled for table in tables)) | {'bbox'}
+        columns = {name: np.concatenate([getattr(table, name) for table in tables])
+                   for name in COLUMNS if name in filled}
+        return cls(int(frame_offsets[-1]),
+                   np.concatenate([table.frame + offset for table, offset in zip(tables, frame_offsets)]),
+                   np.concatenate([table.object_type for table in tables]),
+                   np.concatenate([table.track_id for table in tables]),
+                   columns)
+
+    def select(self, rows, num_frames=None, frame_offset=0):
+        """
+        New table holding `rows` (in frame order), with frames shifted by
+        `-frame_offset`.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = {name: getattr(self, name)[rows] for name in COLUMNS if name in self.filled | {'bbox'}}
+        num_frames = self.num_frames - frame_offset if num_frames is None else num_frames
+        return TrackTable(num_frames, self.frame[rows] - frame_offset, self.object_type[rows],
+                          self.track_id[rows], columns)
+
+    def replace_object_rows(self, obj, frame, track_id, columns):
+        """
+        New table in which every row of object type `obj` is replaced.
+        Args:
+            obj: Object type, e.g. 'ball'.
+            frame: Frame index of each new row.
+            track_id: Track ID of each new row.
+            columns: Dict of column name to values of the new rows.
+        """
+        keep = np.flatnonzero(self.object_type != OBJECT_TYPES.index(obj))
+        frame = np.asarray(frame, dtype=np.int32)
+        n = len(frame)
+        merged_frame = np.concatenate([self.frame[keep], frame])
+        merged_type = np.concatenate([self.object_type[keep],
+                                      np.full(n, OBJECT_TYPES.index(obj), dtype=np.int8)])
+        merged_track = np.concatenate([self.track_id[keep], np.asarray(track_id, dtype=np.int32)])
+        order = np.lexsort((merged_type, merged_frame))
+        merged = {}
+        for name, (dtype, shape, missing) in COLUMNS.items():
+            if name not in self.filled and name not in columns and name != 'bbox':
+                continue
+            new = columns.get(name)
+            if new is None:
+                new = np.full((n,) + shape, missing, dtype=dtype)
+            merged[name] = np.concatenate([getattr(self, name)[keep], np.asarray(new, dtype=dtype).reshape((n,) + shape)])[order]
+        return TrackTable(self.num_frames, merged_frame[order], merged_type[order], merged_track[order], merged)
+
+    def rows_for_frame(self, frame_num):
+        return np.arange(self.frame_offsets[frame_num], self.frame_offsets[frame_num + 1])
+
+    def rows_of_type(self, obj):
+        return np.flatnonzero(self.object_type == OBJECT_TYPES.index(obj))
+
+    @property
+    def track_order(self):
+        """
+        Row indices sorted by (object type, track ID, frame), so each track's
+        rows are contiguous and in time order.
+        """
+        self._build_track_index()
+        return self._track_index[0]
+
+    def track_rows(self, obj, track_id):
+        """
+        Rows of one track, in frame order.
+        """
+        order, starts, keys = self._build_track_index()
+        key = (OBJECT_TYPES.index(obj), track_id)
+        position = np.searchsorted(keys, self._track_key(*key))
+        if position >= len(keys) or keys[position] != self._track_key(*key):
+            return np.empty(0, dtype=np.int64)
+        return order[starts[position]:starts[position + 1]]
+
+    def track_keys(self, rows=None):
+        """
+        One int64 key per row identifying its (object type, track ID).
+        """
+        if rows is None:
+            return self._track_key(self.object_type, self.track_id)
+        return self._track_key(self.object_type[rows], self.track_id[rows])
+
+    @classmethod
+    def key_for(cls, obj, track_id):
+        """
+        Keys matching `track_keys` for track IDs of object type `obj`.
+        """
+        track_id = np.asarray(track_id)
+        return cls._track_key(np.full(track_id.shape, OBJECT_TYPES.index(obj)), track_id)
+
+    def track_starts(self):
+        """
+        Boolean mask over `track_order` marking the first row of each track.
+        """
+        order = self.track_order
+        keys = self.track_keys(order)
+        starts = np.ones(len(order), dtype=bool)
+        starts[1:] = keys[1:] != keys[:-1]
+        return starts
+
+    @staticmethod
+    def _track_key(object_type, track_id):
+        return np.asarray(object_type, dtype=np.int64) << 32 | (np.asarray(track_id, dtype=np.int64) & 0xffffffff)
+
+    def _build_track_index(self):
+        if self._track_index is None:
+            order = np.lexsort((self.frame, self.track_id, self.object_type))
+            keys = self._track_key(self.object_type[order], self.track_id[order])
+            boundaries = np.flatnonzero(np.diff(keys)) + 1 if len(keys) else np.empty(0, dtype=np.int64)
+            starts = np.concatenate(([0], boundaries, [len(keys)])).astype(np.int64)
+            self._track_index = (order, starts, keys[starts[:-1]] if len(keys) else keys)
+        return self._track_index
+
+    def set_column(self, name, values, rows=None):
+        """
+        Write a column, or the given rows of it, and mark it as computed.
+        """
+        column = getattr(self, name)
+        if rows is None:
+            column[...] = values
+        else:
+            column[rows] = values
+        self.filled.add(name)
+
+    def as_tracks(self):
+        """
+        Legacy dict-of-lists view of the table.
+        """
+        return {obj: _FramesView(self, type_index) for type_index, obj in enumerate(OBJECT_TYPES)}
+
+    def write_back(self, tracks, columns):
+        """
+        Copy `columns` into a legacy dict-of-lists `tracks`, the layout this
+        table was built from with `from_tracks`.
+        """
+        if not isinstance(tracks, Mapping) or any(isinstance(v, _FramesView) for v in tracks.values()):
+            return
+        for row in range(len(self)):
+            obj = OBJECT_TYPES[self.object_type[row]]
+            track_info = tracks[obj][self.frame[row]][self.track_id[row].item()]
+            for name in columns:
+                value = _row_value(self, name, row)
+                if value is not _MISSING:
+                    track_info[name] = value
+                elif name == 'position_transformed':
+                    track_info[name] = None
+
+
+def as_track_table(tracks):
+    """
+    Return `tracks` itself if it already is a TrackTable, otherwise a table
+    built from the legacy layout.
+    """
+    if isinstance(tracks, TrackTable):
+        return tracks
+    return TrackTable.from_tracks(tracks)
+
+
+_MISSING = object()
+
+
+def _row_value(table, name, row):
+    if name not in table.filled:
+        return _MISSING
+    value = getattr(table, name)[row]
+    if _is_missing(name, value):
+        return _MISSING
+    if name == 'bbox':
+        return value.tolist()
+    if name in ('position', 'position_adjusted', 'team_color'):
+        return tuple(value.tolist())
+    if name == 'position_transformed':
+        return value.copy()
+    return value.item()
+
+
+class _FramesView(Sequence):
+    def __init__(self, table, type_index):
+        self.table = table
+        self.type_index = type_index
+
+    def __len__(self):
+        return self.table.num_frames
+
+    def __getitem__(self, frame_num):
+        if isinstance(frame_num, slice):
+            return [self[i] for i in range(*frame_num.indices(len(self)))]
+        if frame_num < 0:
+            frame_num += len(self)
+        rows = self.table.rows_for_frame(frame_num)
+        rows = rows[self.table.object_type[rows] == self.type_index]
+        return {self.table.track_id[row].item(): _RowView(self.table, row) for row in rows}
+
+
+class _RowView(MutableMapping):
+    """
+    Dict-like access to one row; writes go straight to the table's columns.
+    """
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = int(row)
+
+    def __getitem__(self, key):
+        if key in COLUMNS:
+            value = _row_value(self.table, key, self.row)
+            if value is not _MISSING:
+                return value
+            if key == 'position_transformed' and key in self.table.filled:
+                return None
+            raise KeyError(key)
+        return self.table.extra[(self.row, key)]
+
+    def __setitem__(self, key, value):
+        if key in COLUMNS:
+            if value is None:
+                value = COLUMNS[key][2]
+            self.table.set_column(key, value, rows=self.row)
+        else:
+            self.table.extra[(self.row, key)] = value
+
+    def __delitem__(self, key):
+        if key in COLUMNS:
+            getattr(self.table, key)[self.row] = COLUMNS[key][2]
+        else:
+            del self.table.extra[(self.row, key)]
+
+    def __iter__(self):
+        for key in COLUMNS:
+            if key in self:
+                yield key
+        for row, key in list(self.table.extra):
+            if row == self.row:
+                yield key
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,382 @@
+import shutil
+import subprocess
+import threading
+import cv2
+import numpy as np
+
+try:
+    import av
+except ImportError:
+    av = None
+
+
+def available_backends():
+    """
+    Which video I/O backends can be used in this environment.
+
+    Returns:
+        Dict of backend name to True when its dependency is installed.
+    """
+    return {'opencv': True, 'pyav': av is not None, 'ffmpeg': shutil.which('ffmpeg') is not None}
+
+
+class FramePool:
+    """
+    Recycles frame buffers instead of allocating a new array per frame.
+
+    A producer takes buffers with `acquire` and whoever is done with a
+    frame last hands it back with `release`, e.g. the decoder and the
+    encoder of a pipeline. Frames that are never released are simply
+    garbage collected, and `acquire` allocates when no free buffer of the
+    right shape is left, so a pool never blocks; it only saves allocations
+    when frames come back.
+    """
+    def __init__(self, max_free=256):
+        """
+        Args:
+            max_free: Most buffers kept for reuse; further released frames
+                are left to the garbage collector.
+        """
+        self.max_free = max_free
+        self.free = {}
+        self.lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self.lock:
+            buffers = self.free.get(key)
+            if buffers:
+                self.reused += 1
+                return buffers.pop()
+            self.allocated += 1
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, frame):
+        if frame is None or not frame.flags.owndata:
+            return
+        key = (frame.shape, frame.dtype.str)
+        with self.lock:
+            if sum(len(buffers) for buffers in self.free.values()) < self.max_free:
+                self.free.setdefault(key, []).append(frame)
+
+    def as_dict(self):
+        with self.lock:
+            return {'allocated': self.allocated, 'reused': self.reused,
+                    'free': sum(len(buffers) for buffers in self.free.values())}
+
+
+def _output_shape(width, height, scale, gray):
+    width, height = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+    return (height, width) if gray else (height, width, 3)
+
+
+class OpenCVReader:
+    """
+    Decodes with `cv2.VideoCapture`, straight into pooled buffers.
+    """
+    def __init__(self, path, start=0, stop=None, scale=1.0, gray=False, pool=None, seek_index=None):
+        """
+        Args:
+            path: Path to the video file.
+            start: Index of the first frame to read.
+            stop: Index one past the last frame to read. None reads to the end.
+            scale: Factor applied to the frames after decoding.
+            gray: Yield single-channel grayscale frames.
+            pool: Optional FramePool the frames are taken from.
+            seek_index: Optional SeekIndex of the video. The reader then
+                seeks to the keyframe before `start` and steps to `start`
+                itself, instead of relying on the container's seeking.
+        """
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self.scale = scale
+        self.gray = gray
+        self.pool = pool
+        self.seek_index = seek_index
+
+    def __iter__(self):
+        cap = cv2.VideoCapture(self.path)
+        if self.start and self.seek_index is not None:
+            keyframe = self.seek_index.keyframe_before(self.start)
+            cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+            # the frames before `start` are decoded but never converted to BGR
+            for _ in range(self.start - keyframe):
+                if not cap.grab():
+                    break
+        elif self.start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        converted = self.scale != 1.0 or self.gray
+        shape = _output_shape(width, height, self.scale, self.gray)
+        # decoded frames only pass through this buffer when they are converted afterwards
+        scratch = np.empty((height, width, 3), dtype=np.uint8) if converted else None
+        frame_num = self.start
+        try:
+            while self.stop is None or frame_num < self.stop:
+                if converted:
+                    ret, decoded = cap.read(scratch)
+                else:
+                    decoded = self.pool.acquire(shape) if self.pool is not None else None
+                    ret, decoded = cap.read(decoded)
+                if not ret:
+                    break
+                frame_num += 1
+                if not converted:
+                    yield decoded
+                    continue
+                frame = self.pool.acquire(shape) if self.pool is not None else None
+                if self.scale == 1.0:
+                    frame = cv2.cvtColor(decoded, cv2.COLOR_BGR2GRAY, dst=frame)
+                elif self.gray:
+                    frame = cv2.resize(cv2.cvtColor(decoded, cv2.COLOR_BGR2GRAY), shape[1::-1], dst=frame,
+                                       interpolation=cv2.INTER_AREA)
+                else:
+                    frame = cv2.resize(decoded, shape[1::-1], dst=frame, interpolation=cv2.INTER_AREA)
+                yield frame
+        finally:
+            cap.release()
+
+
+class PyAVReader:
+    """
+    Decodes with PyAV (FFmpeg's libraries in process), with frame-threaded
+    decoding. Scaling and the grayscale conversion are done by libswscale
+    on the decoded YUV frame, so a grayscale frame only reads the luma
+    plane and never goes through BGR. Frames are returned by PyAV, so no
+    pool is used.
+    """
+    def __init__(self, path, start=0, stop=None, scale=1.0, gray=False, pool=None, threads=0, seek_index=None):
+        """
+        Args:
+            path, start, stop, scale, gray: As for OpenCVReader.
+            pool: Ignored.
+            threads: Decoder threads, 0 lets FFmpeg choose.
+            seek_index: Optional SeekIndex of the video. Seeks then go to
+                the exact keyframe before `start`, and frames are numbered
+                from their timestamps rather than from the nominal frame
+                rate, which variable frame rate videos need.
+        """
+        if av is None:
+            raise RuntimeError("The 'pyav' video backend needs PyAV: pip install av")
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self.scale = scale
+        self.gray = gray
+        self.threads = threads
+        self.seek_index = seek_index
+
+    def __iter__(self):
+        container = av.open(self.path)
+        try:
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'
+            stream.thread_count = self.threads
+            height, width = _output_shape(stream.codec_context.width, stream.codec_context.height, self.scale,
+                                          True)
+            fps = float(stream.average_rate or 24)
+            start_time = stream.start_time or 0
+            if self.start:
+                # seek to the keyframe before `start`, then decode up to it
+                seconds = self.start / fps if self.seek_index is None else \
+                    self.seek_index.timestamp(self.seek_index.keyframe_before(self.start))
+                container.seek(int(round(seconds / stream.time_base)) + start_time, stream=stream)
+            frame_num = None
+            for decoded in container.decode(stream):
+                if frame_num is None:
+                    if decoded.pts is None:
+                        frame_num = self.start
+                    elif self.seek_index is not None:
+                        frame_num = self.seek_index.frame_at(float((decoded.pts - start_time) * stream.time_base))
+                    else:
+                        frame_num = int(round((decoded.pts - start_time) * stream.time_base * fps))
+                if self.stop is not None and frame_num >= self.stop:
+                    break
+                if frame_num >= self.start:
+                    yield decoded.reformat(width=width, height=height,
+                                           format='gray' if self.gray else 'bgr24').to_ndarray()
+                frame_num += 1
+        finally:
+            container.close()
+
+
+class FFmpegReader:
+    """
+    Decodes in an `ffmpeg` subprocess that writes raw frames to a pipe,
+    optionally on a hardware decoder. Scaling and the grayscale conversion
+    happen inside FFmpeg, and every frame is read straight from the pipe
+    into a pooled buffer.
+    """
+    def __init__(self, path, start=0, stop=None, scale=1.0, gray=False, pool=None, threads=0, hwaccel=None,
+                 ffmpeg='ffmpeg', seek_index=None):
+        """
+        Args:
+            path, start, stop, scale, gray, pool: As for OpenCVReader.
+            threads: Decoder threads, 0 lets FFmpeg choose.
+            hwaccel: FFmpeg hardware decoder, e.g. 'cuda', 'qsv' or 'auto'.
+            ffmpeg: Name or path of the ffmpeg executable.
+            seek_index: Optional SeekIndex of the video giving the exact
+                timestamp of `start`, which variable frame rate videos need.
+        """
+        self.ffmpeg = shutil.which(ffmpeg)
+        if self.ffmpeg is None:
+            raise RuntimeError(f"The 'ffmpeg' video backend needs the {ffmpeg!r} executable on the PATH")
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self.scale = scale
+        self.gray = gray
+        self.pool = pool
+        self.threads = threads
+        self.hwaccel = hwaccel
+        self.seek_index = seek_index
+
+    def command(self, width, height, fps):
+        command = [self.ffmpeg, '-loglevel', 'error', '-nostdin']
+        if self.hwaccel:
+            command += ['-hwaccel', self.hwaccel]
+        if self.start:
+            seconds = self.start / fps if self.seek_index is None else self.seek_index.timestamp(self.start)
+            command += ['-ss', f'{seconds:.6f}']
+        command += ['-threads', str(self.threads), '-i', self.path, '-map', '0:v:0']
+        if self.stop is not None:
+            command += ['-frames:v', str(self.stop - self.start)]
+        if self.scale != 1.0:
+            command += ['-vf', f'scale={width}:{height}:flags=area']
+        return command + ['-f', 'rawvideo', '-pix_fmt', 'gray' if self.gray else 'bgr24', 'pipe:1']
+
+    def __iter__(self):
+        cap = cv2.VideoCapture(self.path)
+        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 24
+        cap.release()
+        shape = _output_shape(width, height, self.scale, self.gray)
+        process = subprocess.Popen(self.command(shape[1], shape[0], fps), stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL, bufsize=0)
+        try:
+            while True:
+                frame = self.pool.acquire(shape) if self.pool is not None else np.empty(shape, dtype=np.uint8)
+                if not self._read_into(process.stdout, memoryview(frame).cast('B')):
+                    if self.pool is not None:
+                        self.pool.release(frame)
+                    break
+                yield frame
+        finally:
+            process.kill()
+            process.wait()
+            process.stdout.close()
+
+    @staticmethod
+    def _read_into(pipe, view):
+        filled = 0
+        while filled < len(view):
+            count = pipe.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+        return True
+
+
+class OpenCVWriter:
+    """
+    Encodes with `cv2.VideoWriter`.
+    """
+    def __init__(self, path, fps, size, fourcc='XVID'):
+        """
+        Args:
+            path: Path of the output video file.
+            fps: Frames per second of the output video.
+            size: (width, height) of the frames.
+            fourcc: FourCC code of the output codec.
+        """
+        self.path = path
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, tuple(size))
+
+    def write(self, frame):
+        self.writer.write(frame)
+
+    def close(self):
+        self.writer.release()
+
+
+class FFmpegWriter:
+    """
+    Encodes in an `ffmpeg` subprocess fed with raw BGR frames through a
+    pipe, e.g. to H.264 with libx264 or a hardware encoder such as
+    'h264_nvenc'. Frames are written to the pipe from their own memory,
+    without a copy.
+    """
+    def __init__(self, path, fps, size, codec='libx264', preset='veryfast', crf=23, pix_fmt='yuv420p',
+                 ffmpeg='ffmpeg'):
+        """
+        Args:
+            path: Path of the output video file; its extension picks the
+                container.
+            fps: Frames per second of the output video.
+            size: (width, height) of the frames.
+            codec: FFmpeg video encoder.
+            preset: Encoder preset, None for the encoder's default.
+            crf: Constant rate factor, None for the encoder's default.
+            pix_fmt: Pixel format of the encoded video.
+            ffmpeg: Name or path of the ffmpeg executable.
+        """
+        executable = shutil.which(ffmpeg)
+        if executable is None:
+            raise RuntimeError(f"The 'ffmpeg' video backend needs the {ffmpeg!r} executable on the PATH")
+        self.path = path
+        width, height = size
+        command = [executable, '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+                   '-s', f'{width}x{height}', '-r', str(fps), '-i', 'pipe:0', '-c:v', codec]
+        if preset:
+            command += ['-preset', preset]
+        if crf is not None:
+            command += ['-crf', str(crf)]
+        # yuv420p needs even dimensions
+        command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', pix_fmt, path]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame):
+        self.process.stdin.write(memoryview(np.ascontiguousarray(frame)).cast('B'))
+
+    def close(self):
+        self.process.stdin.close()
+        error = self.process.stderr.read()
+        self.process.stderr.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {self.path}: {error.decode(errors='replace').strip()}")
+
+
+READERS = {'opencv': OpenCVReader, 'pyav': PyAVReader, 'ffmpeg': FFmpegReader}
+WRITERS = {'opencv': OpenCVWriter, 'ffmpeg': FFmpegWriter}
+
+
+def open_video_reader(path, backend='opencv', **options):
+    """
+    Frame iterable over a video file decoded by `backend`.
+    Args:
+        path: Path to the video file.
+        backend: One of READERS: 'opencv', 'pyav' or 'ffmpeg'.
+        **options: Reader arguments: start, stop, scale, gray, pool and the
+            backend's own options.
+    """
+    if backend not in READERS:
+        raise ValueError(f"Unknown video backend {backend!r}, expected one of {sorted(READERS)}")
+    return READERS[backend](path, **options)
+
+
+def open_video_writer(path, fps, size, backend='opencv', **options):
+    """
+    Writer with `write(frame)` and `close()` encoding with `backend`.
+    Args:
+        path: Path of the output video file.
+        fps: Frames per second of the output video.
+        size: (width, height) of the frames.
+        backend: One of WRITERS: 'opencv' or 'ffmpeg'.
+        **options: The backend's own options, e.g. fourcc or codec.
+    """
+    if backend not in WRITERS:
+        raise ValueError(f"Unknown video backend {backend!r}, expected one of {sorted(WRITERS)}")
+    return WRITERS[backend](path, fps, size, **options)
@@ -1,4 +1,6 @@
 import cv2
+from itertools import chain, islice
+from .video_backends import open_video_reader, open_video_writer
 
 def read_video(path):
     """
@@ -16,39 +18,167 @@ def read_video(path):
         (height, width, channels) and dtype uint8.
     """
     
-    cap = cv2.VideoCapture(path)
-    frames = []
+    return list(iter_video(path))
+
+
+def iter_video(path, start=0, stop=None, backend='opencv', **options):
+    """
+    Lazily reads a video from file, yielding one frame at a time.
+
+    Only the frame currently being consumed is held in memory, so this is
+    the reader to use for full-length matches.
+
+    Parameters
+    ----------
+    path : str
+        The path to the video file.
+    start : int, optional
+        Index of the first frame to read. The decoder seeks to it; with
+        codecs whose seeking is not frame-accurate, re-encode the video
+        with regular keyframes before reading ranges of it.
+    stop : int, optional
+        Index one past the last frame to read. Default reads to the end.
+    backend : str, optional
+        Decoder, one of 'opencv' (default), 'pyav' or 'ffmpeg'.
+    **options
+        Further reader options, e.g. `scale=0.5` or `gray=True` to decode
+        reduced or grayscale frames, or a `pool` to take the frames from.
+        See `utils.video_backends`.
+
+    Yields
+    ------
+    frame : numpy array
+        A frame of shape (height, width, channels), or (height, width) when
+        grayscale, and dtype uint8.
+    """
+
+    yield from open_video_reader(path, backend, start=start, stop=stop, **options)
+
+
+def iter_chunks(frames, chunk_size):
+    """
+    Groups an iterable of frames into lists of at most `chunk_size` frames.
+
+    Parameters
+    ----------
+    frames : iterable of numpy arrays
+        The frames to group, e.g. the output of `iter_video`.
+    chunk_size : int
+        The maximum number of frames per chunk.
+
+    Yields
+    ------
+    chunk : list of numpy arrays
+        The next chunk of frames. Only the last chunk may be shorter.
+    """
+
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1.")
+
+    frames = iter(frames)
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        chunk = list(islice(frames, chunk_size))
+        if not chunk:
             break
-        frames.append(frame)
-    return frames
+        yield chunk
 
 
-def write_video(frames, path, fps=24):
+def get_frame_count(path):
     """
-    Writes a list of frames to a video file.
+    Reads the number of frames stored in a video file's header.
 
     Parameters
     ----------
-    frames : list of numpy arrays
-        A list of frames, where each frame is a numpy array of shape
-        (height, width, channels) and dtype uint8.
+    path : str
+        The path to the video file.
+
+    Returns
+    -------
+    count : int
+        Number of frames, or 0 when the container does not report it.
+    """
+
+    cap = cv2.VideoCapture(path)
+    count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return max(count, 0)
+
+
+def get_frame_size(path):
+    """
+    Reads the frame size stored in a video file's header.
+
+    Parameters
+    ----------
+    path : str
+        The path to the video file.
+
+    Returns
+    -------
+    size : tuple of int
+        (width, height) of the frames, (0, 0) when it cannot be read.
+    """
+
+    cap = cv2.VideoCapture(path)
+    size = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    return size if min(size) > 0 else (0, 0)
+
+
+def get_video_fps(path, default=24):
+    """
+    Reads the frame rate stored in a video file's header.
+
+    Parameters
+    ----------
+    path : str
+        The path to the video file.
+    default : float, optional
+        Value returned when the container does not report a frame rate.
+
+    Returns
+    -------
+    fps : float
+        Frames per second of the video.
+    """
+
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps if fps and fps > 0 else default
+
+
+def write_video(frames, path, fps=24, backend='opencv', **options):
+    """
+    Writes a sequence of frames to a video file.
+
+    Parameters
+    ----------
+    frames : iterable of numpy arrays
+        A list or generator of frames, where each frame is a numpy array of
+        shape (height, width, channels) and dtype uint8. Generators are
+        consumed lazily, so frames are written as soon as they are produced.
     path : str
         The path to save the video file.
     fps : int, optional
-        Frames per second for the output video. Default is 30.
+        Frames per second for the output video. Default is 24.
+    backend : str, optional
+        Encoder, 'opencv' (default, XVID) or 'ffmpeg' (H.264 through a pipe).
+    **options
+        Further writer options, e.g. `fourcc` or `codec`. See
+        `utils.video_backends`.
     """
     
-    if not frames:
+    frames = iter(frames)
+    first_frame = next(frames, None)
+    if first_frame is None:
         raise ValueError("The list of frames is empty.")
     
-    height, width, layers = frames[0].shape
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')
-    out = cv2.VideoWriter(path, fourcc, fps, (width, height))
-    
-    for frame in frames:
-        out.write(frame)
+    height, width = first_frame.shape[:2]
+    out = open_video_writer(path, fps, (width, height), backend, **options)
     
-    out.release()
\ No newline at end of file
+    try:
+        for frame in chain([first_frame], frames):
+            out.write(frame)
+    finally:
+        out.close()
@@ -1,5 +1,6 @@
 import cv2
 import numpy as np
+from utils import as_track_table
 
 class ViewTransformer():
     def __init__(self):
@@ -35,16 +36,112 @@ class ViewTransformer():
         
         return transformed_point.reshape(-1, 2)
     
-    def add_transformed_position_to_tracks(self, tracks):
-        for obj, obj_tracks in tracks.items():
-            for frame_num, track in enumerate(obj_tracks):
-                for track_id, track_data in track.items():
-                    position = track_data['position_adjusted']
-                    position = np.array(position)
-                    position_transformed = self.transform_point(position)
-                    if position_transformed is not None:
-                        position_transformed = position_transformed.squeeze()
-                    tracks[obj][frame_num][track_id]['position_transformed'] = position_transformed
-
-
-                    
\ No newline at end of file
+    def points_inside(self, points):
+        """
+        Vectorized even-odd test of which points lie inside the pixel polygon.
+        Args:
+            points: (N, 2) array of pixel positions.
+
+        Returns:
+            Boolean array of shape (N,).
+        """
+        points = np.trunc(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+        x = points[:, 0:1]
+        y = points[:, 1:2]
+        x1, y1 = self.pixel_verticies[:, 0], self.pixel_verticies[:, 1]
+        x2, y2 = np.roll(self.pixel_verticies, -1, axis=0).T
+        crosses = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_intersection = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        return np.count_nonzero(crosses & (x < x_intersection), axis=1) % 2 == 1
+
+    @staticmethod
+    def apply_homography(points, homography):
+        """
+        Apply one homography, or one per point, to many points at once.
+        Args:
+            points: (N, 2) array of points.
+            homography: (3, 3) matrix, or (N, 3, 3) with one matrix per point.
+
+        Returns:
+            (N, 2) float64 array of mapped points.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        homography = np.asarray(homography, dtype=np.float64)
+        homogeneous = np.concatenate([points, np.ones((len(points), 1))], axis=1)
+        if homography.ndim == 2:
+            mapped = homogeneous @ homography.T
+        else:
+            mapped = np.einsum('nij,nj->ni', homography, homogeneous)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return mapped[:, :2] / mapped[:, 2:3]
+
+    @staticmethod
+    def accumulate_camera_transforms(camera_transforms, initial=None):
+        """
+        Chain per-frame camera transforms into reference-to-frame maps.
+
+        The running product is computed with a log-step prefix scan, so the
+        cost is a handful of batched matrix products rather than a Python
+        loop over frames.
+        Args:
+            camera_transforms: (N, 3, 3) transforms mapping each frame's
+                previous frame to it, e.g. from
+                `CameraMovementEstimator.get_camera_transforms_chunk`.
+            initial: Reference-to-frame map of the frame preceding the first
+                one, to continue the chain across chunks.
+
+        Returns:
+            (N, 3, 3) float64 maps from reference-frame pixels to each frame.
+        """
+        cumulative = np.array(camera_transforms, dtype=np.float64).reshape(-1, 3, 3)
+        if initial is not None and len(cumulative):
+            cumulative[0] = cumulative[0] @ initial
+        step = 1
+        while step < len(cumulative):
+            cumulative[step:] = cumulative[step:] @ cumulative[:-step]
+            step *= 2
+        return cumulative
+
+    def transform_points(self, points, frame_homographies=None):
+        """
+        Transform many pixel positions to court coordinates in one call.
+        Args:
+            points: (N, 2) array of pixel positions. NaN rows are allowed.
+            frame_homographies: Optional (3, 3) matrix, or (N, 3, 3) with one
+                per point, mapping each point's frame to the frame the court
+                vertices were calibrated on. Use it to follow camera motion.
+
+        Returns:
+            (N, 2) float32 array of court positions, NaN for points outside
+            the calibrated area.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if frame_homographies is not None:
+            points = self.apply_homography(points, frame_homographies)
+        transformed = np.full(points.shape, np.nan, dtype=np.float32)
+        inside = self.points_inside(points)
+        if inside.any():
+            transformed[inside] = self.apply_homography(points[inside], self.prespective_transform_matrix)
+        return transformed
+
+    def add_transformed_position_to_tracks(self, tracks, frame_homographies=None):
+        """
+        Add the court position of every row.
+
+        Without `frame_homographies` the camera-adjusted positions are
+        transformed. With them, the raw positions are mapped through their
+        frame's homography first, which compensates camera motion exactly.
+        Args:
+            tracks: A TrackTable or the legacy dict of per-frame track lists.
+            frame_homographies: Optional (num_frames, 3, 3) frame-to-reference
+                maps, e.g. the inverse of `accumulate_camera_transforms`.
+        """
+        table = as_track_table(tracks)
+        if frame_homographies is None:
+            transformed = self.transform_points(table.position_adjusted)
+        else:
+            frame_homographies = np.asarray(frame_homographies, dtype=np.float64).reshape(-1, 3, 3)
+            transformed = self.transform_points(table.position, frame_homographies[table.frame])
+        table.set_column('position_transformed', transformed)
+        table.write_back(tracks, ['position_transformed'])